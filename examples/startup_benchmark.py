@@ -0,0 +1,45 @@
+# Description:
+# This script measures the wake-to-transmit latency of a battery node: the time
+# spent importing the library, in begin() and in sending the first message.
+# The first run stores the fingerprint of the configuration in the NVM, the
+# following runs (after a reset or a deep sleep) skip the configuration check.
+#
+# Note: This code was written and tested using CircuitPython on an RPi Pico board.
+#       It works with other boards, but you may need to change the UART pins.
+
+import time
+
+start = time.monotonic_ns()
+
+import microcontroller
+from busio import UART
+
+from examples.example_config import (
+    LORA_AUX,
+    LORA_M0,
+    LORA_M1,
+    MODULE_MODEL,
+    UART_RX,
+    UART_TX,
+)
+from lora_e220 import Configuration, LoRaE220, NvmFingerprintStore
+from lora_e220_operation_constant import ResponseStatusCode
+
+imported = time.monotonic_ns()
+
+uart = UART(UART_TX, UART_RX, baudrate=9600)
+lora = LoRaE220(MODULE_MODEL, uart, aux_pin=LORA_AUX, m0_pin=LORA_M0, m1_pin=LORA_M1)
+
+configuration = Configuration(MODULE_MODEL)
+code = lora.begin(configuration, NvmFingerprintStore(microcontroller.nvm))
+started = time.monotonic_ns()
+
+code_send = lora.send_transparent_message(b"\x01\x02\x03\x04")
+sent = time.monotonic_ns()
+
+print("Initialization: {}".format(ResponseStatusCode.get_description(code)))
+print("Send message: {}".format(ResponseStatusCode.get_description(code_send)))
+print("import : {} ms".format((imported - start) // 1000000))
+print("begin  : {} ms".format((started - imported) // 1000000))
+print("send   : {} ms".format((sent - started) // 1000000))
+print("total  : {} ms".format((sent - start) // 1000000))
@@ -6,7 +6,24 @@ from setuptools import setup
 setup(
     name="ebyte-lora-e220",
     package_dir={"": "src"},
-    py_modules=["lora_e220", "lora_e220_constants", "lora_e220_operation_constant"],
+    py_modules=[
+        "lora_e220",
+        "lora_e220_adr",
+        "lora_e220_backoff",
+        "lora_e220_constants",
+        "lora_e220_dedup",
+        "lora_e220_energy",
+        "lora_e220_gateway",
+        "lora_e220_link",
+        "lora_e220_mesh",
+        "lora_e220_operation_constant",
+        "lora_e220_rpc",
+        "lora_e220_store",
+        "lora_e220_tdma",
+        "lora_e220_telemetry",
+        "lora_e220_transfer",
+        "lora_e220_wor",
+    ],
     version="0.0.3",
     description="LoRa EBYTE E220 device library complete and tested with Arduino, esp8266, esp32, STM32 and Raspberry Pi Pico. LLCC68",
     long_description="Ebyte E220 LoRa (Long Range) library device very cheap and very long range (from 5Km to 10Km). Arduino LoRa EBYTE E220 device library complete and tested with Arduino, esp8266, esp32, STM32 and Raspberry Pi Pico. LLCC68",
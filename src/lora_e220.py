@@ -35,25 +35,23 @@
 # THE SOFTWARE.
 #############################################################################################
 
-import json
-import re
+from collections import namedtuple
 
 import adafruit_ticks as ticks
-import busio
 import digitalio
 
 from lora_e220_constants import (
     AirDataRate,
     FixedTransmission,
     LbtEnableByte,
-    OperatingFrequency,
     RssiAmbientNoiseEnable,
     RssiEnableByte,
     SubPacketSetting,
-    TransmissionPower,
+    TransmissionPower22,
     UARTBaudRate,
     UARTParity,
     WorPeriod,
+    get_model_capabilities,
 )
 from lora_e220_operation_constant import (
     ModeType,
@@ -61,9 +59,13 @@ from lora_e220_operation_constant import (
     ProgramCommand,
     RegisterAddress,
     ResponseStatusCode,
+    RssiRegister,
     SerialUARTBaudRate,
 )
 
+# json and busio are imported where they are used, so a node that wakes up
+# only to send a binary payload does not pay for importing them
+
 
 class Logger:
     def __init__(self, enable_debug):
@@ -94,13 +96,59 @@ logger = logging.getLogger(__name__)
 BROADCAST_ADDRESS = 0xFF
 
 
+# Layout of the 11 bytes of the configuration as read/written on the UART:
+# COMMAND, STARTING_ADDRESS, LENGTH, ADDH, ADDL, SPED, OPTION, CHAN,
+# TRANSMISSION_MODE, CRYPT_H, CRYPT_L
+CONFIGURATION_SIZE = 11
+
+# CHAN 23, 9600bps 8N1, air data rate 2.4kbps, WOR period 2000ms, all the
+# options disabled (the default of every transmission power table is 0b00)
+# ADDH, ADDL, SPED, OPTION, CHAN, TRANSMISSION_MODE (CRYPT is write only)
+CONFIGURATION_FINGERPRINT_SIZE = 6
+
+_DEFAULT_CONFIGURATION = b"\x00\x00\x00\x00\x00\x62\x00\x17\x03\x00\x00"
+
+
+def _power_table(model):
+    if model is None:
+        return TransmissionPower22
+    return get_model_capabilities(model).power_table
+
+
+def _byte_field(index):
+    def getter(self):
+        return self._buffer[index]
+
+    def setter(self, value):
+        self._buffer[index] = value & 0xFF
+
+    return property(getter, setter)
+
+
+def _bit_field(index, shift, mask):
+    def getter(self):
+        return (self._buffer[index] >> shift) & mask
+
+    def setter(self, value):
+        self._buffer[index] = (self._buffer[index] & ~(mask << shift) & 0xFF) | (
+            (value & mask) << shift
+        )
+
+    return property(getter, setter)
+
+
+# The register views read and write the bits directly in the buffer of the
+# configuration they belong to, created alone they get their own buffer
 class Speed:
-    def __init__(self, model):
+    __slots__ = ("model", "_buffer")
+
+    def __init__(self, model, buffer=None):
         self.model = model
+        self._buffer = bytearray(_DEFAULT_CONFIGURATION) if buffer is None else buffer
 
-        self.airDataRate = AirDataRate.AIR_DATA_RATE_010_24
-        self.uartBaudRate = UARTBaudRate.BPS_9600
-        self.uartParity = UARTParity.MODE_00_8N1
+    airDataRate = _bit_field(5, 0, 0b111)
+    uartParity = _bit_field(5, 3, 0b11)
+    uartBaudRate = _bit_field(5, 5, 0b111)
 
     def get_air_data_rate(self):
         return AirDataRate.get_description(self.airDataRate)
@@ -113,15 +161,18 @@ class Speed:
 
 
 class TransmissionMode:
-    def __init__(self, model):
+    __slots__ = ("model", "_buffer")
+
+    def __init__(self, model, buffer=None):
         self.model = model
+        self._buffer = bytearray(_DEFAULT_CONFIGURATION) if buffer is None else buffer
 
-        self.WORPeriod = WorPeriod.WOR_2000_011
-        self.reserved2 = 0
-        self.enableLBT = LbtEnableByte.LBT_DISABLED
-        self.reserved = 0
-        self.fixedTransmission = FixedTransmission.TRANSPARENT_TRANSMISSION
-        self.enableRSSI = RssiEnableByte.RSSI_DISABLED
+    WORPeriod = _bit_field(8, 0, 0b111)
+    reserved2 = _bit_field(8, 3, 0b1)
+    enableLBT = _bit_field(8, 4, 0b1)
+    reserved = _bit_field(8, 5, 0b1)
+    fixedTransmission = _bit_field(8, 6, 0b1)
+    enableRSSI = _bit_field(8, 7, 0b1)
 
     def get_WOR_period_description(self):
         return WorPeriod.get_description(self.WORPeriod)
@@ -137,20 +188,19 @@ class TransmissionMode:
 
 
 class Option:
-    def __init__(self, model):
+    __slots__ = ("model", "_buffer")
+
+    def __init__(self, model, buffer=None):
         self.model = model
+        self._buffer = bytearray(_DEFAULT_CONFIGURATION) if buffer is None else buffer
 
-        self.transmissionPower = (
-            TransmissionPower(self.model).get_transmission_power().get_default_value()
-        )
-        self.reserved = 0
-        self.RSSIAmbientNoise = RssiAmbientNoiseEnable.RSSI_AMBIENT_NOISE_DISABLED
-        self.subPacketSetting = SubPacketSetting.SPS_200_00
+    transmissionPower = _bit_field(6, 0, 0b11)
+    reserved = _bit_field(6, 2, 0b111)
+    RSSIAmbientNoise = _bit_field(6, 5, 0b1)
+    subPacketSetting = _bit_field(6, 6, 0b11)
 
     def get_transmission_power_description(self):
-        return TransmissionPower(self.model).get_transmission_power_description(
-            self.transmissionPower
-        )
+        return _power_table(self.model).get_description(self.transmissionPower)
 
     def get_RSSI_ambient_noise_enable(self):
         return RssiAmbientNoiseEnable.get_description(self.RSSIAmbientNoise)
@@ -160,34 +210,110 @@ class Option:
 
 
 class Crypt:
-    def __init__(self):
-        self.CRYPT_H = 0
-        self.CRYPT_L = 0
+    __slots__ = ("_buffer",)
+
+    def __init__(self, buffer=None):
+        self._buffer = bytearray(_DEFAULT_CONFIGURATION) if buffer is None else buffer
+
+    CRYPT_H = _byte_field(9)
+    CRYPT_L = _byte_field(10)
+
+
+# Immutable view of a configuration with the numeric values of the settings,
+# see Configuration.decode()
+DecodedConfiguration = namedtuple(
+    "DecodedConfiguration",
+    (
+        "ADDH",
+        "ADDL",
+        "channel",
+        "frequency_mhz",
+        "uart_parity",
+        "uart_baud_rate_bps",
+        "air_data_rate_bps",
+        "sub_packet_bytes",
+        "transmission_power_dbm",
+        "rssi_ambient_noise",
+        "wor_period_ms",
+        "lbt",
+        "fixed_transmission",
+        "rssi",
+    ),
+)
 
 
+# The configuration is kept packed in the 11 bytes exchanged with the module,
+# the registers views (SPED, OPTION, TRANSMISSION_MODE, CRYPT) are created on
+# first use. Pass a writable buffer (bytearray or memoryview) to decode it in
+# place without any copy.
 class Configuration:
-    def __init__(self, model):
-        self.model = model
-
-        self.package_type = None
-        self.frequency = None
-        self.transmission_power = None
+    __slots__ = (
+        "model",
+        "capabilities",
+        "_buffer",
+        "_sped",
+        "_option",
+        "_transmission_mode",
+        "_crypt",
+    )
 
+    def __init__(self, model, buffer=None):
+        self.model = model
+        self.capabilities = None
         if model is not None:
-            self.package_type = model[6]
-            self.frequency = int(model[0:3])
-            self.transmission_power = int(model[4:6])
-
-        self._COMMAND = 0
-        self._STARTING_ADDRESS = 0
-        self._LENGTH = 0
-        self.ADDH = 0
-        self.ADDL = 0
-        self.SPED = Speed(self.model)
-        self.OPTION = Option(self.model)
-        self.CHAN = 23
-        self.TRANSMISSION_MODE = TransmissionMode(self.model)
-        self.CRYPT = Crypt()
+            self.capabilities = get_model_capabilities(model)
+
+        if buffer is None:
+            buffer = bytearray(_DEFAULT_CONFIGURATION)
+        self._buffer = buffer
+
+        self._sped = None
+        self._option = None
+        self._transmission_mode = None
+        self._crypt = None
+
+    _COMMAND = _byte_field(0)
+    _STARTING_ADDRESS = _byte_field(1)
+    _LENGTH = _byte_field(2)
+    ADDH = _byte_field(3)
+    ADDL = _byte_field(4)
+    CHAN = _byte_field(7)
+
+    @property
+    def SPED(self):
+        if self._sped is None:
+            self._sped = Speed(self.model, self._buffer)
+        return self._sped
+
+    @property
+    def OPTION(self):
+        if self._option is None:
+            self._option = Option(self.model, self._buffer)
+        return self._option
+
+    @property
+    def TRANSMISSION_MODE(self):
+        if self._transmission_mode is None:
+            self._transmission_mode = TransmissionMode(self.model, self._buffer)
+        return self._transmission_mode
+
+    @property
+    def CRYPT(self):
+        if self._crypt is None:
+            self._crypt = Crypt(self._buffer)
+        return self._crypt
+
+    @property
+    def package_type(self):
+        return self.capabilities.package_type if self.capabilities else None
+
+    @property
+    def frequency(self):
+        return self.capabilities.frequency if self.capabilities else None
+
+    @property
+    def transmission_power(self):
+        return self.capabilities.max_power_dbm if self.capabilities else None
 
     def get_model(self):
         return self.model
@@ -199,69 +325,49 @@ class Configuration:
         return self.CHAN
 
     def get_frequency(self):
-        return OperatingFrequency.get_freq_from_channel(self.frequency, self.CHAN)
-
-    def get_model(self):
-        return self.model
+        return self.capabilities.base_frequency + self.CHAN
+
+    def get_buffer(self):
+        return self._buffer
+
+    def fingerprint(self):
+        return bytes(self._buffer[3 : 3 + CONFIGURATION_FINGERPRINT_SIZE])
+
+    def decode(self):
+        buffer = self._buffer
+        sped = buffer[5]
+        option = buffer[6]
+        mode = buffer[8]
+
+        return DecodedConfiguration(
+            buffer[3],
+            buffer[4],
+            buffer[7],
+            self.get_frequency() if self.capabilities else None,
+            (sped >> 3) & 0b11,
+            UARTBaudRate.get_bps((sped >> 5) & 0b111),
+            AirDataRate.get_bps(sped & 0b111),
+            SubPacketSetting.get_bytes((option >> 6) & 0b11),
+            _power_table(self.model).get_dbm(option & 0b11),
+            bool(option & 0b00100000),
+            WorPeriod.get_ms(mode & 0b111),
+            bool(mode & 0b00010000),
+            bool(mode & 0b01000000),
+            bool(mode & 0b10000000),
+        )
 
     def to_hex_string(self):
-        return "".join(["0x{:02X} ".format(x) for x in self.to_hex_array()])
+        return "".join(["0x{:02X} ".format(x) for x in self._buffer])
 
     def to_bytes(self):
-        hexarray = self.to_hex_array()
-        # Convert values to valid byte values
-        for i in range(len(hexarray)):
-            if hexarray[i] > 255:
-                hexarray[i] = hexarray[i] % 256
-
-        return bytes(hexarray)
+        return bytes(self._buffer)
 
     def from_hex_array(self, hex_array):
-        self._COMMAND = hex_array[0]
-        self._STARTING_ADDRESS = hex_array[1]
-        self._LENGTH = hex_array[2]
-        self.ADDH = hex_array[3]
-        self.ADDL = hex_array[4]
-
-        self.SPED.airDataRate = hex_array[5] & 0b00000111
-        self.SPED.uartParity = (hex_array[5] & 0b00011000) >> 3
-        self.SPED.uartBaudRate = (hex_array[5] & 0b11100000) >> 5
-
-        self.OPTION.transmissionPower = hex_array[6] & 0b00000011
-        self.OPTION.RSSIAmbientNoise = (hex_array[6] & 0b00100000) >> 5
-        self.OPTION.subPacketSetting = (hex_array[6] & 0b11000000) >> 6
-
-        self.CHAN = hex_array[7]
-
-        self.TRANSMISSION_MODE.WORPeriod = hex_array[8] & 0b00000111
-        self.TRANSMISSION_MODE.enableLBT = (hex_array[8] & 0b00010000) >> 4
-        self.TRANSMISSION_MODE.fixedTransmission = (hex_array[8] & 0b01000000) >> 6
-        self.TRANSMISSION_MODE.enableRSSI = (hex_array[8] & 0b10000000) >> 7
-
-        self.CRYPT.CRYPT_H = hex_array[9]
-        self.CRYPT.CRYPT_L = hex_array[10]
+        for i in range(CONFIGURATION_SIZE):
+            self._buffer[i] = hex_array[i] & 0xFF
 
     def to_hex_array(self):
-        return [
-            self._COMMAND,
-            self._STARTING_ADDRESS,
-            self._LENGTH,
-            self.ADDH,
-            self.ADDL,
-            self.SPED.airDataRate
-            | (self.SPED.uartParity << 3)
-            | (self.SPED.uartBaudRate << 5),
-            self.OPTION.transmissionPower
-            | (self.OPTION.RSSIAmbientNoise << 5)
-            | (self.OPTION.subPacketSetting << 6),
-            self.CHAN,
-            self.TRANSMISSION_MODE.WORPeriod
-            | (self.TRANSMISSION_MODE.enableLBT << 4)
-            | (self.TRANSMISSION_MODE.fixedTransmission << 6)
-            | (self.TRANSMISSION_MODE.enableRSSI << 7),
-            self.CRYPT.CRYPT_H,
-            self.CRYPT.CRYPT_L,
-        ]
+        return list(self._buffer)
 
     def from_hex_string(self, hex_string):
         self.from_hex_array(
@@ -269,7 +375,7 @@ class Configuration:
         )
 
     def from_bytes(self, bytes):
-        self.from_hex_array([x for x in bytes])
+        self.from_hex_array(bytes)
 
 
 def print_configuration(configuration):
@@ -355,6 +461,207 @@ def print_configuration(configuration):
 
 MAX_SIZE_TX_PACKET = 200
 
+# size of the transmit buffer of the module
+MODULE_BUFFER_SIZE = 400
+
+# the LoRa preamble and header are modeled as these more bytes on air
+AIRTIME_OVERHEAD_BYTES = 16
+
+
+# time on air of size bytes at the air data rate (an AirDataRate value)
+def get_airtime_ms(size, air_data_rate=AirDataRate.AIR_DATA_RATE_010_24):
+    return (size + AIRTIME_OVERHEAD_BYTES) * 8000 // AirDataRate.get_bps(
+        air_data_rate
+    ) + 1
+
+
+# the RSSI byte appended to the received messages (and read from the
+# registers) in dBm
+def get_rssi_dbm(rssi):
+    return -(256 - rssi)
+
+
+# time on air of a frame of size bytes split in sub packets of sub_packet bytes
+def get_frame_airtime_ms(size, air_data_rate, sub_packet):
+    packets = max(1, (size + sub_packet - 1) // sub_packet)
+    return get_airtime_ms(size + AIRTIME_OVERHEAD_BYTES * (packets - 1), air_data_rate)
+
+
+# time to transfer size bytes on the UART at baudrate (10 bits per byte)
+def get_uart_time_ms(size, baudrate):
+    return size * 10000 // baudrate + 1
+
+
+# the CRC trailer (CRC-16/CCITT-FALSE, big endian) appended to the payload
+# when LoRaE220.crc_trailer is set
+CRC16_SIZE = 2
+_CRC16_POLY = 0x1021
+
+
+def _crc16_table():
+    table = []
+    for byte in range(256):
+        crc = byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ _CRC16_POLY if crc & 0x8000 else crc << 1) & 0xFFFF
+        table.append(crc)
+    return table
+
+
+_CRC16_TABLE = _crc16_table()
+
+
+# CRC-16 of data (bytes, bytearray or a memoryview slice, never copied)
+def crc16(data, crc=0xFFFF) -> int:
+    table = _CRC16_TABLE
+    for byte in data:
+        crc = ((crc << 8) & 0xFF00) ^ table[(crc >> 8) ^ byte]
+    return crc
+
+
+# True if the last CRC16_SIZE bytes of frame are the CRC of the others
+def check_crc16(frame) -> bool:
+    size = len(frame) - CRC16_SIZE
+    if size <= 0:
+        return False
+    view = memoryview(frame)
+    return crc16(view[:size]) == (view[size] << 8) | view[size + 1]
+
+
+# the size of the first frame with a CRC trailer (followed by extra bytes,
+# the RSSI) of the frames merged in data, 0 if none is found
+def split_crc16(data, extra=0) -> int:
+    view = memoryview(data)
+    crc = 0xFFFF
+    for size in range(1, len(view) - CRC16_SIZE - extra):
+        crc = crc16(view[size - 1 : size], crc)
+        if crc == (view[size] << 8) | view[size + 1]:
+            return size + CRC16_SIZE + extra
+    return 0
+
+
+# the module works in the new mode 1 ms after AUX goes high, 2 ms are
+# recommended by the datasheet
+AUX_SETTLE_MS = 2
+# with no AUX pin a switch to or from the program mode (the module restarts
+# its UART) is modeled with this time, the other switches with AUX_SETTLE_MS
+PROGRAM_MODE_SWITCH_MS = 40
+# the longest time the AUX pin can stay low for a mode switch of an idle module
+MODE_SWITCH_TIMEOUT_MS = 200
+# the listen before talk defers a transmission at most this time
+LBT_MAX_DEFER_MS = 2000
+# added to the modeled busy time for the timeout of the waits on the AUX pin
+WAIT_MARGIN_MS = 50
+
+# baud rates tried by probe_uart_settings, the most likely first: 9600 is the
+# only one documented for the program mode, then the fastest ones
+PROBE_BAUD_RATES = (
+    SerialUARTBaudRate.BPS_RATE_9600,
+    SerialUARTBaudRate.BPS_RATE_115200,
+    SerialUARTBaudRate.BPS_RATE_57600,
+    SerialUARTBaudRate.BPS_RATE_38400,
+    SerialUARTBaudRate.BPS_RATE_19200,
+    SerialUARTBaudRate.BPS_RATE_4800,
+    SerialUARTBaudRate.BPS_RATE_2400,
+    SerialUARTBaudRate.BPS_RATE_1200,
+)
+
+# result of probe_uart_settings: the baud rate that answered in program mode
+# and the data UART settings (bps and UARTParity) read from the SPED register
+UARTSettings = namedtuple("UARTSettings", ("program_baudrate", "baudrate", "parity"))
+
+
+class Statistics:
+    def __init__(self):
+        self.tx_messages = 0
+        self.tx_bytes = 0
+        self.rx_messages = 0
+        self.rx_bytes = 0
+        self.errors = 0
+        # frames dropped for a wrong CRC trailer, and messages that are not
+        # valid JSON for receive_dict()
+        self.corrupt = 0
+        self.parse_errors = 0
+        self.waits = 0
+        self.timeouts = 0
+        # budget and duration of the last wait on the module, and the largest
+        # percentage of the budget used by a wait
+        self.wait_budget_ms = 0
+        self.wait_ms = 0
+        self.wait_usage_max = 0
+
+    def add(self, other):
+        self.tx_messages += other.tx_messages
+        self.tx_bytes += other.tx_bytes
+        self.rx_messages += other.rx_messages
+        self.rx_bytes += other.rx_bytes
+        self.errors += other.errors
+        self.corrupt += other.corrupt
+        self.parse_errors += other.parse_errors
+        self.waits += other.waits
+        self.timeouts += other.timeouts
+        self.wait_budget_ms = max(self.wait_budget_ms, other.wait_budget_ms)
+        self.wait_ms = max(self.wait_ms, other.wait_ms)
+        self.wait_usage_max = max(self.wait_usage_max, other.wait_usage_max)
+        return self
+
+    def add_wait(self, budget, elapsed, timeout=False):
+        self.waits += 1
+        if timeout:
+            self.timeouts += 1
+        self.wait_budget_ms = budget
+        self.wait_ms = elapsed
+        if budget > 0:
+            self.wait_usage_max = max(self.wait_usage_max, elapsed * 100 // budget)
+
+    def reset(self):
+        self.__init__()
+
+
+# The fingerprint stores keep the fingerprint of the last configuration
+# verified on the module, so begin() can skip reading it back at every wake
+# up. On CircuitPython the filesystem is writable from the code only if
+# boot.py remounts it, otherwise use the NVM store.
+class FileFingerprintStore:
+    def __init__(self, path="/lora_e220.fp"):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path, "rb") as file:
+                return file.read()
+        except OSError:
+            return None
+
+    def save(self, fingerprint):
+        with open(self.path, "wb") as file:
+            file.write(fingerprint)
+
+    def clear(self):
+        self.save(b"")
+
+
+class NvmFingerprintStore:
+    # nvm is microcontroller.nvm (or any bytearray like object), the store
+    # uses a length byte and the fingerprint starting at offset
+    def __init__(self, nvm, offset=0, size=CONFIGURATION_FINGERPRINT_SIZE):
+        self.nvm = nvm
+        self.offset = offset
+        self.size = size
+
+    def load(self):
+        size = self.nvm[self.offset]
+        if size != self.size:
+            return None
+        return bytes(self.nvm[self.offset + 1 : self.offset + 1 + size])
+
+    def save(self, fingerprint):
+        self.nvm[self.offset + 1 : self.offset + 1 + len(fingerprint)] = fingerprint
+        self.nvm[self.offset] = len(fingerprint)
+
+    def clear(self):
+        self.nvm[self.offset] = 0
+
 
 class ModuleInformation:
     def __init__(self):
@@ -398,6 +705,85 @@ class ModuleInformation:
         self.from_hex_array([x for x in bytes])
 
 
+# size in bytes of a str or of a buffer of bytes (bytes, bytearray, a
+# memoryview on them): the buffers with bigger items are not supported
+def payload_size(message):
+    if isinstance(message, str):
+        return len(message.encode("utf-8"))
+    return len(message)
+
+
+# A fixed transmission destination with a preallocated transmit buffer where
+# the 3 bytes header (ADDH, ADDL, CHAN) is already written, so a send only
+# copies the payload after it and writes the whole frame with a single UART
+# write of a memoryview on the buffer
+class Destination:
+    def __init__(self, ADDH, ADDL, CHAN):
+        # same payload limit checked by LoRaE220._send_message
+        self._buffer = bytearray(3 + MAX_SIZE_TX_PACKET + 2)
+        self._view = memoryview(self._buffer)
+        # where the payload of send_into can be serialized in place
+        self.payload = self._view[3:]
+        self.set_address(ADDH, ADDL, CHAN)
+
+    def set_address(self, ADDH, ADDL, CHAN):
+        self._buffer[0] = ADDH
+        self._buffer[1] = ADDL
+        self._buffer[2] = CHAN
+
+    @property
+    def ADDH(self):
+        return self._buffer[0]
+
+    @property
+    def ADDL(self):
+        return self._buffer[1]
+
+    @property
+    def CHAN(self):
+        return self._buffer[2]
+
+    def frame(self, message):
+        if isinstance(message, str):
+            message = message.encode("utf-8")
+
+        size = len(message)
+        if size > len(self.payload):
+            return None
+
+        self._buffer[3 : 3 + size] = message
+        return self._view[: 3 + size]
+
+    def prepared_frame(self, size):
+        if size < 0 or size > len(self.payload):
+            return None
+        return self._view[: 3 + size]
+
+
+# A received message, the payload is a memoryview on the packet received
+class Message:
+    __slots__ = ("payload", "rssi", "source", "timestamp", "sequence")
+
+    def __init__(self, payload, rssi=None, source=None, timestamp=None, sequence=None):
+        self.payload = payload
+        self.rssi = rssi
+        self.source = source
+        self.timestamp = timestamp
+        # set by the link layer (lora_e220_link) from the header
+        self.sequence = sequence
+
+    def __len__(self):
+        return len(self.payload)
+
+    def decode(self):
+        return str(self.payload, "utf-8")
+
+    def to_dict(self):
+        import json
+
+        return json.loads(self.decode())
+
+
 class LoRaE220:
     # now the constructor that receive directly the UART object
     def __init__(
@@ -408,15 +794,12 @@ class LoRaE220:
         m0_pin=None,
         m1_pin=None,
         uart_baudrate=SerialUARTBaudRate.BPS_RATE_9600,
+        uart_parity=UARTParity.MODE_00_8N1,
     ):
         self.uart = uart
         self.model = model
-
-        pattern = "^(230|400|900)(T|R|MM|M)(22|30)[SD]$"
-
-        model_regex = re.compile(pattern)
-        if not model_regex.match(model):
-            raise ValueError("Invalid model")
+        # raises ValueError for an invalid model
+        self.capabilities = get_model_capabilities(model)
 
         self.aux_pin = aux_pin
         self.m0_pin = m0_pin
@@ -426,25 +809,56 @@ class LoRaE220:
         self.m0 = None
         self.m1 = None
 
+        # baud rate and parity of the data path (normal and WOR modes), in
+        # program mode the UART is switched to 9600 8N1
         self.uart_baudrate = uart_baudrate
+        self.uart_parity = uart_parity
         self.mode = None
+        # the last configuration read from or written to the module, used for
+        # the timings (air data rate, sub packet size)
+        self.configuration = None
+
+        self.stats = Statistics()
+        # an EnergyMeter (lora_e220_energy) attaches itself here
+        self.energy = None
+        # a DuplicateCache (lora_e220_dedup) to drop the messages received twice
+        self.dedup = None
+        # append a CRC-16 to the payload of the messages sent and check it
+        # (and strip it) on the ones received; the peers must set it too
+        self.crc_trailer = False
+        # the packets drained from the UART and not consumed yet, as (packet,
+        # timestamp of its last byte): with max_rx_packets queued the data is
+        # left in the UART buffer
+        self.max_rx_packets = 8
+        self._rx_packets = []
+        # the packet being drained and the time its last byte was read
+        self._rx_partial = bytearray()
+        self._rx_last = None
+        # reused by the fixed and broadcast sends
+        self._destination = Destination(0, 0, 0)
+        # modeled end of the current operation of the module, used instead of
+        # the AUX pin to know when it is done and for the timeouts of the waits
+        self._busy_until = None
 
     # TODO is this even a good way to do it???
     @staticmethod
     def get_uart(tx, rx, *, baudrate=9600, uart_parity=UARTParity.MODE_00_8N1):
+        import busio
+
         return busio.UART(
             tx, rx, baudrate=baudrate, parity=UARTParity.get_uart_value(uart_parity)
         )
 
-    def begin(self):
+    # with a configuration begin() makes sure the module uses it, with a
+    # fingerprint store the check is done only when the configuration differs
+    # from the last one verified (so it is skipped on most of the wake ups)
+    def begin(self, configuration=None, fingerprint_store=None):
         self.uart.baudrate = self.uart_baudrate
 
         self.m0 = None
         self.m1 = None
         self.aux = None
-        if self.aux_pin is not None:
-            self.aux = digitalio.DigitalInOut(self.aux_pin)
-            self.aux.direction = digitalio.Direction.INPUT
+        self.claim_aux()
         if self.m0_pin is not None and self.m1_pin is not None:
             self.m0 = digitalio.DigitalInOut(self.m0_pin)
             self.m0.direction = digitalio.Direction.OUTPUT
@@ -460,10 +874,71 @@ class LoRaE220:
         if code != ResponseStatusCode.SUCCESS:
             return code
 
+        if configuration is not None:
+            code = self.ensure_configuration(configuration, fingerprint_store)
+
+        return code
+
+    # the AUX pin can be released to be used by an alarm (e.g. to wake up the
+    # host from a light sleep), meanwhile the driver works as without it
+    def release_aux(self):
+        if self.aux is not None:
+            self.aux.deinit()
+            self.aux = None
+
+    def claim_aux(self):
+        if self.aux is None and self.aux_pin is not None:
+            self.aux = digitalio.DigitalInOut(self.aux_pin)
+            self.aux.direction = digitalio.Direction.INPUT
+
+    def ensure_configuration(
+        self, configuration, fingerprint_store=None
+    ) -> ResponseStatusCode:
+        fingerprint = configuration.fingerprint()
+        if fingerprint_store is not None and fingerprint_store.load() == fingerprint:
+            logger.debug("Configuration already verified!")
+            self._use_configuration(configuration)
+            return ResponseStatusCode.E220_SUCCESS
+
+        code, current = self.get_configuration()
+        if (
+            code != ResponseStatusCode.E220_SUCCESS
+            or current.fingerprint() != fingerprint
+        ):
+            code, current = self.set_configuration(configuration)
+            if code != ResponseStatusCode.E220_SUCCESS:
+                return code
+            # the fingerprint is saved only for the configuration the module
+            # really has
+            code, current = self.get_configuration()
+            if code != ResponseStatusCode.E220_SUCCESS:
+                return code
+            if current.fingerprint() != fingerprint:
+                return ResponseStatusCode.ERR_E220_HEAD_NOT_RECOGNIZED
+
+        self._use_configuration(current)
+        if fingerprint_store is not None:
+            try:
+                fingerprint_store.save(fingerprint)
+            except OSError as e:
+                # read only filesystem: the configuration is checked again
+                # at the next start
+                logger.error("Fingerprint not saved: {}".format(e))
         return code
 
+    # the module uses configuration: the data path follows its baud rate
+    def _use_configuration(self, configuration):
+        self.configuration = configuration
+        self.uart_baudrate = UARTBaudRate.get_bps(configuration.SPED.uartBaudRate)
+        self._set_uart_baudrate(self.mode)
+
     def set_mode(self, mode: ModeType) -> ResponseStatusCode:
-        self.managed_delay(40)
+        # the module switches only once the current operation is done
+        res = self.wait_complete_response(
+            self._busy_timeout_ms(MODE_SWITCH_TIMEOUT_MS), wait_no_aux=0, settle=0
+        )
+        if res != ResponseStatusCode.E220_SUCCESS:
+            return res
 
         if self.m0 is None and self.m1 is None:
             logger.debug(
@@ -493,14 +968,42 @@ class LoRaE220:
             else:
                 return ResponseStatusCode.ERR_E220_INVALID_PARAM
 
-        self.managed_delay(40)
+        if self.aux is None:
+            if ModeType.MODE_3_PROGRAM in (mode, self.mode):
+                switch = PROGRAM_MODE_SWITCH_MS
+            else:
+                switch = AUX_SETTLE_MS
+            self._busy_until = ticks.ticks_add(ticks.ticks_ms(), switch)
+        else:
+            # leave the module the time to pull AUX low
+            self.managed_delay(AUX_SETTLE_MS)
 
-        res = self.wait_complete_response(1000)
+        res = self.wait_complete_response(
+            MODE_SWITCH_TIMEOUT_MS, wait_no_aux=0, settle=AUX_SETTLE_MS
+        )
         if res == ResponseStatusCode.E220_SUCCESS:
             self.mode = mode
+            if self.energy is not None:
+                self.energy.mode_changed(mode)
+            self._set_uart_baudrate(mode)
 
         return res
 
+    def _set_uart_baudrate(self, mode):
+        # without the M0 and M1 pins the mode is set by the wiring and the
+        # host UART stays as it is
+        if self.m0 is None and self.m1 is None:
+            return
+        # the module accepts the program commands only at 9600 8N1
+        if mode == ModeType.MODE_3_PROGRAM:
+            baudrate = SerialUARTBaudRate.BPS_RATE_9600
+        else:
+            baudrate = self.uart_baudrate
+
+        if self.uart.baudrate != baudrate:
+            logger.debug("UART baud rate: {}".format(baudrate))
+            self.uart.baudrate = baudrate
+
     @staticmethod
     def managed_delay(timeout):
         t = ticks.ticks_ms()
@@ -512,7 +1015,54 @@ class LoRaE220:
         while ticks.ticks_diff(ticks.ticks_ms(), t) < timeout:
             pass
 
-    def wait_complete_response(self, timeout, wait_no_aux=100) -> ResponseStatusCode:
+    def is_busy(self) -> bool:
+        if self.aux is not None:
+            return self.aux.value == False
+        if self._busy_until is None:
+            return False
+        if ticks.ticks_less(ticks.ticks_ms(), self._busy_until):
+            return True
+        self._busy_until = None
+        return False
+
+    # modeled time left before the module ends the current operation
+    def remaining_busy_ms(self) -> int:
+        if self._busy_until is None:
+            return 0
+        remaining = ticks.ticks_diff(self._busy_until, ticks.ticks_ms())
+        return remaining if remaining > 0 else 0
+
+    # longest time the LBT can defer a transmission, 0 without LBT
+    def lbt_defer_ms(self) -> int:
+        if (
+            self.configuration is not None
+            and self.configuration.TRANSMISSION_MODE.enableLBT
+            == LbtEnableByte.LBT_ENABLED
+        ):
+            return LBT_MAX_DEFER_MS
+        return 0
+
+    # timeout of a wait on the AUX pin: the modeled end of the current
+    # operation, the longest deferral of the LBT and a margin
+    def _busy_timeout_ms(self, margin) -> int:
+        if self._busy_until is None:
+            return margin
+        return self.remaining_busy_ms() + self.lbt_defer_ms() + margin
+
+    # modeled time the module is busy with a frame of size bytes: the UART
+    # transfer and the time on air of each of its sub packets, in WOR
+    # transmitter mode preceded by a preamble as long as the WOR period
+    def frame_busy_ms(self, size) -> int:
+        busy = get_uart_time_ms(size, self.uart.baudrate) + get_frame_airtime_ms(
+            size, self.air_data_rate(), self.sub_packet_size()
+        )
+        if self.mode == ModeType.MODE_1_WOR_TRANSMITTER:
+            busy += self._wor_period_ms()
+        return busy
+
+    def wait_complete_response(
+        self, timeout, wait_no_aux=100, settle=20
+    ) -> ResponseStatusCode:
         result = ResponseStatusCode.E220_SUCCESS
         t = ticks.ticks_ms()
 
@@ -524,21 +1074,31 @@ class LoRaE220:
                 if ticks.ticks_diff(ticks.ticks_ms(), t) > timeout:
                     result = ResponseStatusCode.ERR_E220_TIMEOUT
                     logger.debug("Timeout error!")
+                    self._busy_until = None
+                    self.stats.add_wait(timeout, timeout, True)
                     return result
 
             logger.debug("AUX HIGH!")
         else:
+            # the modeled end of the current operation
+            if self._busy_until is not None:
+                while ticks.ticks_less(ticks.ticks_ms(), self._busy_until):
+                    pass
             self.managed_delay(wait_no_aux)
             logger.debug("Wait no AUX pin!")
+        self._busy_until = None
+        self.stats.add_wait(timeout, ticks.ticks_diff(ticks.ticks_ms(), t))
 
-        self.managed_delay(20)
+        self.managed_delay(settle)
         logger.debug("Complete!")
         return result
 
     def check_UART_configuration(self, mode) -> ResponseStatusCode:
+        # the baud rate is switched by set_mode, but busio.UART can change the
+        # parity only when it is created
         if (
             mode == ModeType.MODE_3_PROGRAM
-            and self.uart_baudrate != SerialUARTBaudRate.BPS_RATE_9600
+            and UARTParity.get_uart_value(self.uart_parity) is not None
         ):
             return ResponseStatusCode.ERR_E220_WRONG_UART_CONFIG
         return ResponseStatusCode.E220_SUCCESS
@@ -550,6 +1110,9 @@ class LoRaE220:
         code = self.check_UART_configuration(ModeType.MODE_3_PROGRAM)
         if code != ResponseStatusCode.E220_SUCCESS:
             return code, None
+        # the host UART could not follow a new parity
+        if UARTParity.get_uart_value(configuration.SPED.uartParity) is not None:
+            return ResponseStatusCode.ERR_E220_WRONG_UART_CONFIG, None
 
         prev_mode = self.mode
         code = self.set_mode(ModeType.MODE_3_PROGRAM)
@@ -564,7 +1127,7 @@ class LoRaE220:
         else:
             configuration._COMMAND = ProgramCommand.WRITE_CFG_PWR_DWN_LOSE
 
-        data = configuration.to_bytes()
+        data = configuration.get_buffer()
         logger.debug(
             "Writing configuration: {} size {}".format(
                 configuration.to_hex_string(), len(data)
@@ -576,21 +1139,25 @@ class LoRaE220:
             self.set_mode(prev_mode)
             return code, None
 
-        code = self.set_mode(prev_mode)
-        if code != ResponseStatusCode.E220_SUCCESS:
-            return code, None
-
-        data = self.uart.read()
-        logger.debug("data: {}".format(data))
-        logger.debug("data len: {}".format(len(data)))
+        # the answer is read still in program mode (at 9600)
+        logger.debug("model: {}".format(self.model))
+        configuration = Configuration(self.model)
+        size = self.uart.readinto(configuration.get_buffer())
+        logger.debug("data len: {}".format(size))
 
-        if data is None or len(data) != PacketLength.PL_CONFIGURATION + 3:
+        if size is None or size != PacketLength.PL_CONFIGURATION + 3:
+            self.set_mode(prev_mode)
             code = ResponseStatusCode.ERR_E220_DATA_SIZE_NOT_MATCH
             return code, None
+        logger.debug("data: {}".format(configuration.to_hex_string()))
 
-        logger.debug("model: {}".format(self.model))
-        configuration = Configuration(self.model)
-        configuration.from_bytes(data)
+        # follow the new data baud rate of the module when leaving program mode
+        if ProgramCommand.RETURNED_COMMAND == configuration._COMMAND:
+            self.uart_baudrate = UARTBaudRate.get_bps(configuration.SPED.uartBaudRate)
+
+        code = self.set_mode(prev_mode)
+        if code != ResponseStatusCode.E220_SUCCESS:
+            return code, None
 
         if ProgramCommand.WRONG_FORMAT == configuration._COMMAND:
             code = ResponseStatusCode.ERR_E220_WRONG_FORMAT
@@ -603,14 +1170,31 @@ class LoRaE220:
 
         self.clean_UART_buffer()
 
+        if code == ResponseStatusCode.E220_SUCCESS:
+            self.configuration = configuration
         return code, configuration
 
+    # reconfigure the data baud rate (an UARTBaudRate value) of the module and
+    # of the host UART together
+    def set_data_rate(
+        self, uart_baud_rate, permanentConfiguration=True
+    ) -> ResponseStatusCode:
+        if not UARTBaudRate.is_valid(uart_baud_rate):
+            return ResponseStatusCode.ERR_E220_INVALID_PARAM
+
+        code, configuration = self.get_configuration()
+        if code != ResponseStatusCode.E220_SUCCESS:
+            return code
+
+        configuration.SPED.uartBaudRate = uart_baud_rate
+        code, _ = self.set_configuration(configuration, permanentConfiguration)
+        return code
+
     def write_program_command(self, cmd, addr, pl) -> int:
         cmd = bytearray([cmd, addr, pl])
         size = self.uart.write(cmd)
 
-        self.managed_delay(50)  # need to check
-
+        # no delay: the read of the answer waits for it up to the UART timeout
         return size != 2
 
     def get_configuration(self) -> (ResponseStatusCode, Configuration):
@@ -631,17 +1215,15 @@ class LoRaE220:
             PacketLength.PL_CONFIGURATION,
         )
 
-        data = self.uart.read()
-        if data is None or len(data) != PacketLength.PL_CONFIGURATION + 3:
+        # read the answer directly in the buffer of the configuration
+        configuration = Configuration(self.model)
+        size = self.uart.readinto(configuration.get_buffer())
+        if size is None or size != PacketLength.PL_CONFIGURATION + 3:
             code = ResponseStatusCode.ERR_E220_DATA_SIZE_NOT_MATCH
             return code, None
 
-        logger.debug("data: {}".format(data))
-        logger.debug("data len: {}".format(len(data)))
-
+        logger.debug("data: {}".format(configuration.to_hex_string()))
         logger.debug("model: {}".format(self.model))
-        configuration = Configuration(self.model)
-        configuration.from_bytes(data)
         code = self.set_mode(prev_mode)
 
         if ProgramCommand.WRONG_FORMAT == configuration._COMMAND:
@@ -654,8 +1236,137 @@ class LoRaE220:
         ):
             code = ResponseStatusCode.ERR_E220_HEAD_NOT_RECOGNIZED
 
+        if code == ResponseStatusCode.E220_SUCCESS:
+            self.configuration = configuration
         return code, configuration
 
+    def _read_response(self, size, timeout) -> bytes:
+        # wait at most timeout ms for size bytes without relying on the
+        # (long) timeout of the UART
+        t = ticks.ticks_ms()
+        while self.uart.in_waiting < size:
+            if ticks.ticks_diff(ticks.ticks_ms(), t) > timeout:
+                break
+        if self.uart.in_waiting <= 0:
+            return None
+        return self.uart.read(min(size, self.uart.in_waiting))
+
+    # wait at most timeout ms for the size bytes of the answer starting with
+    # header to a command sent in normal mode, where the UART carries the
+    # packets received too: the bytes around the answer go to the packet queue
+    def _read_reply(self, header, size, timeout) -> bytes:
+        t = ticks.ticks_ms()
+        data = b""
+        start = -1
+        while start < 0 or len(data) < start + size:
+            if ticks.ticks_diff(ticks.ticks_ms(), t) > timeout:
+                self._rx_partial += data
+                self._rx_last = ticks.ticks_ms()
+                return None
+            waiting = self.uart.in_waiting
+            if waiting <= 0:
+                continue
+            data += self.uart.read(waiting)
+            start = data.find(header)
+
+        if start > 0:
+            self._rx_partial += data[:start]
+            self._rx_last = t
+            self._close_rx_packet()
+        if len(data) > start + size:
+            self._rx_partial += data[start + size :]
+            self._rx_last = ticks.ticks_ms()
+        return data[start : start + size]
+
+    def _probe_register(self, address, length, baudrate):
+        # the time to transfer the command and the answer plus the time the
+        # module takes to answer
+        timeout = (3 + 3 + length) * 10000 // baudrate + 20
+        self.uart.reset_input_buffer()
+        self.uart.write(bytes((ProgramCommand.READ_CONFIGURATION, address, length)))
+        data = self._read_response(3 + length, timeout)
+        if (
+            data is None
+            or len(data) != 3 + length
+            or data[0] != ProgramCommand.RETURNED_COMMAND
+            or data[1] != address
+            or data[2] != length
+        ):
+            return None
+        return data
+
+    # find the UART settings of a module with an unknown configuration: the
+    # PID register is read at every candidate baud rate (in program mode)
+    # until a valid answer, then the data baud rate and parity are read from
+    # the SPED register
+    def probe_uart_settings(
+        self, baudrates=PROBE_BAUD_RATES
+    ) -> (ResponseStatusCode, UARTSettings):
+        prev_mode = self.mode
+        code = self.set_mode(ModeType.MODE_3_PROGRAM)
+        if code != ResponseStatusCode.E220_SUCCESS:
+            return code, None
+
+        settings = None
+        for baudrate in baudrates:
+            logger.debug("Probe baud rate {}".format(baudrate))
+            self.uart.baudrate = baudrate
+            if (
+                self._probe_register(
+                    RegisterAddress.REG_ADDRESS_PID, PacketLength.PL_PID, baudrate
+                )
+                is None
+            ):
+                continue
+
+            data = self._probe_register(
+                RegisterAddress.REG_ADDRESS_SPED, PacketLength.PL_SPED, baudrate
+            )
+            if data is not None:
+                settings = UARTSettings(
+                    baudrate,
+                    UARTBaudRate.get_bps((data[3] >> 5) & 0b111),
+                    (data[3] >> 3) & 0b11,
+                )
+            break
+
+        if settings is None:
+            self.set_mode(prev_mode)
+            return ResponseStatusCode.ERR_E220_NO_RESPONSE_FROM_DEVICE, None
+
+        self.uart_baudrate = settings.baudrate
+        code = self.set_mode(prev_mode)
+        return code, settings
+
+    # the ambient noise and the RSSI of the last message received, in dBm
+    def read_rssi(self) -> (ResponseStatusCode, int, int):
+        if self.mode not in (
+            ModeType.MODE_0_NORMAL,
+            ModeType.MODE_1_WOR_TRANSMITTER,
+        ):
+            return ResponseStatusCode.ERR_E220_NOT_SUPPORT, None, None
+
+        # the packets already received go to the packet queue first, and a
+        # packet being received must end before the command
+        self.drain_rx()
+        while self._rx_partial:
+            self.drain_rx()
+
+        self.uart.write(RssiRegister.COMMAND + bytes((RssiRegister.AMBIENT_NOISE, 2)))
+        # the command and the answer on the UART and the time to answer
+        data = self._read_reply(
+            bytes((ProgramCommand.RETURNED_COMMAND, RssiRegister.AMBIENT_NOISE, 2)),
+            5,
+            get_uart_time_ms(6 + 5, self.uart.baudrate) + 20,
+        )
+        if data is None:
+            return ResponseStatusCode.ERR_E220_HEAD_NOT_RECOGNIZED, None, None
+        return (
+            ResponseStatusCode.E220_SUCCESS,
+            get_rssi_dbm(data[3]),
+            get_rssi_dbm(data[4]),
+        )
+
     def get_module_information(self):
         code = self.check_UART_configuration(ModeType.MODE_3_PROGRAM)
         if code != ResponseStatusCode.E220_SUCCESS:
@@ -714,7 +1425,12 @@ class LoRaE220:
     def receive_dict(
         self, rssi=False, delimiter=None, size=None
     ) -> (ResponseStatusCode, any, int or None):
-        code, msg, rssi_value = self.receive_message(rssi, delimiter, size)
+        import json
+
+        # receive_message returns the RSSI only when asked for
+        result = self.receive_message(rssi, delimiter, size)
+        code, msg = result[0], result[1]
+        rssi_value = result[2] if rssi else None
         if code != ResponseStatusCode.E220_SUCCESS:
             return code, None, None
 
@@ -722,6 +1438,7 @@ class LoRaE220:
             msg = json.loads(msg)
         except Exception as e:
             logger.error("Error: {}".format(e))
+            self.stats.parse_errors += 1
             return ResponseStatusCode.ERR_E220_JSON_PARSE, None, None
 
         return code, msg, rssi_value
@@ -735,21 +1452,42 @@ class LoRaE220:
                 rssi_value = data[-1]  # last byte is rssi
                 data = data[:-1]  # remove rssi from data
         elif size is not None:
-            data = self.uart.read(size)
+            data = self._read_rx(size)
         else:
-            data = self.uart.read()
-            self.clean_UART_buffer()
-            if rssi:
+            data = self._receive_packet(rssi)
+            if rssi and data:
                 rssi_value = data[-1]  # last byte is rssi
                 data = data[:-1]  # remove rssi from data
 
         if data is None or len(data) == 0:
+            self.stats.errors += 1
             return (
                 (ResponseStatusCode.ERR_E220_DATA_SIZE_NOT_MATCH, None, None)
                 if rssi
                 else (ResponseStatusCode.ERR_E220_DATA_SIZE_NOT_MATCH, None)
             )
 
+        self.stats.rx_messages += 1
+        self.stats.rx_bytes += len(data)
+        if self.energy is not None:
+            self.energy.add_receive(len(data))
+        # drop the corrupted frames and the duplicates before the decode (and
+        # the JSON parse)
+        if self.crc_trailer:
+            if not check_crc16(data):
+                self.stats.corrupt += 1
+                return (
+                    (ResponseStatusCode.ERR_E220_CRC_MISMATCH, None, None)
+                    if rssi
+                    else (ResponseStatusCode.ERR_E220_CRC_MISMATCH, None)
+                )
+            data = data[:-CRC16_SIZE]
+        if self.dedup is not None and self.dedup.is_duplicate(data):
+            return (
+                (ResponseStatusCode.ERR_E220_DUPLICATE, None, None)
+                if rssi
+                else (ResponseStatusCode.ERR_E220_DUPLICATE, None)
+            )
         data = data.decode("utf-8")
         msg = data
 
@@ -757,57 +1495,304 @@ class LoRaE220:
 
     def clean_UART_buffer(self):
         self.uart.read()
+        self._rx_partial = bytearray()
+
+    def _frame_gap_ms(self) -> int:
+        # the module sends a packet as a continuous stream, so a silence of
+        # about 4 characters on the UART means the packet is complete
+        return 40000 // self.uart.baudrate + 1
+
+    # move the bytes received to the packet queue, as soon as they arrive: the
+    # module outputs a packet as a continuous stream, so a packet ends at a
+    # silence of _frame_gap_ms() seen here (or at the largest packet size).
+    # The packets received back to back while nobody drains the UART are
+    # merged, only the CRC trailer can split them again: a busy loop should
+    # call it (or available()) often. Returns the number of packets queued.
+    def drain_rx(self) -> int:
+        limit = MAX_SIZE_TX_PACKET + CRC16_SIZE + 1
+        while True:
+            waiting = self.uart.in_waiting
+            now = ticks.ticks_ms()
+            if waiting <= 0:
+                if (
+                    self._rx_partial
+                    and ticks.ticks_diff(now, self._rx_last) > self._frame_gap_ms()
+                ):
+                    self._close_rx_packet()
+                break
+            if not self._rx_partial and len(self._rx_packets) >= self.max_rx_packets:
+                break
+            data = self.uart.read(min(waiting, limit - len(self._rx_partial)))
+            if not data:
+                break
+            self._rx_partial += data
+            self._rx_last = now
+            if len(self._rx_partial) >= limit:
+                self._close_rx_packet()
+        return len(self._rx_packets)
+
+    def _close_rx_packet(self):
+        self._rx_packets.append((bytes(self._rx_partial), self._rx_last))
+        self._rx_partial = bytearray()
+
+    # the next packet queued and its timestamp, with the CRC trailer the
+    # packets merged in the UART buffer are split at the first valid trailer
+    def _next_rx_packet(self, rssi):
+        packet, timestamp = self._rx_packets.pop(0)
+        if self.crc_trailer:
+            extra = 1 if rssi else 0
+            if not check_crc16(memoryview(packet)[: len(packet) - extra]):
+                size = split_crc16(packet, extra)
+                if size:
+                    self._rx_packets.insert(0, (packet[size:], timestamp))
+                    packet = packet[:size]
+        return packet, timestamp
+
+    # the next packet received, waiting only for the end of the one being
+    # received; None if there is none
+    def _receive_packet(self, rssi):
+        while self.drain_rx() == 0:
+            if not self._rx_partial:
+                return None
+        return self._next_rx_packet(rssi)[0]
+
+    # yield a Message for every packet received, waiting up to timeout ms
+    # (forever if None) for the next one and returning after max_batch
+    # messages. The packets are drained to the queue of drain_rx() before the
+    # one yielded is processed, the timestamp is the time of their last byte.
+    def messages(self, timeout=None, max_batch=None, rssi=False):
+        count = 0
+        t = ticks.ticks_ms()
+        while max_batch is None or count < max_batch:
+            if self.drain_rx() == 0:
+                # wait for the end of the packet being received
+                if not self._rx_partial and (
+                    timeout is not None
+                    and ticks.ticks_diff(ticks.ticks_ms(), t) >= timeout
+                ):
+                    return
+                continue
+
+            packet, timestamp = self._next_rx_packet(rssi)
+            size = len(packet)
+            if size == 0 or (rssi and size == 1):
+                self.stats.errors += 1
+                continue
+
+            rssi_value = None
+            if rssi:
+                size -= 1
+                rssi_value = packet[size]
+
+            self.stats.rx_messages += 1
+            self.stats.rx_bytes += size
+            if self.energy is not None:
+                self.energy.add_receive(size)
+            payload = memoryview(packet)[:size]
+            if self.crc_trailer:
+                if not check_crc16(payload):
+                    self.stats.corrupt += 1
+                    continue
+                payload = payload[:-CRC16_SIZE]
+            if self.dedup is not None and self.dedup.is_duplicate(payload):
+                continue
+            count += 1
+            yield Message(payload, rssi_value, None, timestamp)
+            t = ticks.ticks_ms()
+
+    # up to size bytes for the stream reads (size and delimiter), the ones
+    # already drained to the packet queue first so the data keeps its order
+    def _read_rx(self, size):
+        data = b""
+        while self._rx_packets and len(data) < size:
+            packet, timestamp = self._rx_packets.pop(0)
+            rest = size - len(data)
+            if len(packet) > rest:
+                self._rx_packets.insert(0, (packet[rest:], timestamp))
+                packet = packet[:rest]
+            data += packet
+        if len(data) < size and self._rx_partial:
+            rest = size - len(data)
+            data += bytes(self._rx_partial[:rest])
+            self._rx_partial = self._rx_partial[rest:]
+        if len(data) < size:
+            more = self.uart.read(size - len(data))
+            if more:
+                data += more
+        return data or None
 
     def _read_until(self, terminator="\n") -> bytes:
         line = b""
         while True:
-            c = self.uart.read(1)
+            c = self._read_rx(1)
             if c == terminator:
                 break
             line += c
         return line
 
-    def send_broadcast_message(self, CHAN, message) -> ResponseStatusCode:
-        return self._send_message(message, BROADCAST_ADDRESS, BROADCAST_ADDRESS, CHAN)
+    # the send methods accept a str or a byte buffer (bytes, bytearray,
+    # memoryview) and block until the module has transmitted
+    # the message, pass wait=False to return just after the UART write and use
+    # is_busy() to poll
+    def send_broadcast_message(self, CHAN, message, wait=True) -> ResponseStatusCode:
+        return self._send_message(
+            message, BROADCAST_ADDRESS, BROADCAST_ADDRESS, CHAN, wait=wait
+        )
+
+    def send_broadcast_dict(self, CHAN, dict_message, wait=True) -> ResponseStatusCode:
+        import json
 
-    def send_broadcast_dict(self, CHAN, dict_message) -> ResponseStatusCode:
         message = json.dumps(dict_message)
-        return self._send_message(message, BROADCAST_ADDRESS, BROADCAST_ADDRESS, CHAN)
+        return self._send_message(
+            message, BROADCAST_ADDRESS, BROADCAST_ADDRESS, CHAN, wait=wait
+        )
 
-    def send_transparent_message(self, message) -> ResponseStatusCode:
-        return self._send_message(message)
+    def send_transparent_message(self, message, wait=True) -> ResponseStatusCode:
+        return self._send_message(message, wait=wait)
 
-    def send_fixed_message(self, ADDH, ADDL, CHAN, message) -> ResponseStatusCode:
-        return self._send_message(message, ADDH, ADDL, CHAN)
+    def send_fixed_message(
+        self, ADDH, ADDL, CHAN, message, wait=True
+    ) -> ResponseStatusCode:
+        return self._send_message(message, ADDH, ADDL, CHAN, wait=wait)
+
+    def send_fixed_dict(
+        self, ADDH, ADDL, CHAN, dict_message, wait=True
+    ) -> ResponseStatusCode:
+        import json
 
-    def send_fixed_dict(self, ADDH, ADDL, CHAN, dict_message) -> ResponseStatusCode:
         message = json.dumps(dict_message)
-        return self._send_message(message, ADDH, ADDL, CHAN)
+        return self._send_message(message, ADDH, ADDL, CHAN, wait=wait)
+
+    def send_transparent_dict(self, dict_message, wait=True) -> ResponseStatusCode:
+        import json
 
-    def send_transparent_dict(self, dict_message) -> ResponseStatusCode:
         message = json.dumps(dict_message)
-        return self._send_message(message)
+        return self._send_message(message, wait=wait)
+
+    # the WOR sends wake up the modules in WOR receiver mode (with the same
+    # WOR period): the module is switched to WOR transmitter mode for the
+    # send, that waits for the preamble too, and then back to the previous mode
+    # the module goes back to the previous mode (the normal one if unknown)
+    # after the send, a failed restore is returned when the send succeeded
+    def _send_wor(self, send, *args) -> ResponseStatusCode:
+        prev_mode = self.mode
+        if prev_mode is None:
+            prev_mode = ModeType.MODE_0_NORMAL
+        code = self.set_mode(ModeType.MODE_1_WOR_TRANSMITTER)
+        if code != ResponseStatusCode.E220_SUCCESS:
+            return code
+
+        code = send(*args)
+        restored = self.set_mode(prev_mode)
+        if restored != ResponseStatusCode.E220_SUCCESS:
+            logger.error(
+                "Module left in WOR transmitter mode: {}".format(
+                    ResponseStatusCode.get_description(restored)
+                )
+            )
+        if code != ResponseStatusCode.E220_SUCCESS:
+            return code
+        return restored
+
+    def send_wor_transparent_message(self, message) -> ResponseStatusCode:
+        return self._send_wor(self.send_transparent_message, message)
+
+    def send_wor_fixed_message(self, ADDH, ADDL, CHAN, message) -> ResponseStatusCode:
+        return self._send_wor(self.send_fixed_message, ADDH, ADDL, CHAN, message)
+
+    def send_wor_broadcast_message(self, CHAN, message) -> ResponseStatusCode:
+        return self._send_wor(self.send_broadcast_message, CHAN, message)
+
+    def send_wor_transparent_dict(self, dict_message) -> ResponseStatusCode:
+        return self._send_wor(self.send_transparent_dict, dict_message)
+
+    def send_wor_fixed_dict(self, ADDH, ADDL, CHAN, dict_message) -> ResponseStatusCode:
+        return self._send_wor(self.send_fixed_dict, ADDH, ADDL, CHAN, dict_message)
+
+    def send_wor_broadcast_dict(self, CHAN, dict_message) -> ResponseStatusCode:
+        return self._send_wor(self.send_broadcast_dict, CHAN, dict_message)
+
+    def send_to(self, destination, message, wait=True) -> ResponseStatusCode:
+        frame = destination.frame(message)
+        if frame is None:
+            return ResponseStatusCode.ERR_E220_PACKET_TOO_BIG
+        if self.crc_trailer:
+            return self.send_into(destination, len(frame) - 3, wait)
+        return self._write_frame(frame, wait)
+
+    def send_dict_to(self, destination, dict_message, wait=True) -> ResponseStatusCode:
+        import json
+
+        return self.send_to(destination, json.dumps(dict_message), wait)
+
+    # the *_into sends transmit the first size bytes already serialized by the
+    # caller in tx_buffer() (or in destination.payload), without any copy
+    def tx_buffer(self):
+        return self._destination.payload
+
+    # write the CRC trailer of the first size bytes of payload after them,
+    # returns the size with the trailer (-1 if it does not fit)
+    def _add_crc_trailer(self, payload, size) -> int:
+        if not self.crc_trailer:
+            return size
+        if size < 0 or size + CRC16_SIZE > len(payload):
+            return -1
+        crc = crc16(payload[:size])
+        payload[size] = crc >> 8
+        payload[size + 1] = crc & 0xFF
+        return size + CRC16_SIZE
+
+    def send_into(self, destination, size, wait=True) -> ResponseStatusCode:
+        size = self._add_crc_trailer(destination.payload, size)
+        frame = destination.prepared_frame(size)
+        if frame is None:
+            return ResponseStatusCode.ERR_E220_PACKET_TOO_BIG
+        return self._write_frame(frame, wait)
+
+    def send_fixed_into(self, ADDH, ADDL, CHAN, size, wait=True) -> ResponseStatusCode:
+        self._destination.set_address(ADDH, ADDL, CHAN)
+        return self.send_into(self._destination, size, wait)
+
+    def send_broadcast_into(self, CHAN, size, wait=True) -> ResponseStatusCode:
+        return self.send_fixed_into(
+            BROADCAST_ADDRESS, BROADCAST_ADDRESS, CHAN, size, wait
+        )
+
+    def send_transparent_into(self, size, wait=True) -> ResponseStatusCode:
+        size = self._add_crc_trailer(self._destination.payload, size)
+        if size < 0 or size > len(self._destination.payload):
+            return ResponseStatusCode.ERR_E220_PACKET_TOO_BIG
+        return self._write_frame(self._destination.payload[:size], wait)
 
     def _send_message(
-        self, message, ADDH=None, ADDL=None, CHAN=None
+        self, message, ADDH=None, ADDL=None, CHAN=None, wait=True
     ) -> ResponseStatusCode:
-        result = ResponseStatusCode.E220_SUCCESS
+        if isinstance(message, str):
+            message = message.encode("utf-8")
 
-        size_ = len(message.encode("utf-8"))
-        if size_ > MAX_SIZE_TX_PACKET + 2:
+        if payload_size(message) > MAX_SIZE_TX_PACKET + 2:
             return ResponseStatusCode.ERR_E220_PACKET_TOO_BIG
 
         if ADDH is not None and ADDL is not None and CHAN is not None:
-            if isinstance(message, str):
-                message = message.encode("utf-8")
-            dataarray = bytes([ADDH, ADDL, CHAN]) + message
-            dataarray = LoRaE220._normalize_array(dataarray)
-            lenMS = self.uart.write(bytes(dataarray))
-            size_ += 3
-        elif isinstance(message, str):
-            lenMS = self.uart.write(message.encode("utf-8"))
-        else:
-            lenMS = self.uart.write(bytes(message))
+            self._destination.set_address(ADDH, ADDL, CHAN)
+            return self.send_to(self._destination, message, wait)
+
+        if self.crc_trailer:
+            # copied in the transmit buffer to append the trailer
+            size = payload_size(message)
+            payload = self._destination.payload
+            if size > len(payload):
+                return ResponseStatusCode.ERR_E220_PACKET_TOO_BIG
+            payload[:size] = message
+            return self.send_transparent_into(size, wait)
+        return self._write_frame(message, wait)
+
+    def _write_frame(self, frame, wait=True) -> ResponseStatusCode:
+        result = ResponseStatusCode.E220_SUCCESS
+
+        size_ = len(frame)
+        start = ticks.ticks_ms()
+        lenMS = self.uart.write(frame)
 
         if lenMS != size_:
             logger.debug("Send... len:", lenMS, " size:", size_)
@@ -816,19 +1801,138 @@ class LoRaE220:
             else:
                 result = ResponseStatusCode.ERR_E220_DATA_SIZE_NOT_MATCH
         if result != ResponseStatusCode.E220_SUCCESS:
+            self.stats.errors += 1
             return result
 
-        result = self.wait_complete_response(1000)
+        self.stats.tx_messages += 1
+        self.stats.tx_bytes += lenMS
+        if self.energy is not None:
+            self.energy.add_send(lenMS)
+
+        self._busy_until = ticks.ticks_add(start, self.frame_busy_ms(lenMS))
+        if not wait:
+            return result
+
+        result = self.wait_complete_response(
+            self._busy_timeout_ms(WAIT_MARGIN_MS), wait_no_aux=0, settle=AUX_SETTLE_MS
+        )
         if result != ResponseStatusCode.E220_SUCCESS:
+            self.stats.errors += 1
             return result
-        logger.debug("Clear buffer...")
-        self.clean_UART_buffer()
+        # the packets received meanwhile go to the packet queue
+        self.drain_rx()
 
         logger.debug("ok!")
         return result
 
+    # air data rate, sub packet size: of the configuration, or the defaults
+    # of the module when it is not known
+    def air_data_rate(self):
+        if self.configuration is None:
+            return AirDataRate.AIR_DATA_RATE_010_24
+        return self.configuration.SPED.airDataRate
+
+    def _wor_period_ms(self):
+        if self.configuration is None:
+            return WorPeriod.get_ms(WorPeriod.WOR_2000_011)
+        return WorPeriod.get_ms(self.configuration.TRANSMISSION_MODE.WORPeriod)
+
+    def sub_packet_size(self):
+        if self.configuration is None:
+            return SubPacketSetting.get_bytes(SubPacketSetting.SPS_200_00)
+        return SubPacketSetting.get_bytes(self.configuration.OPTION.subPacketSetting)
+
+    # send data of any size as a stream of sub packets: the data is written in
+    # frames as large as the free space in the buffer of the module
+    # (MODULE_BUFFER_SIZE), so the next sub packets wait there while one is
+    # on air. A fixed transmission header starts each frame and counts in the
+    # buffer: the module parses it only at the start of a UART frame, so it is
+    # written once per frame and never back to back with the previous one.
+    # With a full buffer it waits for AUX high (the buffer is empty while the
+    # last sub packet can be still on air) or, with no AUX pin, for the
+    # modeled buffer to drain enough; the stream has no CRC trailer
+    def send_stream(self, data, ADDH=None, ADDL=None, CHAN=None) -> ResponseStatusCode:
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        view = memoryview(data)
+        size = len(view)
+
+        header = None
+        header_size = 0
+        if ADDH is not None and ADDL is not None and CHAN is not None:
+            self._destination.set_address(ADDH, ADDL, CHAN)
+            header = self._destination.prepared_frame(0)
+            header_size = len(header)
+
+        chunk_size = self.sub_packet_size()
+        air_data_rate = self.air_data_rate()
+        # the sub packets in the module buffer: modeled time when each one
+        # leaves it and the bytes it takes there
+        pending = []
+        buffered = 0
+        done = ticks.ticks_ms()
+
+        offset = 0
+        while offset < size:
+            # room for a header and a sub packet (or the rest of the data)
+            needed = header_size + min(chunk_size, size - offset)
+            while pending and buffered + needed > MODULE_BUFFER_SIZE:
+                if self.aux is not None:
+                    self._busy_until = done
+                    result = self.wait_complete_response(
+                        self._busy_timeout_ms(WAIT_MARGIN_MS), wait_no_aux=0, settle=0
+                    )
+                    if result != ResponseStatusCode.E220_SUCCESS:
+                        self.stats.errors += 1
+                        return result
+                    pending = []
+                    buffered = 0
+                else:
+                    while ticks.ticks_less(ticks.ticks_ms(), pending[0][0]):
+                        pass
+                    buffered -= pending.pop(0)[1]
+
+            count = min(size - offset, MODULE_BUFFER_SIZE - buffered - header_size)
+            written = 0
+            if header is not None:
+                written += self.uart.write(header)
+            written += self.uart.write(view[offset : offset + count])
+            if written != header_size + count:
+                self.stats.errors += 1
+                return ResponseStatusCode.ERR_E220_DATA_SIZE_NOT_MATCH
+
+            self.stats.tx_messages += 1
+            self.stats.tx_bytes += written
+            if self.energy is not None:
+                self.energy.add_send(written)
+            offset += count
+
+            now = ticks.ticks_ms()
+            if ticks.ticks_less(done, now):
+                done = now
+            # the frame goes on air as sub packets, the header leaves the
+            # buffer with the first one
+            taken = header_size
+            while count > 0:
+                packet = min(count, chunk_size)
+                done = ticks.ticks_add(done, get_airtime_ms(packet, air_data_rate))
+                pending.append((done, taken + packet))
+                buffered += taken + packet
+                taken = 0
+                count -= packet
+
+        self._busy_until = done
+        return self.wait_complete_response(
+            self._busy_timeout_ms(WAIT_MARGIN_MS), wait_no_aux=0, settle=AUX_SETTLE_MS
+        )
+
+    # the bytes received and not consumed yet
     def available(self) -> int:
-        return self.uart.in_waiting
+        self.drain_rx()
+        size = len(self._rx_partial) + self.uart.in_waiting
+        for packet, _ in self._rx_packets:
+            size += len(packet)
+        return size
 
     def end(self) -> ResponseStatusCode:
         try:
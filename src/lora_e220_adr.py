@@ -0,0 +1,312 @@
+import adafruit_ticks as ticks
+
+from lora_e220 import (
+    BROADCAST_ADDRESS,
+    Configuration,
+    Logger,
+    get_frame_airtime_ms,
+    get_rssi_dbm,
+)
+from lora_e220_constants import AirDataRate, FixedTransmission, SubPacketSetting
+from lora_e220_operation_constant import ResponseStatusCode
+
+logging = Logger(False)
+
+logger = logging.getLogger(__name__)
+
+# the distinct air data rates, from the slowest to the fastest
+ADR_AIR_DATA_RATES = (
+    AirDataRate.AIR_DATA_RATE_010_24,
+    AirDataRate.AIR_DATA_RATE_011_48,
+    AirDataRate.AIR_DATA_RATE_100_96,
+    AirDataRate.AIR_DATA_RATE_101_192,
+    AirDataRate.AIR_DATA_RATE_110_384,
+    AirDataRate.AIR_DATA_RATE_111_625,
+)
+
+# command sent to the peers before a change: magic, air data rate, power
+ADR_COMMAND = b"\xadR"
+ADR_COMMAND_SIZE = 4
+
+
+class LinkState:
+    def __init__(self):
+        self.rssi_dbm = None
+        # the last outcomes of the deliveries, a bit for each (1 delivered)
+        self.history = 0
+        self.samples = 0
+        self.heard = ticks.ticks_ms()
+
+
+# The adaptive data rate controller tracks the RSSI and the delivery history
+# of the links to the peers and moves the air data rate and the transmission
+# power (of this module and, with the ADR command, of the peers) to the
+# fastest rate and lowest power that keep the weakest link above the target
+# delivery rate with margin_db dB over the sensitivity. The changes are
+# written with WRITE_CFG_PWR_DWN_LOSE, so a reset restores the saved
+# configuration, and reverted when no peer is heard within probation_ms.
+class AdaptiveDataRate:
+    def __init__(
+        self,
+        lora,
+        target_delivery=90,
+        margin_db=10,
+        window=16,
+        probation_ms=None,
+        max_peers=16,
+    ):
+        self.lora = lora
+        self.target_delivery = target_delivery
+        self.margin_db = margin_db
+        self.window = window
+        self.probation_ms = probation_ms
+        self.max_peers = max_peers
+
+        self.changes = 0
+        self.reverts = 0
+
+        self._links = {}
+        self._previous = None
+        self._changed_at = None
+        self._heard_since_change = False
+
+    def _link(self, peer):
+        link = self._links.get(peer)
+        if link is None:
+            if len(self._links) >= self.max_peers:
+                # forget the peer not heard for the longest time
+                oldest = None
+                for key, value in self._links.items():
+                    if oldest is None or ticks.ticks_less(
+                        value.heard, self._links[oldest].heard
+                    ):
+                        oldest = key
+                del self._links[oldest]
+            link = LinkState()
+            self._links[peer] = link
+        return link
+
+    def record_rssi(self, peer, rssi):
+        link = self._link(peer)
+        dbm = get_rssi_dbm(rssi)
+        if link.rssi_dbm is None:
+            link.rssi_dbm = dbm
+        else:
+            # exponential moving average with weight 1/4
+            link.rssi_dbm += (dbm - link.rssi_dbm) // 4
+        link.heard = ticks.ticks_ms()
+        self._heard_since_change = True
+
+    def record_delivery(self, peer, delivered):
+        link = self._link(peer)
+        link.history = ((link.history << 1) | (1 if delivered else 0)) & (
+            (1 << self.window) - 1
+        )
+        if link.samples < self.window:
+            link.samples += 1
+        if delivered:
+            link.heard = ticks.ticks_ms()
+            self._heard_since_change = True
+
+    # a message received from peer (with the RSSI byte if enabled) is both
+    # a delivery and a RSSI sample
+    def record_message(self, peer, message):
+        if message.rssi is not None:
+            self.record_rssi(peer, message.rssi)
+        self.record_delivery(peer, True)
+
+    # percentage of the last deliveries of the link, None without samples
+    def delivery(self, peer):
+        link = self._links.get(peer)
+        if link is None or link.samples == 0:
+            return None
+        delivered = 0
+        history = link.history
+        for _ in range(link.samples):
+            delivered += history & 1
+            history >>= 1
+        return delivered * 100 // link.samples
+
+    def _configuration(self) -> Configuration:
+        if self.lora.configuration is not None:
+            return self.lora.configuration
+        code, configuration = self.lora.get_configuration()
+        if code != ResponseStatusCode.E220_SUCCESS:
+            return None
+        return configuration
+
+    # the settings (air data rate, transmission power) for the weakest link,
+    # None to keep the current ones
+    def recommend(self):
+        configuration = self._configuration()
+        if configuration is None:
+            return None
+        air_data_rate = configuration.SPED.airDataRate
+        power = configuration.OPTION.transmissionPower
+        power_table = configuration.capabilities.power_table
+
+        worst_delivery = None
+        worst_rssi = None
+        for peer, link in self._links.items():
+            if link.samples >= self.window // 2:
+                delivery = self.delivery(peer)
+                if worst_delivery is None or delivery < worst_delivery:
+                    worst_delivery = delivery
+            if link.rssi_dbm is not None and (
+                worst_rssi is None or link.rssi_dbm < worst_rssi
+            ):
+                worst_rssi = link.rssi_dbm
+        if worst_delivery is None:
+            return None
+
+        index = 0
+        if air_data_rate in ADR_AIR_DATA_RATES:
+            index = ADR_AIR_DATA_RATES.index(air_data_rate)
+
+        if worst_delivery < self.target_delivery:
+            # a higher power first, it costs energy but not capacity
+            if power > 0:
+                return ADR_AIR_DATA_RATES[index], power - 1
+            if index > 0:
+                return ADR_AIR_DATA_RATES[index - 1], power
+            return None
+
+        if worst_rssi is None:
+            return None
+        margin = worst_rssi - AirDataRate.get_sensitivity_dbm(air_data_rate)
+        if index + 1 < len(ADR_AIR_DATA_RATES):
+            faster = ADR_AIR_DATA_RATES[index + 1]
+            loss = AirDataRate.get_sensitivity_dbm(
+                faster
+            ) - AirDataRate.get_sensitivity_dbm(air_data_rate)
+            if margin - loss >= self.margin_db:
+                return faster, power
+        if power_table.is_valid(power + 1):
+            loss = power_table.get_dbm(power) - power_table.get_dbm(power + 1)
+            if margin - loss >= self.margin_db:
+                return ADR_AIR_DATA_RATES[index], power + 1
+        return None
+
+    def _write(self, air_data_rate, power) -> ResponseStatusCode:
+        configuration = self._configuration()
+        if configuration is None:
+            return ResponseStatusCode.ERR_E220_NO_RESPONSE_FROM_DEVICE
+        configuration = Configuration(
+            self.lora.model, bytearray(configuration.get_buffer())
+        )
+        configuration.SPED.airDataRate = air_data_rate
+        configuration.OPTION.transmissionPower = power
+        code, _ = self.lora.set_configuration(
+            configuration, permanentConfiguration=False
+        )
+        return code
+
+    def _send_command(self, air_data_rate, power) -> ResponseStatusCode:
+        command = ADR_COMMAND + bytes((air_data_rate, power))
+        configuration = self.lora.configuration
+        if (
+            configuration is not None
+            and configuration.TRANSMISSION_MODE.fixedTransmission
+            == FixedTransmission.FIXED_TRANSMISSION
+        ):
+            return self.lora.send_fixed_message(
+                BROADCAST_ADDRESS, BROADCAST_ADDRESS, configuration.CHAN, command
+            )
+        return self.lora.send_transparent_message(command)
+
+    # apply the settings here and, with coordinate, on the peers too (the ADR
+    # command is sent with the current settings, repeated to survive a loss)
+    def apply(
+        self, air_data_rate, power, coordinate=True, repeats=2
+    ) -> ResponseStatusCode:
+        configuration = self._configuration()
+        if configuration is None:
+            return ResponseStatusCode.ERR_E220_NO_RESPONSE_FROM_DEVICE
+        previous = (
+            configuration.SPED.airDataRate,
+            configuration.OPTION.transmissionPower,
+        )
+
+        if coordinate:
+            for _ in range(repeats):
+                code = self._send_command(air_data_rate, power)
+                if code != ResponseStatusCode.E220_SUCCESS:
+                    return code
+
+        code = self._write(air_data_rate, power)
+        if code != ResponseStatusCode.E220_SUCCESS:
+            return code
+
+        logger.debug(
+            "ADR: {} {}".format(AirDataRate.get_description(air_data_rate), power)
+        )
+        self.changes += 1
+        self._previous = previous
+        self._changed_at = ticks.ticks_ms()
+        self._heard_since_change = False
+        # the history was collected with the previous settings
+        for link in self._links.values():
+            link.history = 0
+            link.samples = 0
+        return code
+
+    # the peer side: apply the ADR command in payload, False if it is not one
+    def handle(self, payload) -> bool:
+        if len(payload) != ADR_COMMAND_SIZE or bytes(payload[:2]) != ADR_COMMAND:
+            return False
+        air_data_rate, power = payload[2], payload[3]
+        if not AirDataRate.is_valid(air_data_rate):
+            return True
+        configuration = self._configuration()
+        if (
+            configuration is not None
+            and configuration.SPED.airDataRate == air_data_rate
+            and configuration.OPTION.transmissionPower == power
+        ):
+            # a repeated command
+            return True
+        self.apply(air_data_rate, power, coordinate=False)
+        return True
+
+    def _probation_ms(self) -> int:
+        if self.probation_ms is not None:
+            return self.probation_ms
+        # a few of the largest messages at the slowest rate
+        configuration = self._configuration()
+        if configuration is None:
+            # not readable: the default sub packet size of the module
+            sub_packet = self.lora.sub_packet_size()
+        else:
+            sub_packet = SubPacketSetting.get_bytes(
+                configuration.OPTION.subPacketSetting
+            )
+        return 10 * get_frame_airtime_ms(sub_packet, ADR_AIR_DATA_RATES[0], sub_packet)
+
+    # revert a change when no peer is heard within the probation time and,
+    # with adapt, apply the recommended settings
+    def service(self, adapt=True) -> ResponseStatusCode:
+        if self._changed_at is not None and not self._heard_since_change:
+            if (
+                ticks.ticks_diff(ticks.ticks_ms(), self._changed_at)
+                > self._probation_ms()
+            ):
+                logger.debug("ADR: no peer heard, revert")
+                air_data_rate, power = self._previous
+                self._changed_at = None
+                self.reverts += 1
+                return self._write(air_data_rate, power)
+            return ResponseStatusCode.E220_SUCCESS
+        self._changed_at = None
+
+        if not adapt:
+            return ResponseStatusCode.E220_SUCCESS
+        recommended = self.recommend()
+        if recommended is None:
+            return ResponseStatusCode.E220_SUCCESS
+        return self.apply(*recommended)
+
+    def snapshot(self):
+        return {
+            peer: (link.rssi_dbm, self.delivery(peer), link.samples)
+            for peer, link in self._links.items()
+        }
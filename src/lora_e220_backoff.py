@@ -0,0 +1,157 @@
+import random
+
+import adafruit_ticks as ticks
+
+from lora_e220 import (
+    AUX_SETTLE_MS,
+    LBT_MAX_DEFER_MS,
+    WAIT_MARGIN_MS,
+    Logger,
+    get_frame_airtime_ms,
+    get_uart_time_ms,
+    payload_size,
+)
+from lora_e220_constants import RssiAmbientNoiseEnable
+from lora_e220_operation_constant import ResponseStatusCode
+
+logging = Logger(False)
+
+logger = logging.getLogger(__name__)
+
+
+# The LBT sender sends with listen before talk in mind. Before each attempt
+# the ambient noise is read (when enabled in the configuration) and the send
+# is postponed when the channel is busy; after the write the time AUX stays
+# low tells a send deferred by the LBT of the module (AUX low longer than the
+# modeled transfer, within the 2 s of the LBT) from a failure (no AUX high
+# at all). A busy channel is retried after a random backoff up to an
+# exponentially growing limit, so a congested channel slows down the senders
+# instead of piling up timeouts; a failure is not retried, the module may be
+# still busy with the message.
+class LbtSender:
+    def __init__(
+        self,
+        lora,
+        max_retries=5,
+        base_backoff_ms=None,
+        max_backoff_ms=LBT_MAX_DEFER_MS,
+        noise_threshold_dbm=-100,
+    ):
+        self.lora = lora
+        self.max_retries = max_retries
+        self.base_backoff_ms = base_backoff_ms
+        self.max_backoff_ms = max_backoff_ms
+        self.noise_threshold_dbm = noise_threshold_dbm
+
+        self.reset()
+
+    def reset(self):
+        self.sends = 0
+        self.attempts = 0
+        self.retries = 0
+        self.busy_channel = 0
+        self.deferrals = 0
+        self.failures = 0
+        self.dropped = 0
+        self.backoff_ms = 0
+        self.last_noise_dbm = None
+
+    def _noise_enabled(self) -> bool:
+        configuration = self.lora.configuration
+        return (
+            configuration is not None
+            and configuration.OPTION.RSSIAmbientNoise
+            == RssiAmbientNoiseEnable.RSSI_AMBIENT_NOISE_ENABLED
+        )
+
+    def channel_busy(self) -> bool:
+        if not self._noise_enabled():
+            return False
+        code, noise, _ = self.lora.read_rssi()
+        if code != ResponseStatusCode.E220_SUCCESS:
+            return False
+        self.last_noise_dbm = noise
+        return noise > self.noise_threshold_dbm
+
+    # random delay up to base * 2 ^ attempt, at most max_backoff_ms
+    def _backoff(self, attempt, size):
+        base = self.base_backoff_ms
+        if base is None:
+            # the time on air of the message
+            base = get_frame_airtime_ms(
+                size, self.lora.air_data_rate(), self.lora.sub_packet_size()
+            )
+        limit = min(base << attempt, self.max_backoff_ms)
+        delay = random.randint(0, limit)
+        self.backoff_ms += delay
+        self.lora.managed_delay(delay)
+
+    # the longest time AUX stays low without deferral: the UART transfer and
+    # the time on air (AUX goes high already when the last sub packet leaves
+    # the buffer)
+    def _expected_aux_ms(self, size) -> int:
+        return get_uart_time_ms(size, self.lora.uart.baudrate) + get_frame_airtime_ms(
+            size, self.lora.air_data_rate(), self.lora.sub_packet_size()
+        )
+
+    def _send(self, send, size, *args) -> ResponseStatusCode:
+        self.sends += 1
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                self.retries += 1
+                self._backoff(attempt, size)
+
+            if self.channel_busy():
+                self.busy_channel += 1
+                logger.debug("Channel busy: {} dBm".format(self.last_noise_dbm))
+                continue
+
+            self.attempts += 1
+            start = ticks.ticks_ms()
+            code = send(*args, wait=False)
+            if code != ResponseStatusCode.E220_SUCCESS:
+                # not a channel problem
+                return code
+
+            expected = self._expected_aux_ms(size)
+            code = self.lora.wait_complete_response(
+                expected + LBT_MAX_DEFER_MS + WAIT_MARGIN_MS,
+                wait_no_aux=0,
+                settle=AUX_SETTLE_MS,
+            )
+            if code == ResponseStatusCode.ERR_E220_TIMEOUT:
+                self.failures += 1
+                logger.debug("Send failed, AUX still low")
+                return code
+
+            if (
+                self.lora.aux is not None
+                and ticks.ticks_diff(ticks.ticks_ms(), start)
+                > expected + AUX_SETTLE_MS + WAIT_MARGIN_MS
+            ):
+                self.deferrals += 1
+                logger.debug("Send deferred by the LBT")
+            self.lora.drain_rx()
+            return code
+
+        self.dropped += 1
+        return ResponseStatusCode.ERR_E220_TIMEOUT
+
+    def _size(self, message):
+        if isinstance(message, str):
+            message = message.encode("utf-8")
+        return message, payload_size(message)
+
+    def send_transparent_message(self, message) -> ResponseStatusCode:
+        message, size = self._size(message)
+        return self._send(self.lora.send_transparent_message, size, message)
+
+    def send_fixed_message(self, ADDH, ADDL, CHAN, message) -> ResponseStatusCode:
+        message, size = self._size(message)
+        return self._send(
+            self.lora.send_fixed_message, size + 3, ADDH, ADDL, CHAN, message
+        )
+
+    def send_broadcast_message(self, CHAN, message) -> ResponseStatusCode:
+        message, size = self._size(message)
+        return self._send(self.lora.send_broadcast_message, size + 3, CHAN, message)
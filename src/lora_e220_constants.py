@@ -1,34 +1,38 @@
+from collections import namedtuple
+
+
+# The metadata of every constant is kept in tuples indexed by the code of the
+# constant: the description and, where it makes sense, the numeric value
+# (bps, ms, bytes, dBm) used by the timing computations.
+def _lookup(table, code, default=None):
+    if isinstance(code, int) and 0 <= code < len(table):
+        return table[code]
+    return default
+
+
 class UARTParity:
     MODE_00_8N1 = 0b00
     MODE_01_8O1 = 0b01
     MODE_10_8E1 = 0b10
     MODE_11_8N1 = 0b11
 
+    _DESCRIPTIONS = ("8N1 (Default)", "8O1", "8E1", "8N1")
+    # busio.UART parity: None, busio.Parity.ODD (0) or busio.Parity.EVEN (1)
+    _UART_VALUES = (None, 0, 1, None)
+
     @staticmethod
     def get_description(uart_parity):
-        if uart_parity == UARTParity.MODE_00_8N1:
-            return "8N1 (Default)"
-        elif uart_parity == UARTParity.MODE_01_8O1:
-            return "8O1"
-        elif uart_parity == UARTParity.MODE_10_8E1:
-            return "8E1"
-        elif uart_parity == UARTParity.MODE_11_8N1:
-            return "8N1"
-        else:
-            return "Invalid UART Parity!"
+        return _lookup(UARTParity._DESCRIPTIONS, uart_parity, "Invalid UART Parity!")
 
     @staticmethod
     def get_uart_value(uart_parity):
-        if uart_parity == UARTParity.MODE_00_8N1:
-            return None
-        elif uart_parity == UARTParity.MODE_01_8O1:
-            return 0
-        elif uart_parity == UARTParity.MODE_10_8E1:
-            return 1
-        elif uart_parity == UARTParity.MODE_11_8N1:
-            return None
-        else:
+        if not UARTParity.is_valid(uart_parity):
             return ValueError("Invalid UART Parity!")
+        return UARTParity._UART_VALUES[uart_parity]
+
+    @staticmethod
+    def is_valid(uart_parity):
+        return _lookup(UARTParity._DESCRIPTIONS, uart_parity) is not None
 
 
 class UARTBaudRate:
@@ -41,26 +45,38 @@ class UARTBaudRate:
     BPS_57600 = 0b110
     BPS_115200 = 0b111
 
+    _DESCRIPTIONS = (
+        "1200bps",
+        "2400bps",
+        "4800bps",
+        "9600bps (default)",
+        "19200bps",
+        "38400bps",
+        "57600bps",
+        "115200bps",
+    )
+    _BPS = (1200, 2400, 4800, 9600, 19200, 38400, 57600, 115200)
+
     @staticmethod
     def get_description(uart_baud_rate):
-        if uart_baud_rate == UARTBaudRate.BPS_1200:
-            return "1200bps"
-        elif uart_baud_rate == UARTBaudRate.BPS_2400:
-            return "2400bps"
-        elif uart_baud_rate == UARTBaudRate.BPS_4800:
-            return "4800bps"
-        elif uart_baud_rate == UARTBaudRate.BPS_9600:
-            return "9600bps (default)"
-        elif uart_baud_rate == UARTBaudRate.BPS_19200:
-            return "19200bps"
-        elif uart_baud_rate == UARTBaudRate.BPS_38400:
-            return "38400bps"
-        elif uart_baud_rate == UARTBaudRate.BPS_57600:
-            return "57600bps"
-        elif uart_baud_rate == UARTBaudRate.BPS_115200:
-            return "115200bps"
-        else:
-            return "Invalid UART Baud Rate!"
+        return _lookup(
+            UARTBaudRate._DESCRIPTIONS, uart_baud_rate, "Invalid UART Baud Rate!"
+        )
+
+    @staticmethod
+    def get_bps(uart_baud_rate):
+        return _lookup(UARTBaudRate._BPS, uart_baud_rate)
+
+    @staticmethod
+    def from_bps(bps):
+        for code in range(len(UARTBaudRate._BPS)):
+            if UARTBaudRate._BPS[code] == bps:
+                return code
+        return None
+
+    @staticmethod
+    def is_valid(uart_baud_rate):
+        return _lookup(UARTBaudRate._BPS, uart_baud_rate) is not None
 
 
 class AirDataRate:
@@ -73,26 +89,37 @@ class AirDataRate:
     AIR_DATA_RATE_110_384 = 0b110
     AIR_DATA_RATE_111_625 = 0b111
 
+    _DESCRIPTIONS = (
+        "2.4kbps",
+        "2.4kbps",
+        "2.4kbps (default)",
+        "4.8kbps",
+        "9.6kbps",
+        "19.2kbps",
+        "38.4kbps",
+        "62.5kbps",
+    )
+    _BPS = (2400, 2400, 2400, 4800, 9600, 19200, 38400, 62500)
+    # the datasheet gives -147 dBm at 2.4kbps, the others are estimated
+    _SENSITIVITY_DBM = (-147, -147, -147, -144, -141, -138, -134, -130)
+
     @staticmethod
     def get_description(air_data_rate):
-        if air_data_rate == AirDataRate.AIR_DATA_RATE_000_24:
-            return "2.4kbps"
-        elif air_data_rate == AirDataRate.AIR_DATA_RATE_001_24:
-            return "2.4kbps"
-        elif air_data_rate == AirDataRate.AIR_DATA_RATE_010_24:
-            return "2.4kbps (default)"
-        elif air_data_rate == AirDataRate.AIR_DATA_RATE_011_48:
-            return "4.8kbps"
-        elif air_data_rate == AirDataRate.AIR_DATA_RATE_100_96:
-            return "9.6kbps"
-        elif air_data_rate == AirDataRate.AIR_DATA_RATE_101_192:
-            return "19.2kbps"
-        elif air_data_rate == AirDataRate.AIR_DATA_RATE_110_384:
-            return "38.4kbps"
-        elif air_data_rate == AirDataRate.AIR_DATA_RATE_111_625:
-            return "62.5kbps"
-        else:
-            return "Invalid Air Data Rate!"
+        return _lookup(
+            AirDataRate._DESCRIPTIONS, air_data_rate, "Invalid Air Data Rate!"
+        )
+
+    @staticmethod
+    def get_bps(air_data_rate):
+        return _lookup(AirDataRate._BPS, air_data_rate)
+
+    @staticmethod
+    def get_sensitivity_dbm(air_data_rate):
+        return _lookup(AirDataRate._SENSITIVITY_DBM, air_data_rate)
+
+    @staticmethod
+    def is_valid(air_data_rate):
+        return _lookup(AirDataRate._BPS, air_data_rate) is not None
 
 
 class SubPacketSetting:
@@ -101,38 +128,39 @@ class SubPacketSetting:
     SPS_064_10 = 0b10
     SPS_032_11 = 0b11
 
+    _DESCRIPTIONS = ("200bytes (default)", "128bytes", "64bytes", "32bytes")
+    _BYTES = (200, 128, 64, 32)
+
     @staticmethod
     def get_description(sub_packet_setting):
-        if sub_packet_setting == SubPacketSetting.SPS_200_00:
-            return "200bytes (default)"
-        elif sub_packet_setting == SubPacketSetting.SPS_128_01:
-            return "128bytes"
-        elif sub_packet_setting == SubPacketSetting.SPS_064_10:
-            return "64bytes"
-        elif sub_packet_setting == SubPacketSetting.SPS_032_11:
-            return "32bytes"
-        else:
-            return "Invalid Sub Packet Setting!"
+        return _lookup(
+            SubPacketSetting._DESCRIPTIONS,
+            sub_packet_setting,
+            "Invalid Sub Packet Setting!",
+        )
+
+    @staticmethod
+    def get_bytes(sub_packet_setting):
+        return _lookup(SubPacketSetting._BYTES, sub_packet_setting)
+
+    @staticmethod
+    def is_valid(sub_packet_setting):
+        return _lookup(SubPacketSetting._BYTES, sub_packet_setting) is not None
 
 
 class RssiAmbientNoiseEnable:
     RSSI_AMBIENT_NOISE_ENABLED = 0b1
     RSSI_AMBIENT_NOISE_DISABLED = 0b0
 
+    _DESCRIPTIONS = ("Disabled (default)", "Enabled")
+
     @staticmethod
     def get_description(rssi_ambient_noise_enabled):
-        if (
-            rssi_ambient_noise_enabled
-            == RssiAmbientNoiseEnable.RSSI_AMBIENT_NOISE_ENABLED
-        ):
-            return "Enabled"
-        elif (
-            rssi_ambient_noise_enabled
-            == RssiAmbientNoiseEnable.RSSI_AMBIENT_NOISE_DISABLED
-        ):
-            return "Disabled (default)"
-        else:
-            return "Invalid RSSI Ambient Noise enabled!"
+        return _lookup(
+            RssiAmbientNoiseEnable._DESCRIPTIONS,
+            rssi_ambient_noise_enabled,
+            "Invalid RSSI Ambient Noise enabled!",
+        )
 
 
 class WorPeriod:
@@ -145,68 +173,73 @@ class WorPeriod:
     WOR_3500_110 = 0b110
     WOR_4000_111 = 0b111
 
+    _DESCRIPTIONS = (
+        "500ms",
+        "1000ms",
+        "1500ms",
+        "2000ms (default)",
+        "2500ms",
+        "3000ms",
+        "3500ms",
+        "4000ms",
+    )
+    _MS = (500, 1000, 1500, 2000, 2500, 3000, 3500, 4000)
+
     @staticmethod
     def get_description(wor_period):
-        if wor_period == WorPeriod.WOR_500_000:
-            return "500ms"
-        elif wor_period == WorPeriod.WOR_1000_001:
-            return "1000ms"
-        elif wor_period == WorPeriod.WOR_1500_010:
-            return "1500ms"
-        elif wor_period == WorPeriod.WOR_2000_011:
-            return "2000ms (default)"
-        elif wor_period == WorPeriod.WOR_2500_100:
-            return "2500ms"
-        elif wor_period == WorPeriod.WOR_3000_101:
-            return "3000ms"
-        elif wor_period == WorPeriod.WOR_3500_110:
-            return "3500ms"
-        elif wor_period == WorPeriod.WOR_4000_111:
-            return "4000ms"
-        else:
-            return "Invalid WOR period!"
+        return _lookup(WorPeriod._DESCRIPTIONS, wor_period, "Invalid WOR period!")
+
+    @staticmethod
+    def get_ms(wor_period):
+        return _lookup(WorPeriod._MS, wor_period)
+
+    @staticmethod
+    def is_valid(wor_period):
+        return _lookup(WorPeriod._MS, wor_period) is not None
 
 
 class LbtEnableByte:
     LBT_ENABLED = 0b1
     LBT_DISABLED = 0b0
 
+    _DESCRIPTIONS = ("Disabled (default)", "Enabled")
+
     @staticmethod
     def get_description(lbt_enable_byte):
-        if lbt_enable_byte == LbtEnableByte.LBT_ENABLED:
-            return "Enabled"
-        elif lbt_enable_byte == LbtEnableByte.LBT_DISABLED:
-            return "Disabled (default)"
-        else:
-            return "Invalid LBT enable byte!"
+        return _lookup(
+            LbtEnableByte._DESCRIPTIONS, lbt_enable_byte, "Invalid LBT enable byte!"
+        )
 
 
 class RssiEnableByte:
     RSSI_ENABLED = 0b1
     RSSI_DISABLED = 0b0
 
+    _DESCRIPTIONS = ("Disabled (default)", "Enabled")
+
     @staticmethod
     def get_description(rssi_enable_byte):
-        if rssi_enable_byte == RssiEnableByte.RSSI_ENABLED:
-            return "Enabled"
-        elif rssi_enable_byte == RssiEnableByte.RSSI_DISABLED:
-            return "Disabled (default)"
-        else:
-            return "Invalid RSSI enable byte!"
+        return _lookup(
+            RssiEnableByte._DESCRIPTIONS, rssi_enable_byte, "Invalid RSSI enable byte!"
+        )
 
 
 class FixedTransmission:
     TRANSPARENT_TRANSMISSION = 0b0
     FIXED_TRANSMISSION = 0b1
 
+    _DESCRIPTIONS = (
+        "Transparent transmission (default)",
+        "Fixed transmission (first three bytes can be used as high/low address and channel)",
+    )
+
     @staticmethod
     def get_description(fixed_transmission):
-        if fixed_transmission == FixedTransmission.TRANSPARENT_TRANSMISSION:
-            return "Transparent transmission (default)"
-        elif fixed_transmission == FixedTransmission.FIXED_TRANSMISSION:
-            return "Fixed transmission (first three bytes can be used as high/low address and channel)"
-        else:
-            return "Invalid fixed transmission param!"
+        return _lookup(
+            FixedTransmission._DESCRIPTIONS,
+            fixed_transmission,
+            "Invalid fixed transmission param!",
+        )
 
 
 class TransmissionPower22:
@@ -215,18 +248,24 @@ class TransmissionPower22:
     POWER_13 = 0b10
     POWER_10 = 0b11
 
+    _DESCRIPTIONS = ("22dBm (Default)", "17dBm", "13dBm", "10dBm")
+    _DBM = (22, 17, 13, 10)
+
     @staticmethod
     def get_description(transmission_power):
-        if transmission_power == TransmissionPower22.POWER_22:
-            return "22dBm (Default)"
-        elif transmission_power == TransmissionPower22.POWER_17:
-            return "17dBm"
-        elif transmission_power == TransmissionPower22.POWER_13:
-            return "13dBm"
-        elif transmission_power == TransmissionPower22.POWER_10:
-            return "10dBm"
-        else:
-            return "Invalid transmission power param"
+        return _lookup(
+            TransmissionPower22._DESCRIPTIONS,
+            transmission_power,
+            "Invalid transmission power param",
+        )
+
+    @staticmethod
+    def get_dbm(transmission_power):
+        return _lookup(TransmissionPower22._DBM, transmission_power)
+
+    @staticmethod
+    def is_valid(transmission_power):
+        return _lookup(TransmissionPower22._DBM, transmission_power) is not None
 
     @staticmethod
     def get_default_value():
@@ -239,18 +278,24 @@ class TransmissionPower30:
     POWER_24 = 0b10
     POWER_21 = 0b11
 
+    _DESCRIPTIONS = ("30dBm (Default)", "27dBm", "24dBm", "21dBm")
+    _DBM = (30, 27, 24, 21)
+
     @staticmethod
     def get_description(transmission_power):
-        if transmission_power == TransmissionPower30.POWER_30:
-            return "30dBm (Default)"
-        elif transmission_power == TransmissionPower30.POWER_27:
-            return "27dBm"
-        elif transmission_power == TransmissionPower30.POWER_24:
-            return "24dBm"
-        elif transmission_power == TransmissionPower30.POWER_21:
-            return "21dBm"
-        else:
-            return "Invalid transmission power param"
+        return _lookup(
+            TransmissionPower30._DESCRIPTIONS,
+            transmission_power,
+            "Invalid transmission power param",
+        )
+
+    @staticmethod
+    def get_dbm(transmission_power):
+        return _lookup(TransmissionPower30._DBM, transmission_power)
+
+    @staticmethod
+    def is_valid(transmission_power):
+        return _lookup(TransmissionPower30._DBM, transmission_power) is not None
 
     @staticmethod
     def get_default_value():
@@ -293,29 +338,99 @@ class OperatingFrequency:
         return OperatingFrequency.get_value_from_frequency(device_frequency) + channel
 
 
-# model is like 433T20D or 433T27D or 433T30D or 868T20S or 868T27S or 868T30S
-# the part before T is the frequency (example 433)
-# the part after T is the transmission power (example 20)
+# The capabilities of a module model, parsed once for every model string by
+# get_model_capabilities() and shared by all the classes that need them
+ModelCapabilities = namedtuple(
+    "ModelCapabilities",
+    (
+        "model",
+        "frequency",
+        "base_frequency",
+        "channels",
+        "kind",
+        "max_power_dbm",
+        "power_table",
+        "air_data_rates",
+        "package_type",
+    ),
+)
+
+# frequency band: (base frequency MHz, number of channels)
+_BANDS = {"230": (220, 64), "400": (410, 84), "900": (850, 81)}
+_POWER_TABLES = {"22": TransmissionPower22, "30": TransmissionPower30}
+_KINDS = ("MM", "T", "R", "M")
+# all the LLCC68 based modules support every air data rate code
+_AIR_DATA_RATES = tuple(range(len(AirDataRate._BPS)))
+
+_model_capabilities = {}
+
+
+# model is like 900T22D or 400T30D or 230T22S or 400MM22S
+# the first 3 digits are the frequency band (example 900)
+# then there is the kind of module (T, R, M or MM)
+# the 2 digits after it are the max transmission power (example 22)
 # the last letter is the package type, D is for discrete S is for SMD  (example D)
+def get_model_capabilities(model) -> ModelCapabilities:
+    capabilities = _model_capabilities.get(model)
+    if capabilities is not None:
+        return capabilities
+
+    if not isinstance(model, str) or len(model) < 7:
+        raise ValueError("Invalid model")
+
+    band = _BANDS.get(model[0:3])
+    kind = None
+    for candidate in _KINDS:
+        if model.startswith(candidate, 3):
+            kind = candidate
+            break
+    if band is None or kind is None:
+        raise ValueError("Invalid model")
+
+    power = model[3 + len(kind) : 5 + len(kind)]
+    package_type = model[5 + len(kind) :]
+    if power not in _POWER_TABLES or package_type not in ("S", "D"):
+        raise ValueError("Invalid model")
+
+    capabilities = ModelCapabilities(
+        model,
+        int(model[0:3]),
+        band[0],
+        band[1],
+        kind,
+        int(power),
+        _POWER_TABLES[power],
+        _AIR_DATA_RATES,
+        package_type,
+    )
+    _model_capabilities[model] = capabilities
+    return capabilities
+
+
 class TransmissionPower:
     def __init__(self, model):
         self.model = model
         self.package_type = None
         self.frequency = None
         self.transmission_power = None
+        self.capabilities = None
 
         if model is not None:
-            self.package_type = model[6]
-            self.frequency = int(model[0:3])
-            self.transmission_power = int(model[4:6])
+            self.capabilities = get_model_capabilities(model)
+            self.package_type = self.capabilities.package_type
+            self.frequency = self.capabilities.frequency
+            self.transmission_power = self.capabilities.max_power_dbm
 
     def get_transmission_power(self):
-        if self.transmission_power == self.transmission_power:
+        if self.capabilities is None:
             return TransmissionPower22
-        elif self.transmission_power == self.transmission_power:
-            return TransmissionPower30
-        else:
-            return "Invalid transmission power param"
+        return self.capabilities.power_table
 
     def get_transmission_power_description(self, transmission_power):
         return self.get_transmission_power().get_description(transmission_power)
+
+    def get_transmission_power_dbm(self, transmission_power):
+        return self.get_transmission_power().get_dbm(transmission_power)
+
+    def is_valid(self, transmission_power):
+        return self.get_transmission_power().is_valid(transmission_power)
@@ -0,0 +1,65 @@
+import adafruit_ticks as ticks
+
+_FNV_OFFSET = 0x811C9DC5
+_FNV_PRIME = 0x01000193
+
+
+# 30 bit FNV-1a hash of a payload (bytes, bytearray or memoryview), small
+# enough to stay a small int on CircuitPython
+def payload_hash(payload) -> int:
+    value = _FNV_OFFSET
+    for byte in payload:
+        value = ((value ^ byte) * _FNV_PRIME) & 0xFFFFFFFF
+    return value & 0x3FFFFFFF
+
+
+# The duplicate cache remembers the last max_entries messages received, by
+# (source, sequence) when the link header is there or by a hash of the
+# payload, for at most ttl_ms from the first time it is seen: the copies
+# received later do not extend it. When the cache is full the oldest entry
+# is evicted.
+class DuplicateCache:
+    def __init__(self, max_entries=32, ttl_ms=30000):
+        self.max_entries = max_entries
+        self.ttl_ms = ttl_ms
+
+        self.suppressed = 0
+        self.evicted = 0
+
+        self._seen = {}
+
+    def _evict(self, now):
+        oldest = None
+        oldest_age = -1
+        for key, seen in self._seen.items():
+            age = ticks.ticks_diff(now, seen)
+            if age > oldest_age:
+                oldest = key
+                oldest_age = age
+        del self._seen[oldest]
+        self.evicted += 1
+
+    # True (and counted as suppressed) if the message has been seen first
+    # within ttl_ms, otherwise it is remembered
+    def is_duplicate(self, payload=None, source=None, sequence=None) -> bool:
+        if source is not None and sequence is not None:
+            key = (source, sequence)
+        else:
+            key = payload_hash(payload)
+
+        now = ticks.ticks_ms()
+        seen = self._seen.get(key)
+        if seen is not None and ticks.ticks_diff(now, seen) <= self.ttl_ms:
+            self.suppressed += 1
+            return True
+
+        if seen is None and len(self._seen) >= self.max_entries:
+            self._evict(now)
+        self._seen[key] = now
+        return False
+
+    def __len__(self):
+        return len(self._seen)
+
+    def clear(self):
+        self._seen = {}
@@ -0,0 +1,182 @@
+import adafruit_ticks as ticks
+
+from lora_e220 import Configuration, get_airtime_ms, get_frame_airtime_ms
+from lora_e220_constants import SubPacketSetting, WorPeriod, get_model_capabilities
+from lora_e220_operation_constant import ModeType
+
+# currents from the datasheets by max transmission power of the model:
+# (TX at max power, RX, sleep) in uA
+_CURRENTS = {22: (110000, 16800, 5), 30: (620000, 17200, 5)}
+
+_MODES = (
+    ModeType.MODE_0_NORMAL,
+    ModeType.MODE_1_WOR_TRANSMITTER,
+    ModeType.MODE_2_WOR_RECEIVER,
+    ModeType.MODE_3_PROGRAM,
+)
+
+
+# hours a battery of capacity_mah lasts at an average current of average_ua
+def projected_battery_life_hours(capacity_mah, average_ua):
+    if average_ua <= 0:
+        return None
+    return capacity_mah * 1000 / average_ua
+
+
+# The energy model estimates the current of the module in each mode and the
+# charge of each message from the datasheet currents and the configuration
+# (air data rate, sub packet size, transmission power and WOR period). The
+# charges are integers in nC (uA * ms).
+class EnergyModel:
+    def __init__(self, model, configuration=None):
+        self.capabilities = get_model_capabilities(model)
+        if configuration is None:
+            configuration = Configuration(model)
+        self.configuration = configuration
+
+        self.tx_max_ua, self.rx_ua, self.sleep_ua = _CURRENTS[
+            self.capabilities.max_power_dbm
+        ]
+
+    # the TX current at lower power is scaled with the output voltage of the
+    # power amplifier (square root of the output power) over the RX current
+    def tx_current_ua(self) -> int:
+        dbm = self.capabilities.power_table.get_dbm(
+            self.configuration.OPTION.transmissionPower
+        )
+        if dbm is None:
+            return self.tx_max_ua
+        ratio = 10 ** ((dbm - self.capabilities.max_power_dbm) / 20)
+        return self.rx_ua + int((self.tx_max_ua - self.rx_ua) * ratio)
+
+    def wor_period_ms(self) -> int:
+        return WorPeriod.get_ms(self.configuration.TRANSMISSION_MODE.WORPeriod)
+
+    # in WOR receiver mode the module sleeps and listens for a preamble once
+    # every WOR period, for the time on air of a preamble and header
+    def mode_current_ua(self, mode) -> int:
+        if mode == ModeType.MODE_0_NORMAL or mode == ModeType.MODE_1_WOR_TRANSMITTER:
+            return self.rx_ua
+        if mode == ModeType.MODE_2_WOR_RECEIVER:
+            listen = get_airtime_ms(0, self.configuration.SPED.airDataRate)
+            return self.sleep_ua + self.rx_ua * listen // self.wor_period_ms()
+        return self.sleep_ua
+
+    def airtime_ms(self, size) -> int:
+        return get_frame_airtime_ms(
+            size,
+            self.configuration.SPED.airDataRate,
+            SubPacketSetting.get_bytes(self.configuration.OPTION.subPacketSetting),
+        )
+
+    # charge of a send above the current of the mode, in WOR transmitter mode
+    # the message is preceded by a preamble as long as the WOR period
+    def send_charge_nc(self, size, mode=ModeType.MODE_0_NORMAL) -> int:
+        on_air = self.airtime_ms(size)
+        if mode == ModeType.MODE_1_WOR_TRANSMITTER:
+            on_air += self.wor_period_ms()
+        return on_air * (self.tx_current_ua() - self.mode_current_ua(mode))
+
+    # charge of a receive above the current of the mode (nothing in normal
+    # mode, where the module is always receiving)
+    def receive_charge_nc(self, size, mode=ModeType.MODE_0_NORMAL) -> int:
+        extra = self.rx_ua - self.mode_current_ua(mode)
+        if extra <= 0:
+            return 0
+        return self.airtime_ms(size) * extra
+
+    # average current of a node that stays in mode and sends and receives
+    # the given messages of size bytes per hour
+    def average_current_ua(self, mode, sent_per_hour=0, received_per_hour=0, size=32):
+        charge = sent_per_hour * self.send_charge_nc(
+            size, mode
+        ) + received_per_hour * self.receive_charge_nc(size, mode)
+        return self.mode_current_ua(mode) + charge / 3600000
+
+    def projected_battery_life_hours(
+        self, capacity_mah, mode, sent_per_hour=0, received_per_hour=0, size=32
+    ):
+        return projected_battery_life_hours(
+            capacity_mah,
+            self.average_current_ua(mode, sent_per_hour, received_per_hour, size),
+        )
+
+
+# The energy meter accumulates the estimated charge of a LoRaE220 instance:
+# the time spent in each mode (from set_mode) and the charge of every send
+# and receive above the current of the mode, with the live configuration.
+class EnergyMeter:
+    def __init__(self, lora):
+        self.lora = lora
+        self.model = EnergyModel(lora.model, lora.configuration)
+
+        self.reset()
+        lora.energy = self
+
+    def reset(self):
+        self.mode_ms = [0] * len(_MODES)
+        self.mode_nc = [0] * len(_MODES)
+        self.tx_nc = 0
+        self.rx_nc = 0
+        self.sends = 0
+        self.receives = 0
+
+        self._mode = self.lora.mode
+        self._since = ticks.ticks_ms()
+
+    def _sync_configuration(self):
+        if (
+            self.lora.configuration is not None
+            and self.lora.configuration is not self.model.configuration
+        ):
+            self.model.configuration = self.lora.configuration
+
+    # close the time spent in the current mode up to now
+    def update(self):
+        now = ticks.ticks_ms()
+        elapsed = ticks.ticks_diff(now, self._since)
+        self._since = now
+        if self._mode not in _MODES or elapsed <= 0:
+            return
+
+        self._sync_configuration()
+        self.mode_ms[self._mode] += elapsed
+        self.mode_nc[self._mode] += elapsed * self.model.mode_current_ua(self._mode)
+
+    def mode_changed(self, mode):
+        self.update()
+        self._mode = mode
+
+    def add_send(self, size):
+        self._sync_configuration()
+        self.sends += 1
+        self.tx_nc += self.model.send_charge_nc(size, self.lora.mode)
+
+    def add_receive(self, size):
+        self._sync_configuration()
+        self.receives += 1
+        self.rx_nc += self.model.receive_charge_nc(size, self.lora.mode)
+
+    def elapsed_ms(self) -> int:
+        self.update()
+        return sum(self.mode_ms)
+
+    def total_nc(self) -> int:
+        self.update()
+        return sum(self.mode_nc) + self.tx_nc + self.rx_nc
+
+    def total_mah(self):
+        return self.total_nc() / 3600000000
+
+    def average_current_ua(self):
+        elapsed = self.elapsed_ms()
+        if elapsed <= 0:
+            return None
+        return self.total_nc() / elapsed
+
+    # battery life at the average current measured so far
+    def projected_battery_life_hours(self, capacity_mah):
+        average = self.average_current_ua()
+        if average is None:
+            return None
+        return projected_battery_life_hours(capacity_mah, average)
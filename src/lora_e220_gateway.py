@@ -0,0 +1,227 @@
+import adafruit_ticks as ticks
+
+from lora_e220 import BROADCAST_ADDRESS, Logger, Statistics
+from lora_e220_link import parse_link_frame
+from lora_e220_operation_constant import ResponseStatusCode
+
+logging = Logger(False)
+
+logger = logging.getLogger(__name__)
+
+
+class GatewayMessage:
+    def __init__(self, radio, channel, payload, rssi=None, source=None, sequence=None):
+        self.radio = radio
+        self.channel = channel
+        self.payload = payload
+        self.rssi = rssi
+        self.source = source
+        self.sequence = sequence
+        self.timestamp = ticks.ticks_ms()
+
+    def decode(self):
+        return str(self.payload, "utf-8")
+
+    def to_dict(self):
+        import json
+
+        return json.loads(self.decode())
+
+
+class _Radio:
+    def __init__(self, lora, channel, rssi):
+        self.lora = lora
+        self.channel = channel
+        self.rssi = rssi
+        self.queue = []
+
+
+# A gateway owns several LoRaE220 instances (each one with its own UART and
+# channel) and services them without blocking on any of them: the received
+# messages of all the radios are merged in a single queue tagged with the
+# radio index and channel, and the outbound messages are spread on the radio
+# with the lowest load. The payloads are bytes (binary frames are received
+# as they are), a frame that fails to be processed is counted in rx_errors
+# and a message whose send fails in tx_dropped. With the link statistics
+# (lora_e220_link) the messages carry the link header, stripped and
+# accounted per source.
+class LoRaE220Gateway:
+    def __init__(self, max_queue=16, max_received=32, link_statistics=None):
+        self.max_queue = max_queue
+        self.max_received = max_received
+        self.link_statistics = link_statistics
+
+        self.rx_dropped = 0
+        self.rx_errors = 0
+        self.tx_dropped = 0
+
+        self._radios = []
+        self._received = []
+
+    def add_radio(self, lora, channel, rssi=False) -> int:
+        self._radios.append(_Radio(lora, channel, rssi))
+        return len(self._radios) - 1
+
+    def get_radio(self, index):
+        return self._radios[index].lora
+
+    def __len__(self):
+        return len(self._radios)
+
+    def load(self, index) -> int:
+        radio = self._radios[index]
+        return len(radio.queue) + (1 if radio.lora.is_busy() else 0)
+
+    def _select_radio(self):
+        selected = None
+        selected_load = None
+        for index in range(len(self._radios)):
+            if len(self._radios[index].queue) >= self.max_queue:
+                continue
+            load = self.load(index)
+            if selected_load is None or load < selected_load:
+                selected = index
+                selected_load = load
+                if load == 0:
+                    break
+        return selected
+
+    def _enqueue(self, ADDH, ADDL, CHAN, message) -> ResponseStatusCode:
+        index = self._select_radio()
+        if index is None:
+            logger.debug("All the radio queues are full!")
+            return ResponseStatusCode.ERR_E220_BUF_TOO_SMALL
+
+        self._radios[index].queue.append((ADDH, ADDL, CHAN, message))
+        self._service_tx(index)
+        return ResponseStatusCode.E220_SUCCESS
+
+    def send_fixed_message(self, ADDH, ADDL, CHAN, message) -> ResponseStatusCode:
+        return self._enqueue(ADDH, ADDL, CHAN, message)
+
+    def send_fixed_dict(self, ADDH, ADDL, CHAN, dict_message) -> ResponseStatusCode:
+        import json
+
+        return self._enqueue(ADDH, ADDL, CHAN, json.dumps(dict_message))
+
+    def send_broadcast_message(self, CHAN, message) -> ResponseStatusCode:
+        return self._enqueue(BROADCAST_ADDRESS, BROADCAST_ADDRESS, CHAN, message)
+
+    def send_broadcast_dict(self, CHAN, dict_message) -> ResponseStatusCode:
+        import json
+
+        return self._enqueue(
+            BROADCAST_ADDRESS, BROADCAST_ADDRESS, CHAN, json.dumps(dict_message)
+        )
+
+    def _service_tx(self, index):
+        radio = self._radios[index]
+        if not radio.queue or radio.lora.is_busy():
+            return
+
+        ADDH, ADDL, CHAN, message = radio.queue.pop(0)
+        code = radio.lora.send_fixed_message(ADDH, ADDL, CHAN, message, wait=False)
+        if code != ResponseStatusCode.E220_SUCCESS:
+            self.tx_dropped += 1
+            logger.error(
+                "Radio {} send failed: {}".format(
+                    index, ResponseStatusCode.get_description(code)
+                )
+            )
+
+    def _service_rx(self, index) -> int:
+        radio = self._radios[index]
+        if radio.lora.available() <= 0:
+            return 0
+
+        message = None
+        for message in radio.lora.messages(0, 1, radio.rssi):
+            pass
+        if message is None:
+            return 0
+
+        source = None
+        sequence = None
+        rssi = message.rssi
+        payload = message.payload
+        if self.link_statistics is not None:
+            parsed = parse_link_frame(payload)
+            if parsed is None:
+                return 0
+            source, sequence, payload = parsed
+            if not self.link_statistics.update(source, sequence, rssi):
+                # a duplicate
+                return 0
+
+        if len(self._received) >= self.max_received:
+            self._received.pop(0)
+            self.rx_dropped += 1
+        self._received.append(
+            GatewayMessage(index, radio.channel, bytes(payload), rssi, source, sequence)
+        )
+        return 1
+
+    def service(self, index) -> int:
+        # a bad frame must not stop the gateway (and the run() task)
+        try:
+            received = self._service_rx(index)
+        except Exception as e:
+            self.rx_errors += 1
+            logger.error("Radio {} receive failed: {}".format(index, e))
+            received = 0
+        self._service_tx(index)
+        return received
+
+    def poll(self) -> int:
+        received = 0
+        for index in range(len(self._radios)):
+            received += self.service(index)
+        return received
+
+    def available(self) -> int:
+        return len(self._received)
+
+    def receive(self):
+        if not self._received:
+            return None
+        return self._received.pop(0)
+
+    def messages(self):
+        self.poll()
+        while self._received:
+            yield self._received.pop(0)
+
+    async def _run_radio(self, index, interval):
+        import asyncio
+
+        while True:
+            self.service(index)
+            await asyncio.sleep(interval)
+
+    async def run(self, interval_ms=0):
+        # one task per radio, so a slow UART read on a radio does not delay
+        # the others more than a single service step
+        import asyncio
+
+        interval = interval_ms / 1000
+        await asyncio.gather(
+            *[
+                asyncio.create_task(self._run_radio(index, interval))
+                for index in range(len(self._radios))
+            ]
+        )
+
+    def queued(self) -> int:
+        return sum(len(radio.queue) for radio in self._radios)
+
+    # a PeerSnapshot for each source, see LinkStatistics.snapshot()
+    def link_health(self):
+        if self.link_statistics is None:
+            return []
+        return self.link_statistics.snapshot()
+
+    def get_statistics(self) -> Statistics:
+        statistics = Statistics()
+        for radio in self._radios:
+            statistics.add(radio.lora.stats)
+        return statistics
@@ -0,0 +1,310 @@
+from collections import namedtuple
+
+import adafruit_ticks as ticks
+
+from lora_e220 import Logger, get_rssi_dbm, payload_size
+from lora_e220_operation_constant import ResponseStatusCode
+
+logging = Logger(False)
+
+logger = logging.getLogger(__name__)
+
+# the link header before the payload: source ADDH, ADDL and a 16 bit
+# sequence number (big endian)
+LINK_HEADER_SIZE = 4
+
+SEQUENCE_MODULO = 0x10000
+# the sequence numbers behind the highest one tracked for duplicates and
+# reordering, older ones are taken as a restart of the sender
+SEQUENCE_WINDOW = 32
+
+# the RSSI histogram has RSSI_BUCKETS buckets of RSSI_BUCKET_DB dB from
+# RSSI_MIN_DBM, it is halved when RSSI_HISTORY_MAX samples are reached so the
+# quantiles follow the recent samples
+RSSI_MIN_DBM = -148
+RSSI_BUCKET_DB = 4
+RSSI_BUCKETS = 32
+RSSI_HISTORY_MAX = 1024
+
+
+def get_address(ADDH, ADDL):
+    return (ADDH << 8) | ADDL
+
+
+# pack the link header and message in buffer, returns the size or None if it
+# does not fit
+def pack_link_frame(buffer, source, sequence, message):
+    if isinstance(message, str):
+        message = message.encode("utf-8")
+    size = LINK_HEADER_SIZE + payload_size(message)
+    if size > len(buffer):
+        return None
+    buffer[0] = (source >> 8) & 0xFF
+    buffer[1] = source & 0xFF
+    buffer[2] = (sequence >> 8) & 0xFF
+    buffer[3] = sequence & 0xFF
+    buffer[LINK_HEADER_SIZE:size] = message
+    return size
+
+
+# the source, sequence number and payload (a view) of a link frame, None if
+# it is too short
+def parse_link_frame(frame):
+    if len(frame) < LINK_HEADER_SIZE:
+        return None
+    view = memoryview(frame)
+    return (
+        (view[0] << 8) | view[1],
+        (view[2] << 8) | view[3],
+        view[LINK_HEADER_SIZE:],
+    )
+
+
+PeerSnapshot = namedtuple(
+    "PeerSnapshot",
+    (
+        "source",
+        "received",
+        "lost",
+        "duplicates",
+        "reordered",
+        "loss_percent",
+        "jitter_ms",
+        "rssi_p10_dbm",
+        "rssi_p50_dbm",
+        "rssi_p90_dbm",
+        "age_ms",
+    ),
+)
+
+
+class PeerStatistics:
+    def __init__(self, source, sequence, now):
+        self.source = source
+        self.received = 0
+        self.lost = 0
+        self.duplicates = 0
+        self.reordered = 0
+        self.restarts = 0
+
+        self.highest = sequence
+        # bit n set when highest - n has been received
+        self.window = 0
+        self.last_arrival = now
+        # averages of the inter-arrival time and of its deviation, in 1/16 ms
+        self.interval = None
+        self.jitter = 0
+
+        self.rssi_histogram = [0] * RSSI_BUCKETS
+        self.rssi_samples = 0
+
+    def _add_sequence(self, sequence):
+        ahead = (sequence - self.highest) % SEQUENCE_MODULO
+        if self.received == 0:
+            self.window = 1
+            self.highest = sequence
+        elif ahead == 0:
+            self.duplicates += 1
+            return False
+        elif ahead < SEQUENCE_MODULO // 2:
+            self.lost += ahead - 1
+            self.window = ((self.window << ahead) | 1) & ((1 << SEQUENCE_WINDOW) - 1)
+            self.highest = sequence
+        else:
+            behind = SEQUENCE_MODULO - ahead
+            if behind >= SEQUENCE_WINDOW:
+                # the sender restarted its sequence
+                self.restarts += 1
+                self.window = 1
+                self.highest = sequence
+            elif self.window & (1 << behind):
+                self.duplicates += 1
+                return False
+            else:
+                # counted as lost when a later one arrived
+                self.window |= 1 << behind
+                self.reordered += 1
+                self.lost -= 1
+        self.received += 1
+        return True
+
+    def _add_arrival(self, now):
+        interval = ticks.ticks_diff(now, self.last_arrival) * 16
+        self.last_arrival = now
+        if self.received <= 1:
+            return
+        if self.interval is None:
+            self.interval = interval
+            return
+        deviation = abs(interval - self.interval)
+        self.interval += (interval - self.interval) // 8
+        self.jitter += (deviation - self.jitter) // 16
+
+    def _add_rssi(self, rssi):
+        bucket = (get_rssi_dbm(rssi) - RSSI_MIN_DBM) // RSSI_BUCKET_DB
+        bucket = min(max(bucket, 0), RSSI_BUCKETS - 1)
+        self.rssi_histogram[bucket] += 1
+        self.rssi_samples += 1
+        if self.rssi_samples >= RSSI_HISTORY_MAX:
+            self.rssi_samples = 0
+            for index in range(RSSI_BUCKETS):
+                self.rssi_histogram[index] //= 2
+                self.rssi_samples += self.rssi_histogram[index]
+
+    # the (lower bound of the bucket of the) percent quantile of the RSSI
+    def rssi_quantile_dbm(self, percent):
+        if self.rssi_samples == 0:
+            return None
+        rank = self.rssi_samples * percent // 100
+        count = 0
+        for index in range(RSSI_BUCKETS):
+            count += self.rssi_histogram[index]
+            if count > rank:
+                return RSSI_MIN_DBM + index * RSSI_BUCKET_DB
+        return RSSI_MIN_DBM + (RSSI_BUCKETS - 1) * RSSI_BUCKET_DB
+
+    def loss_percent(self):
+        expected = self.received + self.lost
+        if expected <= 0:
+            return 0
+        return self.lost * 100 // expected
+
+    def snapshot(self, now) -> PeerSnapshot:
+        return PeerSnapshot(
+            self.source,
+            self.received,
+            self.lost,
+            self.duplicates,
+            self.reordered,
+            self.loss_percent(),
+            self.jitter // 16,
+            self.rssi_quantile_dbm(10),
+            self.rssi_quantile_dbm(50),
+            self.rssi_quantile_dbm(90),
+            ticks.ticks_diff(now, self.last_arrival),
+        )
+
+
+# The link statistics keep a PeerStatistics for at most max_peers sources:
+# a new source replaces one not heard for stale_ms or, if none, the one not
+# heard for the longest time.
+class LinkStatistics:
+    def __init__(self, max_peers=16, stale_ms=600000):
+        self.max_peers = max_peers
+        self.stale_ms = stale_ms
+        self.evicted = 0
+
+        self._peers = {}
+
+    def _evict(self, now):
+        oldest = None
+        for source, peer in self._peers.items():
+            if ticks.ticks_diff(now, peer.last_arrival) > self.stale_ms:
+                oldest = source
+                break
+            if oldest is None or ticks.ticks_less(
+                peer.last_arrival, self._peers[oldest].last_arrival
+            ):
+                oldest = source
+        del self._peers[oldest]
+        self.evicted += 1
+
+    # returns False for a duplicate
+    def update(self, source, sequence, rssi=None, now=None) -> bool:
+        if now is None:
+            now = ticks.ticks_ms()
+        peer = self._peers.get(source)
+        if peer is None:
+            if len(self._peers) >= self.max_peers:
+                self._evict(now)
+            peer = PeerStatistics(source, sequence, now)
+            self._peers[source] = peer
+
+        if not peer._add_sequence(sequence):
+            return False
+        peer._add_arrival(now)
+        if rssi is not None:
+            peer._add_rssi(rssi)
+        return True
+
+    def get_peer(self, source) -> PeerStatistics:
+        return self._peers.get(source)
+
+    def __len__(self):
+        return len(self._peers)
+
+    def snapshot(self):
+        now = ticks.ticks_ms()
+        return [peer.snapshot(now) for peer in self._peers.values()]
+
+    def reset(self):
+        self._peers = {}
+        self.evicted = 0
+
+
+# The link layer adds the link header (source address and sequence number)
+# to the messages sent and strips it from the messages received, updating
+# the link statistics (if any) of the sources. The duplicate cache (if any)
+# drops the messages already received by (source, sequence).
+class LinkLayer:
+    def __init__(self, lora, ADDH, ADDL, statistics=None, dedup=None):
+        self.lora = lora
+        self.source = get_address(ADDH, ADDL)
+        self.statistics = statistics
+        self.dedup = dedup
+
+        self.sequence = 0
+
+    def _prepare(self, message):
+        return pack_link_frame(
+            self.lora.tx_buffer(), self.source, self.sequence, message
+        )
+
+    def _sent(self, code) -> ResponseStatusCode:
+        if code == ResponseStatusCode.E220_SUCCESS:
+            self.sequence = (self.sequence + 1) % SEQUENCE_MODULO
+        return code
+
+    def send_transparent_message(self, message, wait=True) -> ResponseStatusCode:
+        size = self._prepare(message)
+        if size is None:
+            return ResponseStatusCode.ERR_E220_PACKET_TOO_BIG
+        return self._sent(self.lora.send_transparent_into(size, wait))
+
+    def send_fixed_message(
+        self, ADDH, ADDL, CHAN, message, wait=True
+    ) -> ResponseStatusCode:
+        size = self._prepare(message)
+        if size is None:
+            return ResponseStatusCode.ERR_E220_PACKET_TOO_BIG
+        return self._sent(self.lora.send_fixed_into(ADDH, ADDL, CHAN, size, wait))
+
+    def send_broadcast_message(self, CHAN, message, wait=True) -> ResponseStatusCode:
+        size = self._prepare(message)
+        if size is None:
+            return ResponseStatusCode.ERR_E220_PACKET_TOO_BIG
+        return self._sent(self.lora.send_broadcast_into(CHAN, size, wait))
+
+    # the message with the link header stripped and its source and sequence
+    # set, None if it has no header or is a duplicate
+    def accept(self, message):
+        parsed = parse_link_frame(message.payload)
+        if parsed is None:
+            self.lora.stats.errors += 1
+            return None
+        message.source, message.sequence, message.payload = parsed
+        if self.dedup is not None and self.dedup.is_duplicate(
+            source=message.source, sequence=message.sequence
+        ):
+            return None
+        if self.statistics is not None and not self.statistics.update(
+            message.source, message.sequence, message.rssi, message.timestamp
+        ):
+            return None
+        return message
+
+    # see LoRaE220.messages()
+    def messages(self, timeout=None, max_batch=None, rssi=False):
+        for message in self.lora.messages(timeout, max_batch, rssi):
+            if self.accept(message) is not None:
+                yield message
@@ -0,0 +1,322 @@
+import adafruit_ticks as ticks
+
+from lora_e220 import BROADCAST_ADDRESS, Logger, Message, get_rssi_dbm, payload_size
+from lora_e220_constants import RssiEnableByte
+from lora_e220_dedup import DuplicateCache
+from lora_e220_link import SEQUENCE_MODULO, get_address
+from lora_e220_operation_constant import ResponseStatusCode
+
+logging = Logger(False)
+
+logger = logging.getLogger(__name__)
+
+MESH_DATA = 1
+# a route request, flooded until it reaches the destination
+MESH_ROUTE_REQUEST = 2
+# the answer of the destination, sent back along the learned route
+MESH_ROUTE_REPLY = 3
+
+# type, ttl, hops, origin, destination, sequence, previous hop (the last 4
+# are 16 bit big endian)
+MESH_HEADER_SIZE = 11
+
+MESH_BROADCAST = get_address(BROADCAST_ADDRESS, BROADCAST_ADDRESS)
+
+# RSSI of a neighbor heard without the RSSI byte
+_RSSI_UNKNOWN_DBM = -256
+
+
+def _put_address(buffer, offset, address):
+    buffer[offset] = (address >> 8) & 0xFF
+    buffer[offset + 1] = address & 0xFF
+
+
+def _get_address(view, offset):
+    return (view[offset] << 8) | view[offset + 1]
+
+
+class Route:
+    def __init__(self, next_hop, hops, rssi_dbm, now):
+        self.next_hop = next_hop
+        self.hops = hops
+        self.rssi_dbm = rssi_dbm
+        self.updated = now
+
+
+# A mesh node forwards the messages over more hops on a single channel (the
+# module must be in fixed transmission mode). Every frame heard teaches the
+# node a route to its origin through the neighbor that sent it, so the
+# unicast messages are forwarded hop by hop along the learned routes (one
+# transmission per hop). Only the route requests of discover() are flooded,
+# limited by the TTL and dropped when already seen.
+class MeshNode:
+    def __init__(
+        self,
+        lora,
+        ADDH,
+        ADDL,
+        CHAN,
+        max_hops=4,
+        max_routes=32,
+        route_ttl_ms=600000,
+        max_pending=4,
+        flood_jitter_ms=20,
+        dedup=None,
+    ):
+        self.lora = lora
+        self.address = get_address(ADDH, ADDL)
+        self.CHAN = CHAN
+        self.max_hops = max_hops
+        self.max_routes = max_routes
+        self.route_ttl_ms = route_ttl_ms
+        self.max_pending = max_pending
+        self.flood_jitter_ms = flood_jitter_ms
+        if dedup is None:
+            dedup = DuplicateCache(max_entries=2 * max_routes)
+        self.dedup = dedup
+
+        self.sequence = 0
+
+        self.originated = 0
+        self.forwarded = 0
+        self.delivered = 0
+        self.no_route = 0
+        self.discoveries = 0
+
+        self._routes = {}
+        # messages waiting for a route: (destination, payload)
+        self._pending = []
+
+    def _next_sequence(self):
+        sequence = self.sequence
+        self.sequence = (self.sequence + 1) % SEQUENCE_MODULO
+        return sequence
+
+    def _send_frame(
+        self, next_hop, kind, ttl, hops, origin, destination, sequence, payload
+    ) -> ResponseStatusCode:
+        buffer = self.lora.tx_buffer()
+        size = MESH_HEADER_SIZE + payload_size(payload)
+        if size > len(buffer):
+            return ResponseStatusCode.ERR_E220_PACKET_TOO_BIG
+
+        buffer[0] = kind
+        buffer[1] = ttl
+        buffer[2] = hops
+        _put_address(buffer, 3, origin)
+        _put_address(buffer, 5, destination)
+        _put_address(buffer, 7, sequence)
+        _put_address(buffer, 9, self.address)
+        buffer[MESH_HEADER_SIZE:size] = payload
+
+        return self.lora.send_fixed_into(
+            (next_hop >> 8) & 0xFF, next_hop & 0xFF, self.CHAN, size
+        )
+
+    def _learn(self, destination, next_hop, hops, rssi_dbm, now):
+        if destination == self.address:
+            return
+        route = self._routes.get(destination)
+        if route is not None:
+            if (
+                route.next_hop == next_hop
+                or hops < route.hops
+                or (hops == route.hops and rssi_dbm > route.rssi_dbm)
+                or ticks.ticks_diff(now, route.updated) > self.route_ttl_ms
+            ):
+                route.next_hop = next_hop
+                route.hops = hops
+                route.rssi_dbm = rssi_dbm
+                route.updated = now
+            return
+
+        if len(self._routes) >= self.max_routes:
+            oldest = None
+            for key, value in self._routes.items():
+                if oldest is None or ticks.ticks_less(
+                    value.updated, self._routes[oldest].updated
+                ):
+                    oldest = key
+            del self._routes[oldest]
+        self._routes[destination] = Route(next_hop, hops, rssi_dbm, now)
+
+    def get_route(self, ADDH, ADDL) -> Route:
+        route = self._routes.get(get_address(ADDH, ADDL))
+        if route is not None and (
+            ticks.ticks_diff(ticks.ticks_ms(), route.updated) > self.route_ttl_ms
+        ):
+            return None
+        return route
+
+    def routes(self):
+        return {
+            destination: (route.next_hop, route.hops, route.rssi_dbm)
+            for destination, route in self._routes.items()
+        }
+
+    def discover(self, ADDH, ADDL) -> ResponseStatusCode:
+        self.discoveries += 1
+        sequence = self._next_sequence()
+        # not forwarded back to us by the neighbors
+        self.dedup.is_duplicate(source=self.address, sequence=sequence)
+        return self._send_frame(
+            MESH_BROADCAST,
+            MESH_ROUTE_REQUEST,
+            self.max_hops,
+            0,
+            self.address,
+            get_address(ADDH, ADDL),
+            sequence,
+            b"",
+        )
+
+    # send message to the node ADDH ADDL along the learned route, without a
+    # route the message waits (at most max_pending) for a discovery and
+    # E220_QUEUED is returned once the route request is sent
+    def send(self, ADDH, ADDL, message) -> ResponseStatusCode:
+        if isinstance(message, str):
+            message = message.encode("utf-8")
+        if MESH_HEADER_SIZE + payload_size(message) > len(self.lora.tx_buffer()):
+            return ResponseStatusCode.ERR_E220_PACKET_TOO_BIG
+
+        destination = get_address(ADDH, ADDL)
+        route = self.get_route(ADDH, ADDL)
+        if route is None:
+            if len(self._pending) >= self.max_pending:
+                return ResponseStatusCode.ERR_E220_BUF_TOO_SMALL
+            self._pending.append((destination, bytes(message)))
+            code = self.discover(ADDH, ADDL)
+            if code != ResponseStatusCode.E220_SUCCESS:
+                return code
+            return ResponseStatusCode.E220_QUEUED
+
+        self.originated += 1
+        return self._send_frame(
+            route.next_hop,
+            MESH_DATA,
+            self.max_hops,
+            0,
+            self.address,
+            destination,
+            self._next_sequence(),
+            message,
+        )
+
+    # send the waiting messages whose destination has now a route
+    def _flush_pending(self):
+        pending = self._pending
+        self._pending = []
+        for destination, payload in pending:
+            ADDH = (destination >> 8) & 0xFF
+            ADDL = destination & 0xFF
+            if self.get_route(ADDH, ADDL) is None:
+                self._pending.append((destination, payload))
+            else:
+                self.send(ADDH, ADDL, payload)
+
+    # handle a received message (with the RSSI byte if enabled): the routes
+    # are learned, the frames for other nodes forwarded and the data for this
+    # node returned as a Message with the origin as source, None otherwise
+    def handle(self, message):
+        view = message.payload
+        if len(view) < MESH_HEADER_SIZE:
+            return None
+
+        kind = view[0]
+        if kind not in (MESH_DATA, MESH_ROUTE_REQUEST, MESH_ROUTE_REPLY):
+            return None
+        ttl = view[1]
+        hops = view[2] + 1
+        origin = _get_address(view, 3)
+        destination = _get_address(view, 5)
+        sequence = _get_address(view, 7)
+        previous = _get_address(view, 9)
+
+        now = ticks.ticks_ms()
+        rssi_dbm = _RSSI_UNKNOWN_DBM
+        if message.rssi is not None:
+            rssi_dbm = get_rssi_dbm(message.rssi)
+        self._learn(previous, previous, 1, rssi_dbm, now)
+        self._learn(origin, previous, hops, rssi_dbm, now)
+        if self._pending:
+            self._flush_pending()
+
+        if origin == self.address or self.dedup.is_duplicate(
+            source=origin, sequence=sequence
+        ):
+            return None
+
+        if destination == self.address:
+            if kind == MESH_ROUTE_REQUEST:
+                route = self._routes[origin]
+                self._send_frame(
+                    route.next_hop,
+                    MESH_ROUTE_REPLY,
+                    self.max_hops,
+                    0,
+                    self.address,
+                    origin,
+                    self._next_sequence(),
+                    b"",
+                )
+                return None
+            if kind == MESH_DATA:
+                self.delivered += 1
+                return Message(
+                    view[MESH_HEADER_SIZE:],
+                    message.rssi,
+                    origin,
+                    message.timestamp,
+                    sequence,
+                )
+            return None
+
+        if ttl <= 1:
+            return None
+
+        payload = view[MESH_HEADER_SIZE:]
+        if kind == MESH_ROUTE_REQUEST:
+            route = self._routes.get(destination)
+            if route is None or route.next_hop == previous:
+                next_hop = MESH_BROADCAST
+                # the neighbors that heard the same request do not all
+                # rebroadcast it at the same time
+                if self.flood_jitter_ms > 0:
+                    import random
+
+                    self.lora.managed_delay(random.randint(0, self.flood_jitter_ms))
+            else:
+                # the route is known: no need to flood any further
+                next_hop = route.next_hop
+        else:
+            route = self._routes.get(destination)
+            if route is None:
+                self.no_route += 1
+                return None
+            next_hop = route.next_hop
+
+        self.forwarded += 1
+        self._send_frame(
+            next_hop, kind, ttl - 1, hops, origin, destination, sequence, payload
+        )
+        return None
+
+    # the RSSI byte is appended to the packets received when the module
+    # configuration (if known) enables it
+    def _rssi_enabled(self) -> bool:
+        configuration = self.lora.configuration
+        return (
+            configuration is not None
+            and configuration.TRANSMISSION_MODE.enableRSSI
+            == RssiEnableByte.RSSI_ENABLED
+        )
+
+    # the data received for this node, see LoRaE220.messages(); rssi None
+    # follows the module configuration
+    def messages(self, timeout=None, max_batch=None, rssi=None):
+        if rssi is None:
+            rssi = self._rssi_enabled()
+        for message in self.lora.messages(timeout, max_batch, rssi):
+            message = self.handle(message)
+            if message is not None:
+                yield message
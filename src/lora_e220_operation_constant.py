@@ -30,6 +30,14 @@ class RegisterAddress:
     REG_ADDRESS_PID = 0x08
 
 
+# the RSSI registers, read with COMMAND + address + length in normal and WOR
+# transmitter mode when OPTION.RSSIAmbientNoise is enabled
+class RssiRegister:
+    COMMAND = b"\xc0\xc1\xc2\xc3"
+    AMBIENT_NOISE = 0x00
+    LAST_RECEIVE = 0x01
+
+
 class PacketLength:
     PL_CONFIGURATION = 0x08
     PL_SPED = 0x01
@@ -59,45 +67,42 @@ class ResponseStatusCode:
     ERR_E220_JSON_PARSE = 15
     ERR_E220_DEINIT_UART_FAILED = 16
     ERR_E220_WRONG_FORMAT = 17
+    ERR_E220_DUPLICATE = 18
+    ERR_E220_CRC_MISMATCH = 19
+    # accepted but not sent yet (a mesh message waiting for a route)
+    E220_QUEUED = 20
+
+    _DESCRIPTIONS = (
+        None,
+        "Success",
+        "Unknown",
+        "Not support!",
+        "Not implement",
+        "Not initial!",
+        "Invalid param!",
+        "Data size not match!",
+        "Buff too small!",
+        "Timeout!!",
+        "Hardware error!",
+        "Save mode returned not recognized!",
+        "No response from device! (Check wiring)",
+        "Wrong UART configuration! (parity must be 8N1 for configuration)",
+        "The device support only 58byte of data transmission!",
+        "JSON parse error!",
+        "Deinit UART failed!",
+        "Wrong format!",
+        "Duplicate message!",
+        "CRC mismatch!",
+        "Queued",
+    )
 
     @staticmethod
     def get_description(status):
-        if status == ResponseStatusCode.E220_SUCCESS:
-            return "Success"
-        elif status == ResponseStatusCode.ERR_E220_UNKNOWN:
-            return "Unknown"
-        elif status == ResponseStatusCode.ERR_E220_NOT_SUPPORT:
-            return "Not support!"
-        elif status == ResponseStatusCode.ERR_E220_NOT_IMPLEMENT:
-            return "Not implement"
-        elif status == ResponseStatusCode.ERR_E220_NOT_INITIAL:
-            return "Not initial!"
-        elif status == ResponseStatusCode.ERR_E220_INVALID_PARAM:
-            return "Invalid param!"
-        elif status == ResponseStatusCode.ERR_E220_DATA_SIZE_NOT_MATCH:
-            return "Data size not match!"
-        elif status == ResponseStatusCode.ERR_E220_BUF_TOO_SMALL:
-            return "Buff too small!"
-        elif status == ResponseStatusCode.ERR_E220_TIMEOUT:
-            return "Timeout!!"
-        elif status == ResponseStatusCode.ERR_E220_HARDWARE:
-            return "Hardware error!"
-        elif status == ResponseStatusCode.ERR_E220_HEAD_NOT_RECOGNIZED:
-            return "Save mode returned not recognized!"
-        elif status == ResponseStatusCode.ERR_E220_NO_RESPONSE_FROM_DEVICE:
-            return "No response from device! (Check wiring)"
-        elif status == ResponseStatusCode.ERR_E220_WRONG_UART_CONFIG:
-            return "Wrong UART configuration! (BPS must be 9600 for configuration)"
-        elif status == ResponseStatusCode.ERR_E220_PACKET_TOO_BIG:
-            return "The device support only 58byte of data transmission!"
-        elif status == ResponseStatusCode.ERR_E220_JSON_PARSE:
-            return "JSON parse error!"
-        elif status == ResponseStatusCode.ERR_E220_DEINIT_UART_FAILED:
-            return "Deinit UART failed!"
-        elif status == ResponseStatusCode.ERR_E220_WRONG_FORMAT:
-            return "Wrong format!"
-        else:
-            return "Invalid status!"
+        if isinstance(status, int) and 0 < status < len(
+            ResponseStatusCode._DESCRIPTIONS
+        ):
+            return ResponseStatusCode._DESCRIPTIONS[status]
+        return "Invalid status!"
 
 
 class SerialUARTBaudRate:
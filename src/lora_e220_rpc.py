@@ -0,0 +1,382 @@
+import random
+
+import adafruit_ticks as ticks
+
+from lora_e220 import WAIT_MARGIN_MS, Logger, Message, payload_size
+from lora_e220_link import get_address
+from lora_e220_operation_constant import ResponseStatusCode
+
+logging = Logger(False)
+
+logger = logging.getLogger(__name__)
+
+RPC_REQUEST = 0xA5
+RPC_RESPONSE = 0xA6
+
+# kind, correlation id (16 bit big endian) and the address (ADDH, ADDL, CHAN)
+# of the sender: the caller in a request (where to reply), the callee in a
+# response
+RPC_HEADER_SIZE = 6
+
+RPC_ID_MODULO = 0x10000
+
+
+def _pack_rpc_frame(buffer, kind, call_id, ADDH, ADDL, CHAN, message):
+    if isinstance(message, str):
+        message = message.encode("utf-8")
+    size = RPC_HEADER_SIZE + payload_size(message)
+    if size > len(buffer):
+        return None
+    buffer[0] = kind
+    buffer[1] = (call_id >> 8) & 0xFF
+    buffer[2] = call_id & 0xFF
+    buffer[3] = ADDH
+    buffer[4] = ADDL
+    buffer[5] = CHAN
+    buffer[RPC_HEADER_SIZE:size] = message
+    return size
+
+
+# the kind, correlation id, sender address (ADDH, ADDL, CHAN) and body (a
+# view) of an RPC frame, None if it is not one
+def parse_rpc_frame(frame):
+    if len(frame) < RPC_HEADER_SIZE or frame[0] not in (RPC_REQUEST, RPC_RESPONSE):
+        return None
+    view = memoryview(frame)
+    return (
+        view[0],
+        (view[1] << 8) | view[2],
+        (view[3], view[4], view[5]),
+        view[RPC_HEADER_SIZE:],
+    )
+
+
+# A call in flight: code is None until the response arrives
+# (E220_SUCCESS, with payload and rssi set) or the deadline expires
+# (ERR_E220_TIMEOUT)
+class RpcCall:
+    def __init__(self, call_id, ADDH, ADDL, CHAN, request, timeout_ms, callback):
+        self.id = call_id
+        self.ADDH = ADDH
+        self.ADDL = ADDL
+        self.CHAN = CHAN
+        self.request = request
+        self.timeout_ms = timeout_ms
+        self.callback = callback
+
+        self.code = None
+        self.payload = None
+        self.rssi = None
+        self.sent = None
+        self.deadline = None
+        self.elapsed_ms = None
+
+    def done(self) -> bool:
+        return self.code is not None
+
+    def decode(self):
+        return str(self.payload, "utf-8")
+
+    def to_dict(self):
+        import json
+
+        return json.loads(self.decode())
+
+
+# The RPC client sends requests to the peers with a correlation id and
+# matches the responses to them as they arrive, so many calls to different
+# peers are in flight at the same time and a late response is never taken
+# for the one of another call. The requests are written one at a time when
+# the module is free (without blocking); the deadline of a call starts then
+# and covers the time on air of the request and of a response of
+# reply_size bytes, the LBT deferral, the processing time of the peer and a
+# margin. The messages received that are not responses are kept (at most
+# max_received) for receive().
+class RpcClient:
+    def __init__(
+        self,
+        lora,
+        ADDH,
+        ADDL,
+        CHAN,
+        max_outstanding=16,
+        reply_size=32,
+        processing_ms=50,
+        max_received=16,
+        rssi=False,
+    ):
+        self.lora = lora
+        self.ADDH = ADDH
+        self.ADDL = ADDL
+        self.CHAN = CHAN
+        self.max_outstanding = max_outstanding
+        self.reply_size = reply_size
+        self.processing_ms = processing_ms
+        self.max_received = max_received
+        self.rssi = rssi
+
+        self.calls = 0
+        self.replies = 0
+        self.timeouts = 0
+        self.late = 0
+        self.rx_dropped = 0
+
+        # a random start, so the responses to the calls made before a reset
+        # are not matched
+        self._next_id = random.randint(0, RPC_ID_MODULO - 1)
+        # calls waiting to be sent, in order
+        self._queue = []
+        # calls sent, by id
+        self._outstanding = {}
+        self._received = []
+
+    def outstanding(self) -> int:
+        return len(self._queue) + len(self._outstanding)
+
+    # the deadline of a call from the write of a request of size bytes
+    def _timeout_ms(self, size, reply_size):
+        lora = self.lora
+        return (
+            lora.frame_busy_ms(3 + size)
+            + lora.lbt_defer_ms()
+            + self.processing_ms
+            + lora.frame_busy_ms(3 + RPC_HEADER_SIZE + reply_size)
+            + lora.lbt_defer_ms()
+            + WAIT_MARGIN_MS
+        )
+
+    # queue a request to the peer ADDH ADDL on CHAN, returns the code and the
+    # RpcCall (None if not queued); callback (if any) is called with the
+    # RpcCall when it is done
+    def call(
+        self,
+        ADDH,
+        ADDL,
+        CHAN,
+        message,
+        timeout_ms=None,
+        reply_size=None,
+        callback=None,
+    ):
+        if self.outstanding() >= self.max_outstanding:
+            return ResponseStatusCode.ERR_E220_BUF_TOO_SMALL, None
+        if isinstance(message, str):
+            message = message.encode("utf-8")
+        size = RPC_HEADER_SIZE + payload_size(message)
+        if size > len(self.lora.tx_buffer()):
+            return ResponseStatusCode.ERR_E220_PACKET_TOO_BIG, None
+
+        if timeout_ms is None:
+            if reply_size is None:
+                reply_size = self.reply_size
+            timeout_ms = self._timeout_ms(size, reply_size)
+
+        call_id = self._next_id
+        self._next_id = (self._next_id + 1) % RPC_ID_MODULO
+        call = RpcCall(call_id, ADDH, ADDL, CHAN, bytes(message), timeout_ms, callback)
+        self._queue.append(call)
+        self.calls += 1
+        self._send_next()
+        return ResponseStatusCode.E220_SUCCESS, call
+
+    def call_dict(
+        self,
+        ADDH,
+        ADDL,
+        CHAN,
+        dict_message,
+        timeout_ms=None,
+        reply_size=None,
+        callback=None,
+    ):
+        import json
+
+        return self.call(
+            ADDH,
+            ADDL,
+            CHAN,
+            json.dumps(dict_message),
+            timeout_ms,
+            reply_size,
+            callback,
+        )
+
+    def _complete(self, call, code, now):
+        call.code = code
+        call.elapsed_ms = ticks.ticks_diff(now, call.sent)
+        if call.callback is not None:
+            call.callback(call)
+
+    def _send_next(self):
+        if not self._queue or self.lora.is_busy():
+            return
+        call = self._queue.pop(0)
+        size = _pack_rpc_frame(
+            self.lora.tx_buffer(),
+            RPC_REQUEST,
+            call.id,
+            self.ADDH,
+            self.ADDL,
+            self.CHAN,
+            call.request,
+        )
+        call.sent = ticks.ticks_ms()
+        call.deadline = ticks.ticks_add(call.sent, call.timeout_ms)
+        code = self.lora.send_fixed_into(
+            call.ADDH, call.ADDL, call.CHAN, size, wait=False
+        )
+        if code != ResponseStatusCode.E220_SUCCESS:
+            logger.error(
+                "RPC send failed: {}".format(ResponseStatusCode.get_description(code))
+            )
+            self._complete(call, code, call.sent)
+            return
+        self._outstanding[call.id] = call
+
+    # match a received message to its call, returns False if it is not a
+    # response
+    def handle(self, message) -> bool:
+        parsed = parse_rpc_frame(message.payload)
+        if parsed is None or parsed[0] != RPC_RESPONSE:
+            return False
+
+        _, call_id, address, body = parsed
+        call = self._outstanding.get(call_id)
+        if call is None or address != (call.ADDH, call.ADDL, call.CHAN):
+            # expired, or the response to a call made before a reset
+            self.late += 1
+            logger.debug("Late RPC response: {}".format(call_id))
+            return True
+
+        del self._outstanding[call_id]
+        call.payload = bytes(body)
+        call.rssi = message.rssi
+        self.replies += 1
+        now = message.timestamp
+        if now is None:
+            now = ticks.ticks_ms()
+        self._complete(call, ResponseStatusCode.E220_SUCCESS, now)
+        return True
+
+    def _expire(self):
+        if not self._outstanding:
+            return
+        now = ticks.ticks_ms()
+        for call_id in list(self._outstanding):
+            call = self._outstanding[call_id]
+            if ticks.ticks_less(now, call.deadline):
+                continue
+            del self._outstanding[call_id]
+            self.timeouts += 1
+            self._complete(call, ResponseStatusCode.ERR_E220_TIMEOUT, now)
+
+    # send the next request, match the responses received and expire the
+    # calls past their deadline, without blocking; to call in the main loop
+    def poll(self) -> int:
+        received = 0
+        for message in self.lora.messages(0, None, self.rssi):
+            if self.handle(message):
+                received += 1
+                continue
+            if len(self._received) >= self.max_received:
+                self._received.pop(0)
+                self.rx_dropped += 1
+            self._received.append(
+                Message(
+                    bytes(message.payload),
+                    message.rssi,
+                    message.source,
+                    message.timestamp,
+                )
+            )
+        self._expire()
+        self._send_next()
+        return received
+
+    # poll until all the calls are done or timeout ms (forever if None),
+    # returns E220_SUCCESS if all of them got a response
+    def wait(self, calls, timeout=None) -> ResponseStatusCode:
+        t = ticks.ticks_ms()
+        while True:
+            self.poll()
+            pending = False
+            for call in calls:
+                if call is not None and not call.done():
+                    pending = True
+                    break
+            if not pending:
+                break
+            if timeout is not None and ticks.ticks_diff(ticks.ticks_ms(), t) >= timeout:
+                return ResponseStatusCode.ERR_E220_TIMEOUT
+
+        for call in calls:
+            if call is None or call.code != ResponseStatusCode.E220_SUCCESS:
+                return ResponseStatusCode.ERR_E220_TIMEOUT
+        return ResponseStatusCode.E220_SUCCESS
+
+    def available(self) -> int:
+        return len(self._received)
+
+    # a message received that is not a response (with a bytes payload)
+    def receive(self):
+        if not self._received:
+            return None
+        return self._received.pop(0)
+
+
+# The RPC server answers the requests received with the response returned
+# by handler, called with the request as a Message (body as payload, caller
+# address as source); a response of None sends nothing, a dict is sent as
+# JSON.
+class RpcServer:
+    def __init__(self, lora, ADDH, ADDL, CHAN, handler):
+        self.lora = lora
+        self.ADDH = ADDH
+        self.ADDL = ADDL
+        self.CHAN = CHAN
+        self.handler = handler
+
+        self.requests = 0
+        self.responses = 0
+
+    # answer a received message, returns False if it is not a request
+    def handle(self, message) -> bool:
+        parsed = parse_rpc_frame(message.payload)
+        if parsed is None or parsed[0] != RPC_REQUEST:
+            return False
+
+        _, call_id, address, body = parsed
+        self.requests += 1
+        ADDH, ADDL, CHAN = address
+        response = self.handler(
+            Message(body, message.rssi, get_address(ADDH, ADDL), message.timestamp)
+        )
+        if response is None:
+            return True
+        if isinstance(response, dict):
+            import json
+
+            response = json.dumps(response)
+
+        size = _pack_rpc_frame(
+            self.lora.tx_buffer(),
+            RPC_RESPONSE,
+            call_id,
+            self.ADDH,
+            self.ADDL,
+            self.CHAN,
+            response,
+        )
+        if size is None:
+            logger.error("RPC response too big!")
+            return True
+        code = self.lora.send_fixed_into(ADDH, ADDL, CHAN, size, wait=False)
+        if code == ResponseStatusCode.E220_SUCCESS:
+            self.responses += 1
+        return True
+
+    # the messages received that are not requests, see LoRaE220.messages()
+    def messages(self, timeout=None, max_batch=None, rssi=False):
+        for message in self.lora.messages(timeout, max_batch, rssi):
+            if not self.handle(message):
+                yield message
@@ -0,0 +1,300 @@
+import struct
+from binascii import crc32
+
+from lora_e220 import Logger, payload_size
+from lora_e220_operation_constant import ResponseStatusCode
+
+logging = Logger(False)
+
+logger = logging.getLogger(__name__)
+
+# the header of the log file: magic, slot size, number of slots, sequence of
+# the last message delivered and CRC32 of the previous fields. There are two
+# copies written in turn, so a write torn by a reset leaves the other one
+STORE_MAGIC = b"E2SQ"
+_HEADER = "<4sHHI"
+STORE_HEADER_SIZE = struct.calcsize(_HEADER) + 4
+_RECORDS_OFFSET = 2 * STORE_HEADER_SIZE
+
+# a record: sequence, ADDH, ADDL, CHAN, payload size, the payload padded to
+# the slot size and CRC32 of the header and payload
+_RECORD = "<IBBBB"
+_RECORD_HEADER_SIZE = struct.calcsize(_RECORD)
+
+
+def _crc(data) -> int:
+    return crc32(data) & 0xFFFFFFFF
+
+
+# The store and forward queue keeps the messages to send in a circular log
+# file of slots fixed size records, so they survive a reset and are sent
+# when the link is back. The messages queued are committed to the file in
+# batches of max_batch (or by flush()), and the ones still in the batch when
+# the queue drains are sent without being written at all. When the queue is
+# full the oldest message is evicted. The sequence of the last message
+# delivered is kept in the header and written once for each service(). When
+# the file can not be written (CIRCUITPY is read only unless boot.py remounts
+# it) the messages are kept in RAM only.
+class StoreAndForwardQueue:
+    def __init__(
+        self,
+        lora,
+        path="/lora_e220.q",
+        slots=64,
+        slot_size=64,
+        max_batch=4,
+        send=None,
+    ):
+        self.lora = lora
+        self.path = path
+        self.slots = slots
+        self.slot_size = slot_size
+        self.max_batch = min(max_batch, slots)
+        # the send of a message (ADDH, ADDL, CHAN, message) returning a
+        # ResponseStatusCode, like LbtSender.send_fixed_message
+        if send is None:
+            send = lora.send_fixed_message
+        self.send = send
+
+        self.record_size = _RECORD_HEADER_SIZE + slot_size + 4
+
+        self.queued = 0
+        self.delivered = 0
+        self.evicted = 0
+        self.failures = 0
+        self.corrupt = 0
+        self.commits = 0
+
+        # the messages queued not yet in the file: (sequence, ADDH, ADDL,
+        # CHAN, payload); they are the sequences from _flushed to _next
+        self._batch = []
+        self._open()
+
+    def _header(self, acked):
+        header = struct.pack(
+            _HEADER, STORE_MAGIC, self.slot_size, self.slots, acked & 0xFFFFFFFF
+        )
+        return header + struct.pack("<I", _crc(header))
+
+    # the sequence of the last message delivered of a valid header copy, None
+    # for a torn one
+    def _parse_header(self, header):
+        if len(header) != STORE_HEADER_SIZE:
+            return None
+        acked = struct.unpack_from(_HEADER, header, 0)[3]
+        if header != self._header(acked):
+            return None
+        return acked
+
+    # overwrite the older copy of the header
+    def _write_header(self, file, acked):
+        file.seek(self._header_index * STORE_HEADER_SIZE)
+        file.write(self._header(acked))
+        self._header_index ^= 1
+
+    def _record(self, sequence, ADDH, ADDL, CHAN, payload):
+        record = bytearray(self.record_size)
+        size = len(payload)
+        struct.pack_into(_RECORD, record, 0, sequence, ADDH, ADDL, CHAN, size)
+        record[_RECORD_HEADER_SIZE : _RECORD_HEADER_SIZE + size] = payload
+        end = self.record_size - 4
+        struct.pack_into("<I", record, end, _crc(memoryview(record)[:end]))
+        return record
+
+    def _offset(self, sequence):
+        return _RECORDS_OFFSET + (sequence % self.slots) * self.record_size
+
+    def _format(self):
+        with open(self.path, "wb") as file:
+            file.write(self._header(0))
+            file.write(self._header(0))
+            empty = bytes(self.record_size)
+            for _ in range(self.slots):
+                file.write(empty)
+        self._committed = 0
+        self._header_index = 0
+
+    # the sequence of a valid record, None for an empty or torn one
+    def _parse(self, record):
+        end = self.record_size - 4
+        if len(record) != self.record_size:
+            return None
+        (crc,) = struct.unpack_from("<I", record, end)
+        if crc != _crc(memoryview(record)[:end]):
+            return None
+        sequence, _, _, _, size = struct.unpack_from(_RECORD, record, 0)
+        if size > self.slot_size:
+            return None
+        return sequence
+
+    # read the newest valid header copy and scan the records for the last
+    # sequence written, so only a record at a time is in memory; a missing
+    # file or one with another slot size or number of slots is formatted
+    # again
+    def _open(self):
+        acked = None
+        last = None
+        self._header_index = 0
+        try:
+            with open(self.path, "rb") as file:
+                for index in range(2):
+                    copy = self._parse_header(file.read(STORE_HEADER_SIZE))
+                    if copy is not None and (acked is None or copy > acked):
+                        acked = copy
+                        self._header_index = index ^ 1
+                if acked is not None:
+                    for _ in range(self.slots):
+                        sequence = self._parse(file.read(self.record_size))
+                        if sequence is not None and sequence > acked:
+                            if last is None or sequence > last:
+                                last = sequence
+        except OSError:
+            pass
+
+        if acked is None:
+            try:
+                self._format()
+                logger.debug("Store and forward file formatted: {}".format(self.path))
+            except OSError as e:
+                logger.error(
+                    "Store and forward file {} not writable, queue in RAM: {}".format(
+                        self.path, e
+                    )
+                )
+                self.path = None
+            acked = 0
+
+        self._committed = acked
+        self._next = acked + 1 if last is None else last + 1
+        # the older sequences have been overwritten
+        self._oldest = max(acked + 1, self._next - self.slots)
+        self._flushed = self._next
+
+    def __len__(self):
+        return self._next - self._oldest
+
+    def _evict(self):
+        if self._oldest >= self._flushed:
+            self._batch.pop(0)
+            self._flushed += 1
+        self._oldest += 1
+        self.evicted += 1
+
+    def send_fixed_message(self, ADDH, ADDL, CHAN, message) -> ResponseStatusCode:
+        if isinstance(message, str):
+            message = message.encode("utf-8")
+        if payload_size(message) > self.slot_size:
+            return ResponseStatusCode.ERR_E220_PACKET_TOO_BIG
+
+        if len(self) >= self.slots:
+            self._evict()
+        self._batch.append((self._next, ADDH, ADDL, CHAN, bytes(message)))
+        self._next += 1
+        self.queued += 1
+        if len(self._batch) >= self.max_batch:
+            self.flush()
+        return ResponseStatusCode.E220_SUCCESS
+
+    def send_fixed_dict(self, ADDH, ADDL, CHAN, dict_message) -> ResponseStatusCode:
+        import json
+
+        return self.send_fixed_message(ADDH, ADDL, CHAN, json.dumps(dict_message))
+
+    # the sequence of the last message delivered, that is not in the file
+    def _acked(self):
+        return min(self._oldest, self._flushed) - 1
+
+    # write the batch and the header with a single open of the file
+    def flush(self):
+        acked = self._acked()
+        if self.path is None or (not self._batch and acked == self._committed):
+            return
+        with open(self.path, "r+b") as file:
+            for sequence, ADDH, ADDL, CHAN, payload in self._batch:
+                file.seek(self._offset(sequence))
+                file.write(self._record(sequence, ADDH, ADDL, CHAN, payload))
+            self._write_header(file, acked)
+        self._batch = []
+        self._flushed = self._next
+        self._committed = acked
+        self.commits += 1
+
+    def _commit_acked(self):
+        acked = self._acked()
+        if self.path is None or acked == self._committed:
+            return
+        with open(self.path, "r+b") as file:
+            self._write_header(file, acked)
+        self._committed = acked
+        self.commits += 1
+
+    # the oldest message (ADDH, ADDL, CHAN, payload), None if its record is
+    # lost
+    def _peek(self, file):
+        if self._oldest >= self._flushed:
+            return self._batch[0][1:]
+        file.seek(self._offset(self._oldest))
+        record = file.read(self.record_size)
+        if self._parse(record) != self._oldest:
+            return None
+        _, ADDH, ADDL, CHAN, size = struct.unpack_from(_RECORD, record, 0)
+        return (
+            ADDH,
+            ADDL,
+            CHAN,
+            memoryview(record)[_RECORD_HEADER_SIZE : _RECORD_HEADER_SIZE + size],
+        )
+
+    def _pop(self):
+        if self._oldest >= self._flushed:
+            self._batch.pop(0)
+            self._flushed += 1
+        self._oldest += 1
+
+    def _deliver(self, file, max_messages) -> int:
+        delivered = 0
+        while len(self) > 0 and (max_messages is None or delivered < max_messages):
+            if self.lora.is_busy():
+                break
+            message = self._peek(file)
+            if message is None:
+                self.corrupt += 1
+                self._pop()
+                continue
+
+            code = self.send(*message)
+            if code != ResponseStatusCode.E220_SUCCESS:
+                self.failures += 1
+                logger.debug(
+                    "Store and forward send failed: {}".format(
+                        ResponseStatusCode.get_description(code)
+                    )
+                )
+                break
+            self._pop()
+            self.delivered += 1
+            delivered += 1
+        return delivered
+
+    # send the queued messages, oldest first, until a send fails or
+    # max_messages are delivered; to call in the main loop
+    def service(self, max_messages=None) -> int:
+        if len(self) == 0:
+            return 0
+
+        if self.path is None:
+            # in RAM all the messages are in the batch
+            delivered = self._deliver(None, max_messages)
+        else:
+            with open(self.path, "rb") as file:
+                delivered = self._deliver(file, max_messages)
+
+        self._commit_acked()
+        return delivered
+
+    # forget all the messages queued
+    def clear(self):
+        self._batch = []
+        self._oldest = self._next
+        self._flushed = self._next
+        self._commit_acked()
@@ -0,0 +1,264 @@
+import adafruit_ticks as ticks
+
+from lora_e220 import MAX_SIZE_TX_PACKET, Logger, get_frame_airtime_ms, get_uart_time_ms
+from lora_e220_link import get_address
+from lora_e220_operation_constant import ResponseStatusCode
+
+logging = Logger(False)
+
+logger = logging.getLogger(__name__)
+
+# beacon: marker, sequence, slot length (ms, 16 bit), number of slots and the
+# address (16 bit) of the node of each slot; the superframe is the beacon
+# slot followed by the slots of the nodes
+TDMA_BEACON = 0xB7
+TDMA_BEACON_HEADER_SIZE = 5
+TDMA_MAX_SLOTS = (MAX_SIZE_TX_PACKET - TDMA_BEACON_HEADER_SIZE) // 2
+
+# the clock drift is estimated in parts per million
+_PPM = 1000000
+
+
+# slot long enough for a message of max_payload bytes (3 more in fixed
+# transmission): the UART transfer, the time on air and a guard time on both
+# sides for the residual clock error of the nodes
+def get_slot_ms(
+    air_data_rate, sub_packet, baudrate, max_payload=MAX_SIZE_TX_PACKET, guard_ms=10
+) -> int:
+    size = max_payload + 3
+    return (
+        get_uart_time_ms(size, baudrate)
+        + get_frame_airtime_ms(size, air_data_rate, sub_packet)
+        + 2 * guard_ms
+    )
+
+
+# time from the start of the write of a beacon of size bytes on the gateway
+# to the end of its read on a node: UART in, time on air, UART out and the
+# silence that ends the frame
+def get_beacon_latency_ms(size, air_data_rate, sub_packet, baudrate) -> int:
+    return (
+        2 * get_uart_time_ms(size, baudrate)
+        + get_frame_airtime_ms(size, air_data_rate, sub_packet)
+        + 40000 // baudrate
+        + 1
+    )
+
+
+# a beacon with the whole schedule, a slot length and at most TDMA_MAX_SLOTS
+# slots (a short or foreign frame with the marker is not one)
+def _is_beacon(payload) -> bool:
+    if len(payload) < TDMA_BEACON_HEADER_SIZE or payload[0] != TDMA_BEACON:
+        return False
+    slots = payload[4]
+    return (
+        slots <= TDMA_MAX_SLOTS
+        and len(payload) >= TDMA_BEACON_HEADER_SIZE + 2 * slots
+        and (payload[2] | payload[3]) != 0
+    )
+
+
+# The TDMA coordinator (on the gateway) assigns a slot to each node and
+# broadcasts a beacon at the start of every superframe with the schedule, so
+# the nodes send only in their slots without collisions.
+class TdmaCoordinator:
+    def __init__(
+        self, lora, CHAN, slot_ms=None, max_payload=MAX_SIZE_TX_PACKET, guard_ms=10
+    ):
+        self.lora = lora
+        self.CHAN = CHAN
+        if slot_ms is None:
+            slot_ms = get_slot_ms(
+                lora.air_data_rate(),
+                lora.sub_packet_size(),
+                lora.uart.baudrate,
+                max_payload,
+                guard_ms,
+            )
+        self.slot_ms = slot_ms
+
+        self.sequence = 0
+        self.beacons = 0
+
+        self._slots = []
+        self._next_beacon = None
+
+    def assign(self, ADDH, ADDL) -> int:
+        address = get_address(ADDH, ADDL)
+        if address in self._slots:
+            return self._slots.index(address)
+        if len(self._slots) >= TDMA_MAX_SLOTS:
+            return None
+        self._slots.append(address)
+        return len(self._slots) - 1
+
+    def release(self, ADDH, ADDL):
+        address = get_address(ADDH, ADDL)
+        if address in self._slots:
+            self._slots.remove(address)
+
+    def superframe_ms(self) -> int:
+        return self.slot_ms * (1 + len(self._slots))
+
+    def send_beacon(self) -> ResponseStatusCode:
+        buffer = self.lora.tx_buffer()
+        buffer[0] = TDMA_BEACON
+        buffer[1] = self.sequence
+        buffer[2] = (self.slot_ms >> 8) & 0xFF
+        buffer[3] = self.slot_ms & 0xFF
+        buffer[4] = len(self._slots)
+        offset = TDMA_BEACON_HEADER_SIZE
+        for address in self._slots:
+            buffer[offset] = (address >> 8) & 0xFF
+            buffer[offset + 1] = address & 0xFF
+            offset += 2
+
+        self._next_beacon = ticks.ticks_add(ticks.ticks_ms(), self.superframe_ms())
+        code = self.lora.send_broadcast_into(self.CHAN, offset, wait=False)
+        self.sequence = (self.sequence + 1) & 0xFF
+        self.beacons += 1
+        return code
+
+    # send the beacon when a superframe starts, to call in the main loop
+    def service(self) -> bool:
+        if self._next_beacon is not None and ticks.ticks_less(
+            ticks.ticks_ms(), self._next_beacon
+        ):
+            return False
+        self.send_beacon()
+        return True
+
+
+# A TDMA node synchronizes on the beacons of the coordinator and sends the
+# queued messages only in its slot. The start of the superframe is the
+# arrival of the beacon less its modeled latency, the drift of the clock is
+# estimated from the time between the beacons and corrected in between, and
+# the node stops sending after max_missed beacons lost.
+class TdmaNode:
+    def __init__(self, lora, ADDH, ADDL, max_queue=8, max_missed=3, guard_ms=10):
+        self.lora = lora
+        self.address = get_address(ADDH, ADDL)
+        self.max_queue = max_queue
+        self.max_missed = max_missed
+        self.guard_ms = guard_ms
+
+        self.slot = None
+        self.slot_ms = None
+        self.slots = 0
+        self.drift_ppm = 0
+        self.beacons = 0
+
+        self._anchor = None
+        self._anchor_sequence = None
+        self._sent_anchor = None
+        self._queue = []
+
+    def superframe_ms(self) -> int:
+        return self.slot_ms * (1 + self.slots)
+
+    # local time of offset ms from the start of the superframe
+    def _local(self, anchor, offset):
+        return ticks.ticks_add(anchor, offset + offset * self.drift_ppm // _PPM)
+
+    def handle(self, message) -> bool:
+        payload = message.payload
+        if not _is_beacon(payload):
+            return False
+
+        received = message.timestamp
+        if received is None:
+            received = ticks.ticks_ms()
+        anchor = ticks.ticks_add(
+            received,
+            -get_beacon_latency_ms(
+                len(payload),
+                self.lora.air_data_rate(),
+                self.lora.sub_packet_size(),
+                self.lora.uart.baudrate,
+            ),
+        )
+        sequence = payload[1]
+        slot_ms = (payload[2] << 8) | payload[3]
+        slots = payload[4]
+
+        # the drift from the superframes elapsed since the last beacon
+        if self._anchor is not None and slot_ms == self.slot_ms and slots == self.slots:
+            elapsed = (sequence - self._anchor_sequence) & 0xFF
+            if 0 < elapsed <= self.max_missed + 1:
+                expected = elapsed * self.superframe_ms()
+                measured = ticks.ticks_diff(anchor, self._anchor)
+                ppm = (measured - expected) * _PPM // expected
+                self.drift_ppm += (ppm - self.drift_ppm) // 4
+
+        self.slot_ms = slot_ms
+        self.slots = slots
+        self._anchor = anchor
+        self._anchor_sequence = sequence
+        self.beacons += 1
+
+        self.slot = None
+        for index in range(slots):
+            offset = TDMA_BEACON_HEADER_SIZE + 2 * index
+            if ((payload[offset] << 8) | payload[offset + 1]) == self.address:
+                self.slot = index
+                break
+        return True
+
+    def synchronized(self) -> bool:
+        if self._anchor is None:
+            return False
+        lost = ticks.ticks_diff(ticks.ticks_ms(), self._anchor)
+        return lost < (self.max_missed + 1) * self.superframe_ms()
+
+    # local time when the slot of the node starts in the current superframe
+    def slot_start(self):
+        if self.slot is None or not self.synchronized():
+            return None
+        superframe = self.superframe_ms()
+        elapsed = ticks.ticks_diff(ticks.ticks_ms(), self._anchor)
+        anchor = self._local(self._anchor, (elapsed // superframe) * superframe)
+        return self._local(anchor, (1 + self.slot) * self.slot_ms)
+
+    # True when a frame of size bytes fits in what is left of the slot
+    def in_slot(self, size) -> bool:
+        start = self.slot_start()
+        if start is None:
+            return False
+        offset = ticks.ticks_diff(ticks.ticks_ms(), start)
+        return (
+            self.guard_ms
+            <= offset
+            <= self.slot_ms - self.guard_ms - self.lora.frame_busy_ms(size)
+        )
+
+    def send_fixed_message(self, ADDH, ADDL, CHAN, message) -> ResponseStatusCode:
+        if len(self._queue) >= self.max_queue:
+            return ResponseStatusCode.ERR_E220_BUF_TOO_SMALL
+        if isinstance(message, str):
+            message = message.encode("utf-8")
+        self._queue.append((ADDH, ADDL, CHAN, message))
+        return ResponseStatusCode.E220_SUCCESS
+
+    def queued(self) -> int:
+        return len(self._queue)
+
+    # send the first queued message if the node is in its slot, one for
+    # each superframe; to call in the main loop
+    def service(self) -> bool:
+        if not self._queue:
+            return False
+        ADDH, ADDL, CHAN, message = self._queue[0]
+        if not self.in_slot(len(message) + 3):
+            return False
+        start = self.slot_start()
+        if self._sent_anchor == start:
+            return False
+
+        self._sent_anchor = start
+        self._queue.pop(0)
+        code = self.lora.send_fixed_message(ADDH, ADDL, CHAN, message, wait=False)
+        if code != ResponseStatusCode.E220_SUCCESS:
+            logger.error(
+                "TDMA send failed: {}".format(ResponseStatusCode.get_description(code))
+            )
+        return True
@@ -0,0 +1,364 @@
+import adafruit_ticks as ticks
+
+from lora_e220 import Logger
+from lora_e220_link import get_address
+from lora_e220_operation_constant import ResponseStatusCode
+
+logging = Logger(False)
+
+logger = logging.getLogger(__name__)
+
+# a record with all the fields: kind, source (16 bit), sequence, the fields
+# present (varint bitmap) and their values (zigzag varints)
+TELEMETRY_KEYFRAME = 0xD0
+# the fields changed since the snapshot of sequence base: kind, source,
+# sequence, base, bitmap and the differences from the snapshot
+TELEMETRY_DELTA = 0xD1
+# the receiver has the record of sequence: kind, source, sequence and the
+# address of the receiver (16 bit)
+TELEMETRY_ACK = 0xD2
+TELEMETRY_ACK_SIZE = 6
+
+TELEMETRY_SEQUENCE_MODULO = 0x100
+
+
+def _zigzag(value):
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def _unzigzag(value):
+    return value >> 1 if not value & 1 else -((value + 1) >> 1)
+
+
+# write value as a varint (7 bits a byte, least significant first) in buffer
+# at offset, returns the offset after it or -1 if it does not fit
+def put_varint(buffer, offset, value):
+    while True:
+        if offset >= len(buffer):
+            return -1
+        if value < 0x80:
+            buffer[offset] = value
+            return offset + 1
+        buffer[offset] = (value & 0x7F) | 0x80
+        value >>= 7
+        offset += 1
+
+
+# the varint in view at offset and the offset after it, None if truncated
+def get_varint(view, offset):
+    value = 0
+    shift = 0
+    while offset < len(view):
+        byte = view[offset]
+        value |= (byte & 0x7F) << shift
+        offset += 1
+        if not byte & 0x80:
+            return value, offset
+        shift += 7
+    return None
+
+
+# the fields of a telemetry stream, in order, with the scale of each one:
+# the values are sent as integers (value * scale rounded), so a float with
+# 2 decimals has scale 100
+class TelemetrySchema:
+    def __init__(self, fields, scales=None):
+        self.fields = tuple(fields)
+        if scales is None:
+            scales = {}
+        self.scales = tuple(scales.get(field, 1) for field in self.fields)
+
+    # the scaled integer values of record, None for the fields missing
+    def to_values(self, record):
+        values = []
+        for index in range(len(self.fields)):
+            value = record.get(self.fields[index])
+            if value is not None:
+                value = int(round(value * self.scales[index]))
+            values.append(value)
+        return values
+
+    def to_record(self, values):
+        record = {}
+        for index in range(len(self.fields)):
+            value = values[index]
+            if value is None:
+                continue
+            scale = self.scales[index]
+            record[self.fields[index]] = value if scale == 1 else value / scale
+        return record
+
+
+class _Stream:
+    def __init__(self, now):
+        self.used = now
+        # the snapshot the receiver acknowledged: sequence and values
+        self.acked_sequence = None
+        self.acked = None
+        # the last records sent waiting for the ACK, or received (sequence,
+        # values)
+        self.pending = []
+        self.since_keyframe = 0
+        self.since_ack = 0
+
+
+def _least_recently_used(streams):
+    oldest = None
+    for key, stream in streams.items():
+        if oldest is None or ticks.ticks_less(stream.used, streams[oldest].used):
+            oldest = key
+    return oldest
+
+
+# The telemetry encoder sends the records of a periodic stream (a dict of
+# the schema fields) as deltas against the last snapshot acknowledged by
+# each destination: only the fields changed, as zigzag varints of the
+# difference, so a steady stream takes a few bytes a record. A keyframe with
+# all the fields is sent when there is no acknowledged snapshot, every
+# keyframe_interval records and after max_pending records without ACK (the
+# decoder may have forgotten the snapshot, its max_history must not be
+# lower). The memory is bounded by max_destinations (the least recently
+# used is forgotten) and max_pending records waiting for their ACK.
+class TelemetryEncoder:
+    def __init__(
+        self,
+        lora,
+        ADDH,
+        ADDL,
+        schema,
+        keyframe_interval=16,
+        max_destinations=8,
+        max_pending=4,
+    ):
+        self.lora = lora
+        self.source = get_address(ADDH, ADDL)
+        self.schema = schema
+        self.keyframe_interval = keyframe_interval
+        self.max_destinations = max_destinations
+        self.max_pending = max_pending
+
+        self.sequence = 0
+        self.keyframes = 0
+        self.deltas = 0
+        self.acks = 0
+        self.bytes_encoded = 0
+
+        self._streams = {}
+
+    def _stream(self, destination, now):
+        stream = self._streams.get(destination)
+        if stream is None:
+            if len(self._streams) >= self.max_destinations:
+                del self._streams[_least_recently_used(self._streams)]
+            stream = _Stream(now)
+            self._streams[destination] = stream
+        stream.used = now
+        return stream
+
+    # encode record for the destination ADDH ADDL in buffer, returns the size
+    # or None if it does not fit
+    def encode(self, ADDH, ADDL, record, buffer):
+        stream = self._stream(get_address(ADDH, ADDL), ticks.ticks_ms())
+        values = self.schema.to_values(record)
+        sequence = self.sequence
+
+        base = stream.acked
+        keyframe = (
+            base is None
+            or stream.since_keyframe >= self.keyframe_interval
+            or stream.since_ack >= self.max_pending
+        )
+
+        if len(buffer) < 5:
+            return None
+        buffer[0] = TELEMETRY_KEYFRAME if keyframe else TELEMETRY_DELTA
+        buffer[1] = (self.source >> 8) & 0xFF
+        buffer[2] = self.source & 0xFF
+        buffer[3] = sequence
+        offset = 4
+        if not keyframe:
+            buffer[4] = stream.acked_sequence
+            offset = 5
+
+        bitmap = 0
+        for index in range(len(values)):
+            value = values[index]
+            if value is None:
+                continue
+            if keyframe or value != base[index]:
+                bitmap |= 1 << index
+        offset = put_varint(buffer, offset, bitmap)
+        if offset < 0:
+            return None
+        for index in range(len(values)):
+            if not bitmap & (1 << index):
+                continue
+            value = values[index]
+            if not keyframe and base[index] is not None:
+                value -= base[index]
+            offset = put_varint(buffer, offset, _zigzag(value))
+            if offset < 0:
+                return None
+
+        if keyframe:
+            stream.since_keyframe = 0
+            self.keyframes += 1
+        else:
+            # unchanged fields missing from the record stay as in the base
+            for index in range(len(values)):
+                if values[index] is None:
+                    values[index] = base[index]
+            self.deltas += 1
+        stream.since_keyframe += 1
+        stream.since_ack += 1
+        stream.pending.append((sequence, values))
+        if len(stream.pending) > self.max_pending:
+            stream.pending.pop(0)
+        self.sequence = (self.sequence + 1) % TELEMETRY_SEQUENCE_MODULO
+        self.bytes_encoded += offset
+        return offset
+
+    def send(self, ADDH, ADDL, CHAN, record, wait=True) -> ResponseStatusCode:
+        size = self.encode(ADDH, ADDL, record, self.lora.tx_buffer())
+        if size is None:
+            return ResponseStatusCode.ERR_E220_PACKET_TOO_BIG
+        return self.lora.send_fixed_into(ADDH, ADDL, CHAN, size, wait)
+
+    # handle the ACK of a destination, returns False if the message is not
+    # an ACK for this encoder
+    def handle(self, message) -> bool:
+        view = message.payload
+        if (
+            len(view) < TELEMETRY_ACK_SIZE
+            or view[0] != TELEMETRY_ACK
+            or ((view[1] << 8) | view[2]) != self.source
+        ):
+            return False
+
+        sequence = view[3]
+        destination = (view[4] << 8) | view[5]
+        stream = self._streams.get(destination)
+        if stream is None:
+            return True
+        for index in range(len(stream.pending)):
+            if stream.pending[index][0] == sequence:
+                stream.acked_sequence, stream.acked = stream.pending[index]
+                # the older ones can not be acknowledged later
+                del stream.pending[: index + 1]
+                stream.since_ack = 0
+                self.acks += 1
+                break
+        return True
+
+
+# The telemetry decoder rebuilds the full records of the streams of at most
+# max_sources encoders (the least recently heard is forgotten), keeping the
+# last max_history records of each one as the snapshots the deltas refer
+# to, and acknowledges every record decoded to its encoder on CHAN.
+class TelemetryDecoder:
+    def __init__(
+        self, lora, ADDH, ADDL, CHAN, schema, max_sources=16, max_history=4, ack=True
+    ):
+        self.lora = lora
+        self.address = get_address(ADDH, ADDL)
+        self.CHAN = CHAN
+        self.schema = schema
+        self.max_sources = max_sources
+        self.max_history = max_history
+        self.ack = ack
+
+        self.keyframes = 0
+        self.deltas = 0
+        self.missing_base = 0
+        self.errors = 0
+
+        self._streams = {}
+
+    def _send_ack(self, source, sequence):
+        buffer = self.lora.tx_buffer()
+        buffer[0] = TELEMETRY_ACK
+        buffer[1] = (source >> 8) & 0xFF
+        buffer[2] = source & 0xFF
+        buffer[3] = sequence
+        buffer[4] = (self.address >> 8) & 0xFF
+        buffer[5] = self.address & 0xFF
+        return self.lora.send_fixed_into(
+            (source >> 8) & 0xFF, source & 0xFF, self.CHAN, TELEMETRY_ACK_SIZE
+        )
+
+    # the source and the full record of a telemetry frame, None if it is not
+    # one or its snapshot is missing
+    def decode(self, payload):
+        view = memoryview(payload)
+        if len(view) < 5 or view[0] not in (TELEMETRY_KEYFRAME, TELEMETRY_DELTA):
+            return None
+        keyframe = view[0] == TELEMETRY_KEYFRAME
+        source = (view[1] << 8) | view[2]
+        sequence = view[3]
+        offset = 4
+
+        now = ticks.ticks_ms()
+        stream = self._streams.get(source)
+        base = None
+        if not keyframe:
+            if len(view) < 6:
+                self.errors += 1
+                return None
+            base_sequence = view[4]
+            offset = 5
+            if stream is not None:
+                for snapshot_sequence, values in stream.pending:
+                    if snapshot_sequence == base_sequence:
+                        base = values
+                        break
+            if base is None:
+                self.missing_base += 1
+                return None
+
+        parsed = get_varint(view, offset)
+        if parsed is None:
+            self.errors += 1
+            return None
+        bitmap, offset = parsed
+        if keyframe:
+            values = [None] * len(self.schema.fields)
+        else:
+            values = list(base)
+        for index in range(len(values)):
+            if not bitmap & (1 << index):
+                continue
+            parsed = get_varint(view, offset)
+            if parsed is None:
+                self.errors += 1
+                return None
+            value, offset = parsed
+            value = _unzigzag(value)
+            if not keyframe and base[index] is not None:
+                value += base[index]
+            values[index] = value
+
+        if stream is None:
+            if len(self._streams) >= self.max_sources:
+                del self._streams[_least_recently_used(self._streams)]
+            stream = _Stream(now)
+            self._streams[source] = stream
+        stream.used = now
+        stream.pending.append((sequence, values))
+        if len(stream.pending) > self.max_history:
+            stream.pending.pop(0)
+        if keyframe:
+            self.keyframes += 1
+        else:
+            self.deltas += 1
+
+        if self.ack:
+            self._send_ack(source, sequence)
+        return source, self.schema.to_record(values)
+
+    # (source, record) for each telemetry frame received, see
+    # LoRaE220.messages()
+    def records(self, timeout=None, max_batch=None, rssi=False):
+        for message in self.lora.messages(timeout, max_batch, rssi):
+            decoded = self.decode(message.payload)
+            if decoded is not None:
+                yield decoded
@@ -0,0 +1,468 @@
+import random
+from binascii import crc32
+from collections import namedtuple
+
+import adafruit_ticks as ticks
+
+from lora_e220 import CRC16_SIZE, WAIT_MARGIN_MS, Logger, Message
+from lora_e220_constants import AirDataRate
+from lora_e220_operation_constant import ResponseStatusCode
+
+logging = Logger(False)
+
+logger = logging.getLogger(__name__)
+
+# start of a transfer: kind, id, size (32 bit), chunk size, CRC32 of the
+# blob and the address (ADDH, ADDL, CHAN) of the sender, where to reply
+BLOB_START = 0xB1
+BLOB_START_SIZE = 14
+# a chunk: kind, id, index (16 bit) and the data; BLOB_DATA_ACK asks for an
+# ACK, it is the last chunk of a window
+BLOB_DATA = 0xB2
+BLOB_DATA_ACK = 0xB3
+BLOB_DATA_HEADER_SIZE = 4
+# kind, id: asks for an ACK again
+BLOB_POLL = 0xB4
+BLOB_POLL_SIZE = 2
+# kind, id, base (16 bit) and a bitmap (32 bit): all the chunks before base
+# have been received, bit n set when the chunk base + n has been received
+BLOB_ACK = 0xB5
+BLOB_ACK_SIZE = 8
+# kind, id, status: the blob has been received (and verified)
+BLOB_DONE = 0xB6
+BLOB_DONE_SIZE = 3
+
+BLOB_DONE_OK = 0
+BLOB_DONE_CRC_MISMATCH = 1
+BLOB_DONE_TOO_BIG = 2
+
+BLOB_MAX_WINDOW = 32
+BLOB_MAX_CHUNKS = 0x10000
+BLOB_ID_MODULO = 0x100
+
+
+def _crc(data) -> int:
+    return crc32(data) & 0xFFFFFFFF
+
+
+def _put_int(buffer, offset, value, size):
+    for index in range(size):
+        buffer[offset + index] = (value >> (8 * (size - 1 - index))) & 0xFF
+
+
+def _get_int(view, offset, size):
+    value = 0
+    for index in range(size):
+        value = (value << 8) | view[offset + index]
+    return value
+
+
+TransferReport = namedtuple(
+    "TransferReport",
+    (
+        "size",
+        "chunks",
+        "sent_chunks",
+        "retransmitted",
+        "resumed_chunks",
+        "elapsed_ms",
+        "goodput_bps",
+        "air_bps",
+        "efficiency_percent",
+    ),
+)
+
+
+# The blob sender transfers a blob (a config file, a firmware delta) to a
+# BlobReceiver in chunks of a sub packet each. The chunks are sent in
+# windows of at most window chunks, the receiver answers the last one with
+# a selective ACK (the first missing chunk and a bitmap of the ones after
+# it), so only the missing chunks are sent again. The receiver verifies the
+# CRC32 of the whole blob. A transfer interrupted (send() returns a
+# timeout) resumes from the chunks already acknowledged when send() is
+# called again with the same blob, that gets the id of the interrupted
+# transfer: the receiver keeps them and reports them in the ACK of the
+# start. Every other blob gets the next id. An empty blob is a single chunk
+# without data. The messages received during a transfer that are not of it
+# are kept (at most max_received) for receive().
+class BlobSender:
+    def __init__(
+        self,
+        lora,
+        ADDH,
+        ADDL,
+        CHAN,
+        window=16,
+        max_retries=5,
+        processing_ms=50,
+        max_received=16,
+        rssi=False,
+    ):
+        self.lora = lora
+        self.ADDH = ADDH
+        self.ADDL = ADDL
+        self.CHAN = CHAN
+        self.window = min(window, BLOB_MAX_WINDOW)
+        self.max_retries = max_retries
+        self.processing_ms = processing_ms
+        self.max_received = max_received
+        self.rssi = rssi
+
+        self.late = 0
+        self.rx_dropped = 0
+        self.report = None
+        self._received = []
+
+        # a random start, so a transfer after a reset is not taken for one
+        # before it
+        self._next_id = random.randint(0, BLOB_ID_MODULO - 1)
+        # size, CRC32 and id of the last transfer not completed
+        self._interrupted = None
+
+    def _transfer_id(self, size, crc):
+        if self._interrupted is not None and self._interrupted[:2] == (size, crc):
+            return self._interrupted[2]
+        transfer_id = self._next_id
+        self._next_id = (self._next_id + 1) % BLOB_ID_MODULO
+        return transfer_id
+
+    # a chunk and its header (and the CRC trailer) fill a sub packet
+    def chunk_size(self) -> int:
+        size = min(self.lora.sub_packet_size(), len(self.lora.tx_buffer()))
+        if self.lora.crc_trailer:
+            size -= CRC16_SIZE
+        return size - BLOB_DATA_HEADER_SIZE
+
+    # the time to wait for the answer of the receiver to the frame just sent
+    def _reply_timeout_ms(self, size):
+        lora = self.lora
+        return (
+            lora.remaining_busy_ms()
+            + lora.lbt_defer_ms()
+            + self.processing_ms
+            + lora.frame_busy_ms(3 + size)
+            + lora.lbt_defer_ms()
+            + WAIT_MARGIN_MS
+        )
+
+    # wait for an ACK or DONE of the transfer, returns (kind, view) or None
+    def _wait_reply(self, transfer_id, size):
+        deadline = ticks.ticks_add(ticks.ticks_ms(), self._reply_timeout_ms(size))
+        while True:
+            remaining = ticks.ticks_diff(deadline, ticks.ticks_ms())
+            if remaining <= 0:
+                return None
+            for message in self.lora.messages(remaining, 1, self.rssi):
+                view = message.payload
+                if (
+                    len(view) >= BLOB_DONE_SIZE
+                    and view[0] in (BLOB_ACK, BLOB_DONE)
+                    and view[1] == transfer_id
+                    and (view[0] == BLOB_DONE or len(view) >= BLOB_ACK_SIZE)
+                ):
+                    return view[0], view
+                if len(view) > 0 and view[0] in (BLOB_ACK, BLOB_DONE):
+                    # of an older transfer
+                    self.late += 1
+                    continue
+                self._keep(message)
+
+    def _keep(self, message):
+        if len(self._received) >= self.max_received:
+            self._received.pop(0)
+            self.rx_dropped += 1
+        self._received.append(
+            Message(
+                bytes(message.payload),
+                message.rssi,
+                message.source,
+                message.timestamp,
+            )
+        )
+
+    def available(self) -> int:
+        return len(self._received)
+
+    # a message received during a transfer that is not of it (with a bytes
+    # payload)
+    def receive(self):
+        if not self._received:
+            return None
+        return self._received.pop(0)
+
+    def _send_frame(self, ADDH, ADDL, CHAN, size, wait):
+        return self.lora.send_fixed_into(ADDH, ADDL, CHAN, size, wait)
+
+    def send(self, ADDH, ADDL, CHAN, blob, transfer_id=None):
+        view = memoryview(blob)
+        size = len(view)
+        chunk_size = self.chunk_size()
+        chunks = max(1, (size + chunk_size - 1) // chunk_size)
+        if chunks > BLOB_MAX_CHUNKS:
+            return ResponseStatusCode.ERR_E220_PACKET_TOO_BIG, None
+        crc = _crc(view)
+        if transfer_id is None:
+            transfer_id = self._transfer_id(size, crc)
+        self._interrupted = (size, crc, transfer_id)
+
+        start = ticks.ticks_ms()
+        buffer = self.lora.tx_buffer()
+        sent_chunks = 0
+        retransmitted = 0
+        resumed_chunks = None
+        # the chunks sent at least once
+        sent = bytearray((chunks + 7) // 8)
+
+        # the start, answered with the chunks the receiver already has
+        buffer[0] = BLOB_START
+        buffer[1] = transfer_id
+        _put_int(buffer, 2, size, 4)
+        buffer[6] = chunk_size
+        _put_int(buffer, 7, crc, 4)
+        buffer[11] = self.ADDH
+        buffer[12] = self.ADDL
+        buffer[13] = self.CHAN
+        frame_size = BLOB_START_SIZE
+        retries = 0
+        progress = None
+        while True:
+            code = self._send_frame(ADDH, ADDL, CHAN, frame_size, False)
+            if code != ResponseStatusCode.E220_SUCCESS:
+                return code, None
+            reply = self._wait_reply(transfer_id, BLOB_ACK_SIZE)
+            if reply is None:
+                retries += 1
+                if retries > self.max_retries:
+                    return ResponseStatusCode.ERR_E220_TIMEOUT, None
+                # a poll if the start has been received
+                if resumed_chunks is not None:
+                    buffer[0] = BLOB_POLL
+                    buffer[1] = transfer_id
+                    frame_size = BLOB_POLL_SIZE
+                continue
+
+            kind, reply_view = reply
+            if kind == BLOB_DONE:
+                status = reply_view[2]
+                if status == BLOB_DONE_OK:
+                    break
+                if status == BLOB_DONE_CRC_MISMATCH:
+                    return ResponseStatusCode.ERR_E220_CRC_MISMATCH, None
+                return ResponseStatusCode.ERR_E220_PACKET_TOO_BIG, None
+
+            base = _get_int(reply_view, 2, 2)
+            bitmap = _get_int(reply_view, 4, 4)
+            if resumed_chunks is None:
+                resumed_chunks = base
+            # the retries count the timeouts and the windows without progress
+            if (base, bitmap) != progress:
+                progress = (base, bitmap)
+                retries = 0
+            elif frame_size != BLOB_POLL_SIZE:
+                retries += 1
+                if retries > self.max_retries:
+                    return ResponseStatusCode.ERR_E220_TIMEOUT, None
+
+            # the missing chunks of the window, the last one (sent at the top
+            # of the loop, without waiting) asks for the ACK
+            missing = []
+            for index in range(base, min(base + self.window, chunks)):
+                if not bitmap & (1 << (index - base)):
+                    missing.append(index)
+            if not missing:
+                buffer[0] = BLOB_POLL
+                buffer[1] = transfer_id
+                frame_size = BLOB_POLL_SIZE
+                continue
+            for index in missing:
+                offset = index * chunk_size
+                data = view[offset : offset + chunk_size]
+                buffer[0] = BLOB_DATA_ACK if index == missing[-1] else BLOB_DATA
+                buffer[1] = transfer_id
+                _put_int(buffer, 2, index, 2)
+                frame_size = BLOB_DATA_HEADER_SIZE + len(data)
+                buffer[BLOB_DATA_HEADER_SIZE:frame_size] = data
+                sent_chunks += 1
+                if sent[index >> 3] & (1 << (index & 7)):
+                    retransmitted += 1
+                sent[index >> 3] |= 1 << (index & 7)
+                if index == missing[-1]:
+                    break
+                code = self._send_frame(ADDH, ADDL, CHAN, frame_size, True)
+                if code != ResponseStatusCode.E220_SUCCESS:
+                    return code, None
+
+        self._interrupted = None
+        if resumed_chunks is None:
+            # already received
+            resumed_chunks = chunks
+        # the goodput of the bytes sent by this call, from the start to the DONE
+        elapsed = max(1, ticks.ticks_diff(ticks.ticks_ms(), start))
+        goodput = max(0, size - resumed_chunks * chunk_size) * 8000 // elapsed
+        air_bps = AirDataRate.get_bps(self.lora.air_data_rate())
+        self.report = TransferReport(
+            size,
+            chunks,
+            sent_chunks,
+            retransmitted,
+            resumed_chunks,
+            elapsed,
+            goodput,
+            air_bps,
+            goodput * 100 // air_bps,
+        )
+        return ResponseStatusCode.E220_SUCCESS, self.report
+
+
+# The blob receiver reassembles the blobs of a BlobSender in a buffer of
+# max_size bytes allocated once. The chunks received are kept when the
+# transfer is interrupted, so a new start of the same blob (same id, size
+# and CRC32) resumes from them; a different blob restarts the reception.
+class BlobReceiver:
+    def __init__(self, lora, max_size=4096, on_complete=None):
+        self.lora = lora
+        self.max_size = max_size
+        self.on_complete = on_complete
+
+        self.completed = 0
+        self.crc_errors = 0
+
+        self._buffer = bytearray(max_size)
+        self._received = bytearray((max_size + 7) // 8)
+        self._transfer = None
+        self._reply_to = None
+        self._chunk_size = 0
+        self._chunks = 0
+        self._size = 0
+        self._base = 0
+        self._done = False
+
+    def _has(self, index) -> bool:
+        return bool(self._received[index >> 3] & (1 << (index & 7)))
+
+    def _reset(self, transfer, size, chunk_size, chunks):
+        self._transfer = transfer
+        self._size = size
+        self._chunk_size = chunk_size
+        self._chunks = chunks
+        self._base = 0
+        self._done = False
+        for index in range((chunks + 7) // 8):
+            self._received[index] = 0
+
+    def _reply(self, size):
+        ADDH, ADDL, CHAN = self._reply_to
+        return self.lora.send_fixed_into(ADDH, ADDL, CHAN, size, wait=False)
+
+    def _send_ack(self):
+        buffer = self.lora.tx_buffer()
+        bitmap = 0
+        for bit in range(min(BLOB_MAX_WINDOW, self._chunks - self._base)):
+            if self._has(self._base + bit):
+                bitmap |= 1 << bit
+        buffer[0] = BLOB_ACK
+        buffer[1] = self._transfer[0]
+        _put_int(buffer, 2, self._base, 2)
+        _put_int(buffer, 4, bitmap, 4)
+        return self._reply(BLOB_ACK_SIZE)
+
+    def _send_done(self, transfer_id, status):
+        buffer = self.lora.tx_buffer()
+        buffer[0] = BLOB_DONE
+        buffer[1] = transfer_id
+        buffer[2] = status
+        return self._reply(BLOB_DONE_SIZE)
+
+    def _start(self, view):
+        transfer_id = view[1]
+        size = _get_int(view, 2, 4)
+        chunk_size = view[6]
+        crc = _get_int(view, 7, 4)
+        self._reply_to = (view[11], view[12], view[13])
+        if size > self.max_size or chunk_size == 0:
+            self._send_done(transfer_id, BLOB_DONE_TOO_BIG)
+            return
+
+        transfer = (transfer_id, size, crc)
+        if transfer != self._transfer:
+            self._reset(
+                transfer,
+                size,
+                chunk_size,
+                max(1, (size + chunk_size - 1) // chunk_size),
+            )
+        elif self._done:
+            self._send_done(transfer_id, BLOB_DONE_OK)
+            return
+        self._send_ack()
+
+    def _data(self, view, ack):
+        index = _get_int(view, 2, 2)
+        offset = index * self._chunk_size
+        data = view[BLOB_DATA_HEADER_SIZE:]
+        if (
+            index < self._chunks
+            and len(data) == min(self._chunk_size, self._size - offset)
+            and not self._has(index)
+        ):
+            self._buffer[offset : offset + len(data)] = data
+            self._received[index >> 3] |= 1 << (index & 7)
+            while self._base < self._chunks and self._has(self._base):
+                self._base += 1
+
+        if self._base < self._chunks:
+            if ack:
+                self._send_ack()
+            return
+
+        if _crc(memoryview(self._buffer)[: self._size]) != self._transfer[2]:
+            self.crc_errors += 1
+            logger.error("Blob CRC mismatch!")
+            self._send_done(self._transfer[0], BLOB_DONE_CRC_MISMATCH)
+            self._transfer = None
+            return
+        self._done = True
+        self.completed += 1
+        self._send_done(self._transfer[0], BLOB_DONE_OK)
+        if self.on_complete is not None:
+            self.on_complete(self.data())
+
+    # handle a received message, returns False if it is not of a transfer
+    def handle(self, message) -> bool:
+        view = message.payload
+        if len(view) < BLOB_POLL_SIZE or view[0] not in (
+            BLOB_START,
+            BLOB_DATA,
+            BLOB_DATA_ACK,
+            BLOB_POLL,
+        ):
+            return False
+
+        kind = view[0]
+        if kind == BLOB_START:
+            if len(view) >= BLOB_START_SIZE:
+                self._start(view)
+            return True
+        if self._transfer is None or view[1] != self._transfer[0]:
+            return True
+        if kind == BLOB_POLL:
+            if self._done:
+                self._send_done(self._transfer[0], BLOB_DONE_OK)
+            else:
+                self._send_ack()
+        elif not self._done and len(view) >= BLOB_DATA_HEADER_SIZE:
+            self._data(view, kind == BLOB_DATA_ACK)
+        return True
+
+    # the last blob received (a view on the buffer), None while receiving
+    def data(self):
+        if not self._done:
+            return None
+        return memoryview(self._buffer)[: self._size]
+
+    # the messages received that are not of a transfer, see
+    # LoRaE220.messages()
+    def messages(self, timeout=None, max_batch=None, rssi=False):
+        for message in self.lora.messages(timeout, max_batch, rssi):
+            if not self.handle(message):
+                yield message
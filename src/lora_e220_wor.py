@@ -0,0 +1,126 @@
+import adafruit_ticks as ticks
+
+from lora_e220 import Logger
+from lora_e220_operation_constant import ModeType, ResponseStatusCode
+
+logging = Logger(False)
+
+logger = logging.getLogger(__name__)
+
+
+# A WOR receiver parks the module in WOR receiver mode, where it listens only
+# for a short window every WOR period (at a fraction of the current of the
+# normal mode) and receives only the messages sent in WOR transmitter mode
+# (send_wor_* with the same WOR period). The module pulls AUX low before
+# writing a message on the UART, so the host can sleep until then.
+class WorReceiver:
+    def __init__(self, lora, rssi=False, receive_timeout_ms=100):
+        self.lora = lora
+        self.rssi = rssi
+        self.receive_timeout_ms = receive_timeout_ms
+
+        self.listening = False
+        self.wakeups = 0
+
+        self._prev_mode = None
+
+    def start(self) -> ResponseStatusCode:
+        if self.listening:
+            return ResponseStatusCode.E220_SUCCESS
+
+        prev_mode = self.lora.mode
+        code = self.lora.set_mode(ModeType.MODE_2_WOR_RECEIVER)
+        if code == ResponseStatusCode.E220_SUCCESS:
+            self._prev_mode = prev_mode
+            self.listening = True
+        return code
+
+    # back to the previous mode, the module cannot send in WOR receiver mode
+    def stop(self) -> ResponseStatusCode:
+        if not self.listening:
+            return ResponseStatusCode.E220_SUCCESS
+
+        mode = self._prev_mode
+        if mode is None or mode == ModeType.MODE_2_WOR_RECEIVER:
+            mode = ModeType.MODE_0_NORMAL
+        code = self.lora.set_mode(mode)
+        if code == ResponseStatusCode.E220_SUCCESS:
+            self.listening = False
+        return code
+
+    def traffic(self) -> bool:
+        if self.lora.available() > 0:
+            return True
+        return self.lora.aux is not None and self.lora.aux.value == False
+
+    # busy wait for a message, at most timeout ms (None waits forever)
+    def wait(self, timeout=None) -> bool:
+        t = ticks.ticks_ms()
+        while not self.traffic():
+            if timeout is not None and ticks.ticks_diff(ticks.ticks_ms(), t) >= timeout:
+                return False
+        self.wakeups += 1
+        return True
+
+    # light sleep of the host until the module pulls AUX low or timeout ms
+    # have passed; without the AUX pin (or the alarm module) it busy waits
+    def sleep(self, timeout=None) -> bool:
+        if self.lora.aux_pin is None:
+            return self.wait(timeout)
+        try:
+            import alarm
+        except ImportError:
+            return self.wait(timeout)
+
+        if self.traffic():
+            self.wakeups += 1
+            return True
+
+        # the alarm needs the pin, the driver takes it back after the sleep
+        self.lora.release_aux()
+        try:
+            alarms = [alarm.pin.PinAlarm(self.lora.aux_pin, value=False)]
+            if timeout is not None:
+                import time
+
+                alarms.append(
+                    alarm.time.TimeAlarm(
+                        monotonic_time=time.monotonic() + timeout / 1000
+                    )
+                )
+            woken = alarm.light_sleep_until_alarms(*alarms)
+        finally:
+            self.lora.claim_aux()
+
+        if isinstance(woken, alarm.pin.PinAlarm) or self.traffic():
+            self.wakeups += 1
+            return True
+        return False
+
+    # the messages received after a wake up, see LoRaE220.messages()
+    def messages(self, max_batch=None):
+        return self.lora.messages(
+            timeout=self.receive_timeout_ms, max_batch=max_batch, rssi=self.rssi
+        )
+
+    # start listening, then sleep and yield the messages received at every
+    # wake up, at most timeout ms for each sleep (None sleeps until a message)
+    def listen(self, timeout=None, sleep=True):
+        code = self.start()
+        if code != ResponseStatusCode.E220_SUCCESS:
+            logger.error(
+                "WOR receiver mode failed: {}".format(
+                    ResponseStatusCode.get_description(code)
+                )
+            )
+            return
+
+        while True:
+            if sleep:
+                woken = self.sleep(timeout)
+            else:
+                woken = self.wait(timeout)
+            if not woken:
+                return
+            for message in self.messages():
+                yield message